@@ -0,0 +1,56 @@
+"""Per-statement parse latency of a Kestrel huntflow.
+
+Compare parsing with a parser built for every statement (before the parser
+registry) and parsing with the parser shared by the process.
+
+Usage::
+
+    $ python benchmarks/parse_latency.py [number_of_statements]
+
+"""
+
+import sys
+import time
+
+from lark import Lark
+
+from kestrel.deprecating import load_data_file
+from kestrel.syntax.parser import parse_kestrel, _KestrelT
+
+
+def make_huntflow(size):
+    return [
+        (
+            f"p{i} = GET process FROM stixshifter://edr WHERE name = 'cmd{i}.exe'"
+            if i % 2 == 0
+            else f"c{i} = FIND process CREATED p{i-1} WHERE pid > {i}"
+        )
+        for i in range(size)
+    ]
+
+
+def parse_with_new_parser(huntflow):
+    grammar = load_data_file("kestrel.syntax", "kestrel.lark")
+    start = time.perf_counter()
+    for stmt in huntflow:
+        Lark(grammar, parser="lalr", transformer=_KestrelT()).parse(stmt)
+    return (time.perf_counter() - start) / len(huntflow)
+
+
+def parse_with_shared_parser(huntflow):
+    # build the shared parser before timing
+    parse_kestrel(huntflow[0])
+    start = time.perf_counter()
+    for stmt in huntflow:
+        parse_kestrel(stmt)
+    return (time.perf_counter() - start) / len(huntflow)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    huntflow = make_huntflow(size)
+    before = parse_with_new_parser(huntflow)
+    after = parse_with_shared_parser(huntflow)
+    print(f"statements: {size}")
+    print(f"per-statement parse latency before: {before*1000:.3f} ms")
+    print(f"per-statement parse latency after:  {after*1000:.3f} ms")
@@ -18,20 +18,20 @@
 #     - a table that can be imported to pandas dataframe
 ################################################################
 
+import copy
 import functools
 import logging
 import re
 import itertools
+import uuid
 from collections import OrderedDict
 
 from firepit.deref import auto_deref
 from firepit.exceptions import InvalidAttr, UnknownViewname
 from firepit.query import (
-    Aggregation,
     Column,
     Limit,
     Filter,
-    Group,
     Offset,
     Order,
     Predicate,
@@ -42,7 +42,6 @@ from firepit.query import (
 )
 from firepit.stix20 import summarize_pattern
 
-from kestrel.utils import remove_empty_dicts, dedup_ordered_dicts
 from kestrel.exceptions import *
 from kestrel.symboltable.variable import new_var
 from kestrel.syntax.utils import (
@@ -50,10 +49,15 @@ from kestrel.syntax.utils import (
     get_all_input_var_names,
 )
 from kestrel.codegen.data import load_data, load_data_file, dump_data_to_file
-from kestrel.codegen.display import DisplayDataframe, DisplayDict, DisplayWarning
+from kestrel.codegen.indexes import RELATION_TABLE_INDEXES
+from kestrel.codegen.queries import SQLQuery
+from kestrel.codegen.display import (
+    DisplayDict,
+    DisplayPagedDataframe,
+    DisplayWarning,
+)
 from kestrel.codegen.relations import (
     generic_relations,
-    get_entity_id_attribute,
 )
 from kestrel.codegen.prefetch import do_prefetch
 from kestrel.codegen.queries import (
@@ -94,10 +98,10 @@ def _skip_command_if_empty_input(func):
         if not var_names:
             return func(stmt, session)
         elif any(
-            [
-                session.symtable[v].length + session.symtable[v].records_count
-                for v in var_names
-            ]
+            session.symtable[v].is_deferred
+            or session.symtable[v].length
+            or session.symtable[v].records_count
+            for v in var_names
         ):
             return func(stmt, session)
         elif "output" in stmt:
@@ -127,6 +131,10 @@ def _debug_logger(func):
 @_default_output
 @_skip_command_if_empty_input
 def assign(stmt, session):
+    if not stmt.get("transformer") and _is_lazy_output(stmt, session):
+        var_struct = _defer_query(stmt, session)
+        if var_struct is not None:
+            return var_struct, None
     entity_table = session.symtable[stmt["input"]].entity_table
     transform = stmt.get("transformer")
     if transform:
@@ -157,20 +165,29 @@ def merge(stmt, session):
 @_default_output
 def new(stmt, session):
     stmt["type"] = load_data(session.store, stmt["output"], stmt["data"], stmt["type"])
+    session.index_advisor.advise()
 
 
 @_debug_logger
 @_default_output
 def load(stmt, session):
     stmt["type"] = load_data_file(
-        session.store, stmt["output"], stmt["path"], stmt["type"]
+        session.store,
+        stmt["output"],
+        stmt["path"],
+        stmt["type"],
+        session.config["session"]["data_batch_size"],
     )
+    session.index_advisor.advise()
 
 
 @_debug_logger
 def save(stmt, session):
     dump_data_to_file(
-        session.store, session.symtable[stmt["input"]].entity_table, stmt["path"]
+        session.store,
+        session.symtable[stmt["input"]].entity_table,
+        stmt["path"],
+        session.config["session"]["data_batch_size"],
     )
     return None, None
 
@@ -211,6 +228,11 @@ def info(stmt, session):
     disp["Dependent Variables"] = ", ".join(
         session.symtable[stmt["input"]].dependent_variables
     )
+    disp["Store Indexes"] = ", ".join(
+        f"{table} ({', '.join(columns)})"
+        for table in [session.symtable[stmt["input"]].type, *RELATION_TABLE_INDEXES]
+        for columns in session.index_advisor.get_indexes(table)
+    )
 
     return None, DisplayDict(disp)
 
@@ -226,15 +248,62 @@ def disp(stmt, session):
         qry = Query(entity_table)
 
     qry = _build_query(session.store, entity_table, qry, stmt)
+
+    # PostgreSQL rejects ORDER BY on columns not in SELECT DISTINCT
+    # so the rows are deduplicated in the display object in that case
+    if qry.order and session.store.dialect == "postgresql":
+        dedup_in_sql = False
+    else:
+        dedup_in_sql = True
+        qry.append(Unique())
+
+    # the results are kept in a temporary table before later statements
+    # change the variable, and pages are fetched from it in the query order
+    # until the session executes other statements
+    limit = stmt.get("limit")
+    offset = stmt.get("offset")
+    if limit:
+        qry.limit = Limit(limit)
+    if offset:
+        qry.offset = Offset(offset)
+    text, values = qry.render(session.store.placeholder, session.store.dialect)
+    snapshot = f"__disp_{uuid.uuid4().hex}"
     try:
-        cursor = session.store.run_query(qry)
+        session.store.run_query(
+            SQLQuery(f'CREATE TEMP TABLE "{snapshot}" AS {text}', values, snapshot)
+        ).close()
     except InvalidAttr as e:
         var_attr = str(e).split()[-1]
         var_name, _, attr = var_attr.rpartition(".")
         raise MissingEntityAttribute(var_name, attr) from e
-    content = cursor.fetchall()
+    session.display_snapshots.append(snapshot)
+    row_order = "ctid" if session.store.dialect == "postgresql" else "rowid"
+
+    def fetch_page(page_offset, page_size):
+        if snapshot not in session.display_snapshots:
+            raise DisplayExpired("DISP results fetched")
+        ph = session.store.placeholder
+        cursor = session.store.run_query(
+            SQLQuery(
+                f'SELECT * FROM "{snapshot}" ORDER BY {row_order}'
+                f" LIMIT {ph} OFFSET {ph}",
+                (page_size, page_offset),
+                snapshot,
+            )
+        )
+        rows = cursor.fetchall()
+        if len(rows) < page_size:
+            # last page
+            session.drop_display_snapshots([snapshot])
+        return rows
+
+    display = DisplayPagedDataframe(
+        fetch_page,
+        session.config["session"]["display_page_size"],
+        not dedup_in_sql,
+    )
 
-    return None, DisplayDataframe(dedup_ordered_dicts(remove_empty_dicts(content)))
+    return None, display
 
 
 @_debug_logger
@@ -244,46 +313,34 @@ def describe(stmt, session):
     attribute = stmt["attribute"]
     schema = {i["name"]: i["type"] for i in session.store.schema(entity_table)}
     attr_type = schema[attribute].lower()
-
-    result = OrderedDict()
-
-    qry = Query(entity_table)
-    if attr_type in ("integer", "bigint", "numeric"):
-        qry.append(
-            Aggregation(
-                [
-                    ("COUNT", attribute, "count"),
-                    ("AVG", attribute, "mean"),
-                    ("MIN", attribute, "min"),
-                    ("MAX", attribute, "max"),
-                ]
-            )
-        )
-    else:
-        qry.append(
-            Aggregation(
-                [("COUNT", attribute, "count"), ("NUNIQUE", attribute, "unique")]
-            )
-        )
-        cursor = session.store.run_query(qry)
-        content = cursor.fetchall()[0]
-        result.update(content)
-
-        # Need second query for top and freq
-        qry = Query(
-            [
-                Table(entity_table),
-                Group([Column(attribute, alias="top")]),
-                Aggregation([("COUNT", "*", "freq")]),
-                Order([("freq", Order.DESC)]),
-                Limit(1),
-            ]
-        )
-
+    config = session.config["describe"]
+    var_struct = session.symtable[stmt["input"]]
+
+    # the entity table can be sampled for views of its entities
+    sample_table = var_struct.type if "id" in schema else None
+    if sample_table and attribute not in session.store.columns(sample_table):
+        sample_table = None
+
+    qry = _build_describe_query(
+        session.store,
+        entity_table,
+        attribute,
+        attr_type in ("integer", "bigint", "numeric"),
+        config["percentiles"],
+        config["sample_size"] if config["approximate"] else None,
+        len(var_struct),
+        sample_table,
+    )
     cursor = session.store.run_query(qry)
     content = cursor.fetchall()[0]
 
-    result.update(content)
+    result = OrderedDict()
+    for key, value in content.items():
+        if key.startswith("percentile_"):
+            key = f'{config["percentiles"][int(key.rpartition("_")[2])] * 100:g}%'
+        result[key] = value
+    if config["approximate"]:
+        result["sample_size"] = config["sample_size"]
 
     return None, DisplayDict(result)
 
@@ -316,10 +373,15 @@ def get(stmt, session):
 
     elif "datasource" in stmt:
         # rs: RetStruct
-        rs = session.data_source_manager.query(
-            stmt["datasource"], pattern, session.session_id, session.store, limit
+        rs = session.data_source_manager.query_shards(
+            stmt["datasource"],
+            stmt["stixpattern_shards"],
+            session.session_id,
+            session.store,
+            limit,
         )
         query_id = rs.load_to_store(session.store)
+        session.index_advisor.advise()
         session.store.extract(local_var_table, return_type, query_id, pattern)
         local_stage_varstruct = new_var(
             session.store, local_var_table, [], stmt, session.symtable
@@ -331,7 +393,7 @@ def get(stmt, session):
         # TODO: add a ECGP method to do this directly
         pat_summary = summarize_pattern(pattern)
 
-        local_stage_var_entity_id = get_entity_id_attribute(local_stage_varstruct)
+        local_stage_var_entity_id = local_stage_varstruct.entity_id_attribute
         if (
             pat_summary
             and return_type in pat_summary  # allow extended subgraph
@@ -389,7 +451,10 @@ def find(stmt, session):
         if stmt["relation"] in generic_relations:
             _logger.debug("Compiling query for generic relation '%s'", stmt["relation"])
             rel_query = compile_generic_relation_to_query(
-                return_type, input_type, session.symtable[stmt["input"]].entity_table
+                return_type,
+                input_type,
+                session.symtable[stmt["input"]].entity_table,
+                session.store.dialect,
             )
 
         else:
@@ -456,6 +521,10 @@ def group(stmt, session):
 @_default_output
 @_skip_command_if_empty_input
 def sort(stmt, session):
+    if _is_lazy_output(stmt, session):
+        var_struct = _defer_query(stmt, session)
+        if var_struct is not None:
+            return var_struct, None
     entity_table = session.symtable[stmt["input"]].entity_table
     qry = _build_query(session.store, entity_table, Query(entity_table), stmt, [])
     session.store.assign_query(stmt["output"], qry)
@@ -561,6 +630,134 @@ def _build_query(store, entity_table, qry, stmt, paths=None):
     return qry
 
 
+def _is_lazy_output(stmt, session):
+    # lazy variables only take new names: no existing view depending on the
+    # name is stale while the view of the lazy variable is not created
+    return (
+        session.config["session"]["lazy_evaluation"]
+        and stmt["output"] not in session.symtable
+    )
+
+
+def _defer_query(stmt, session):
+    # create a lazy variable with the query of an ASSIGN/SORT statement
+    #   - if the input variable is lazy, not fused before, and not limited,
+    #     the query is fused with its deferred query into one query on the
+    #     same table in the store
+    #   - otherwise, the query is on the view of the input variable
+    # return None if the query changes the attributes of the input
+    input_var = session.symtable[stmt["input"]]
+    base_qry = input_var.deferred_query
+    if base_qry is None or input_var.fused_count or base_qry.limit or base_qry.offset:
+        base_qry = None
+        entity_table = input_var.entity_table
+    else:
+        entity_table = base_qry.table.name
+
+    # _build_query() anchors the WHERE clause to the table
+    stmt = copy.deepcopy(stmt)
+    qry = _build_query(session.store, entity_table, Query(entity_table), stmt, [])
+    if qry.joins or (qry.proj and qry.proj.cols):
+        return None
+
+    if base_qry:
+        input_var.fused_count += 1
+        qry.where = base_qry.where + qry.where
+        if not stmt.get("attribute"):
+            # no new order: keep the order of the input
+            qry.order = base_qry.order
+
+    var_struct = new_var(session.store, stmt["output"], [], stmt, session.symtable)
+    var_struct.defer(qry)
+    return var_struct
+
+
+def _build_describe_query(
+    store,
+    entity_table,
+    attribute,
+    is_numeric,
+    percentiles,
+    sample_size,
+    row_count=None,
+    sample_table=None,
+):
+    # all statistics of an attribute in one query, i.e., one pass of the table
+    # - numeric: count, mean, min, max, and nearest-rank percentiles
+    # - others: count, unique, top, freq
+    # if sample_size is given, compute statistics on a sample of about
+    # sample_size of the row_count rows, and estimate count from the
+    # fraction of sampled rows with the attribute
+    # - PostgreSQL: TABLESAMPLE of sample_table, the entity table of the view
+    # - SQLite (views have no rowid to sample): rows of the view passing a
+    #   random filter in one pass
+    # percentiles are named by position, e.g., "percentile_0", since "%" in
+    # names is a format marker with PostgreSQL placeholders
+    attr = '"' + attribute.replace('"', '""') + '"'
+    table = '"' + entity_table.replace('"', '""') + '"'
+    ph = store.placeholder
+    prefix = ""
+    values = tuple()
+    if sample_size:
+        if store.dialect == "postgresql" and sample_table:
+            percent = (
+                min(100.0, 100.0 * sample_size / row_count) if row_count else 100.0
+            )
+            sample_table = '"' + sample_table.replace('"', '""') + '"'
+            sample = (
+                f'SELECT {attr} AS "x" FROM {sample_table}'
+                f" TABLESAMPLE BERNOULLI ({percent})"
+                f' WHERE "id" IN (SELECT "id" FROM {table})'
+            )
+            values = (sample_size, row_count)
+        else:
+            sample = (
+                f'SELECT {attr} AS "x" FROM {table}'
+                f" WHERE ABS(RANDOM()) % {ph} < {ph}"
+            )
+            values = (row_count, sample_size, sample_size, row_count)
+        prefix = f'WITH "sample" AS ({sample} LIMIT {ph}) '
+        source = '(SELECT "x" FROM "sample" WHERE "x" IS NOT NULL) AS "v"'
+        count = (
+            "(SELECT COALESCE(CAST(ROUND("
+            f'1.0 * COUNT("x") * {ph} / NULLIF(COUNT(*), 0)) AS BIGINT), 0)'
+            ' FROM "sample") AS "count"'
+        )
+    else:
+        source = f'(SELECT {attr} AS "x" FROM {table} WHERE {attr} IS NOT NULL) AS "v"'
+        count = 'COUNT(*) AS "count"'
+
+    if is_numeric:
+        aggs = [count, 'AVG("x") AS "mean"', 'MIN("x") AS "min"', 'MAX("x") AS "max"']
+        if percentiles:
+            for i, p in enumerate(percentiles):
+                if not 0 <= p <= 1:
+                    raise InvalidConfiguration(
+                        f'percentile "{p}" in DESCRIBE configuration not in [0, 1]',
+                        "use percentiles between 0 and 1, e.g., 0.25, 0.5, 0.75",
+                    )
+                aggs.append(
+                    f'MIN(CASE WHEN "rn" >= {float(p)} * "n" THEN "x" END) AS "percentile_{i}"'
+                )
+            source = (
+                f'(SELECT "x", ROW_NUMBER() OVER (ORDER BY "x") AS "rn",'
+                f' COUNT(*) OVER () AS "n" FROM {source}) AS "ranked"'
+            )
+        text = f"{prefix}SELECT {', '.join(aggs)} FROM {source}"
+    else:
+        if not sample_size:
+            count = 'COALESCE(CAST(SUM("freq") AS BIGINT), 0) AS "count"'
+        text = (
+            f'{prefix}SELECT {count}, COUNT(*) AS "unique",'
+            ' MAX(CASE WHEN "rn" = 1 THEN "x" END) AS "top", MAX("freq") AS "freq"'
+            ' FROM (SELECT "x", "freq", ROW_NUMBER() OVER (ORDER BY "freq" DESC, "x") AS "rn"'
+            f' FROM (SELECT "x", COUNT(*) AS "freq" FROM {source} GROUP BY "x") AS "g"'
+            ') AS "ranked"'
+        )
+
+    return SQLQuery(text, values, entity_table)
+
+
 def _transform_query(store, entity_table, transform):
     if transform.lower() == "timestamped":
         qry = store.timestamped(entity_table, run=False)
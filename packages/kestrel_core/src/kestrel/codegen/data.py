@@ -1,11 +1,33 @@
+import bz2
+import contextlib
 import csv
+import gzip
+import itertools
 import json
+import lzma
 import pathlib
+import re
 import uuid
+import zipfile
 
+import ijson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from firepit.deref import auto_deref
+from firepit.query import Column, Order, Query
 
-from kestrel.exceptions import MissingEntityType, NonUniformEntityType
+from kestrel.exceptions import EmptyInputData, MissingEntityType, NonUniformEntityType
+
+# Arrow types of SQL column types for streaming SAVE
+# other columns, e.g., NUMERIC in PostgreSQL, are inferred from the data
+SQL_TO_ARROW_TYPES = {
+    "integer": pa.int64(),
+    "bigint": pa.int64(),
+    "real": pa.float64(),
+    "double precision": pa.float64(),
+    "text": pa.string(),
+}
 
 
 def load_data(
@@ -32,37 +54,204 @@ def load_data(
     return entity_type
 
 
-def load_data_file(store, output_entity_table, file_path, input_entity_type=None):
+def load_data_file(
+    store, output_entity_table, file_path, input_entity_type=None, batch_size=65536
+):
+    # stream the file in chunks of batch_size records into the store
     dump_format = _get_dump_format(file_path)
+    query_id = str(uuid.uuid5(uuid.NAMESPACE_URL, str(file_path)))
+    entity_type = None
     if dump_format == "csv":
-        data = pd.read_csv(file_path)
+        try:
+            reader = pd.read_csv(file_path, chunksize=batch_size)
+        except pd.errors.EmptyDataError:
+            reader = contextlib.nullcontext([])
+        with reader as chunks:
+            entity_type = _load_chunks(
+                store, output_entity_table, chunks, input_entity_type, query_id
+            )
     elif dump_format == "parquet":
-        data = pd.read_parquet(file_path)
+        batches = pq.ParquetFile(file_path).iter_batches(batch_size=batch_size)
+        chunks = (batch.to_pandas() for batch in batches)
+        entity_type = _load_chunks(
+            store, output_entity_table, chunks, input_entity_type, query_id
+        )
     elif dump_format == "json":
-        with open(file_path) as input_file:
-            data = json.load(input_file)
-    query_id = str(uuid.uuid5(uuid.NAMESPACE_URL, str(file_path)))
-    entity_type = load_data(
-        store, output_entity_table, data, input_entity_type, query_id
-    )
+        with open(file_path, "rb") as input_file:
+            chunks = _iter_json_chunks(input_file, batch_size)
+            entity_type = _load_chunks(
+                store, output_entity_table, chunks, input_entity_type, query_id
+            )
+    if not entity_type:
+        raise EmptyInputData(file_path)
     return entity_type
 
 
-def dump_data_to_file(store, input_entity_table, file_path):
+def dump_data_to_file(store, input_entity_table, file_path, batch_size=65536):
     p = pathlib.Path(file_path)
     p.parent.mkdir(parents=True, exist_ok=True)
-
-    input_data = store.lookup(input_entity_table) if input_entity_table else []
-    df = pd.DataFrame(input_data)
     dump_format = _get_dump_format(p)
+
+    if not input_entity_table:
+        batches = iter([])
+    else:
+        batches = _iter_record_batches(store, input_entity_table, batch_size)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        # nothing to stream
+        df = pd.DataFrame([])
+        if dump_format == "csv":
+            df.to_csv(file_path, index=False, quoting=csv.QUOTE_NONNUMERIC)
+        elif dump_format == "parquet":
+            df.to_parquet(file_path)
+        elif dump_format == "json":
+            with open(file_path, "w") as output_file:
+                output_file.write(df.to_json(orient="records"))
+        return
+
+    batches = itertools.chain([first_batch], batches)
     if dump_format == "csv":
-        df.to_csv(file_path, index=False, quoting=csv.QUOTE_NONNUMERIC)
+        # written by pandas with the quoting of previous versions
+        with _open_compressed_output(p) as output_file:
+            header = True
+            for batch in batches:
+                records = batch.to_pandas().to_csv(
+                    index=False, header=header, quoting=csv.QUOTE_NONNUMERIC
+                )
+                output_file.write(records.encode())
+                header = False
     elif dump_format == "parquet":
-        df.to_parquet(file_path)
+        with pq.ParquetWriter(file_path, first_batch.schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
     elif dump_format == "json":
-        data = df.to_json(orient="records")
         with open(file_path, "w") as output_file:
-            output_file.write(data)
+            separator = "["
+            for batch in batches:
+                records = batch.to_pandas().to_json(orient="records")
+                output_file.write(separator + records[1:-1])
+                separator = ","
+            output_file.write("]")
+
+
+def _load_chunks(store, output_entity_table, chunks, input_entity_type, query_id):
+    # load chunks of records under one query_id with entity types checked
+    # across chunks; the output view is replaced only after all chunks are
+    # loaded, so the variable is intact if the entity types are not uniform
+    # return None without any record loaded
+    loading_table = f"{output_entity_table}_loading_{uuid.uuid4().hex[:8]}"
+    entity_type = None
+    try:
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            chunk_entity_type = load_data(
+                store, loading_table, chunk, input_entity_type, query_id
+            )
+            if entity_type and chunk_entity_type != entity_type:
+                raise NonUniformEntityType([entity_type, chunk_entity_type])
+            entity_type = chunk_entity_type
+    except Exception:
+        store.remove_view(loading_table)
+        raise
+    if entity_type:
+        store.rename_view(loading_table, output_entity_table)
+    return entity_type
+
+
+def _iter_json_chunks(input_file, chunk_size):
+    # stream items of a JSON array in lists of chunk_size items
+    # other JSON documents, e.g., an object of columns, are loaded as a whole
+    head = input_file.read(1024).lstrip()
+    input_file.seek(0)
+    if not head.startswith(b"["):
+        yield json.load(input_file)
+        return
+    items = ijson.items(input_file, "item", use_float=True)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def _iter_record_batches(store, entity_table, batch_size):
+    # stream the records of a variable (as store.lookup() does) from the store
+    # cursor in Arrow record batches with a schema fixed by the first batch
+    qry = Query(entity_table)
+    joins, proj = auto_deref(store, entity_table)
+    if joins:
+        qry.extend(joins)
+    if proj:
+        qry.append(proj)
+    # preserve the original sort order like store.lookup()
+    viewdef = store._get_view_def(entity_table)
+    match = re.search(r"ORDER BY \"([a-z0-9:'\._\-]*)\" (ASC|DESC)$", viewdef)
+    if match:
+        if "_ref." in match.group(1):
+            sort = (match.group(1), match.group(2))
+        else:
+            sort = (Column(match.group(1), entity_table), match.group(2))
+        qry.append(Order([sort]))
+    arrow_types = _get_arrow_types(store, entity_table)
+    if proj:
+        # types of dereferenced attributes from the tables joined
+        tables = {join.alias: join.name for join in joins}
+        for col in proj.cols:
+            if getattr(col, "table", None) in tables:
+                table_types = _get_arrow_types(store, tables[col.table])
+                arrow_types[col.alias] = table_types.get(col.name)
+    entity_type = store.table_type(entity_table) or entity_table
+
+    cursor = store.run_query(qry)
+    schema = None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            row["type"] = entity_type
+        if not schema:
+            fields = []
+            for name in rows[0]:
+                arrow_type = arrow_types.get(name)
+                if not arrow_type:
+                    arrow_type = pa.array([row[name] for row in rows]).type
+                    if pa.types.is_null(arrow_type):
+                        arrow_type = pa.string()
+                fields.append(pa.field(name, arrow_type))
+            schema = pa.schema(fields)
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+def _get_arrow_types(store, table):
+    return {
+        c["name"]: SQL_TO_ARROW_TYPES.get(c["type"].lower())
+        for c in store.schema(table)
+    }
+
+
+@contextlib.contextmanager
+def _open_compressed_output(path):
+    # binary output stream with compression by suffix as in pandas
+    suffix = path.suffixes[-1]
+    if suffix == ".gz":
+        output_file = gzip.open(path, "wb")
+    elif suffix == ".bz2":
+        output_file = bz2.open(path, "wb")
+    elif suffix == ".xz":
+        output_file = lzma.open(path, "wb")
+    elif suffix == ".zip":
+        archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        output_file = archive.open(path.stem, "w")
+    else:
+        output_file = open(path, "wb")
+    try:
+        yield output_file
+    finally:
+        output_file.close()
+        if suffix == ".zip":
+            archive.close()
 
 
 def _extract_uniform_type(dataframe, input_entity_type):
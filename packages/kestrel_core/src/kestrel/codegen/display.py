@@ -4,6 +4,7 @@ from io import StringIO
 import json
 
 from kestrel.exceptions import KestrelInternalError
+from kestrel.utils import remove_empty_dicts
 
 
 class AbstractDisplay(ABC):
@@ -52,8 +53,75 @@ class DisplayDataframe(AbstractDisplay):
         return msg
 
 
+class DisplayPagedDataframe(DisplayDataframe):
+    """Dataframe display with rows fetched lazily in pages.
+
+    The first page is fetched when the object is created. Other pages are
+    fetched on demand by :meth:`fetch_next_page` or :meth:`iter_pages`, and
+    all pages are fetched for :attr:`dataframe`. :meth:`to_html` only renders
+    the pages fetched, at least the first page.
+
+    Args:
+        fetch_page: function ``(offset, limit)`` returning a list of rows.
+        page_size (int): number of rows per page.
+        dedup (bool): whether to remove duplicated rows across pages if not
+          already done in the query.
+    """
+
+    def __init__(self, fetch_page, page_size, dedup=False):
+        self._fetch_page = fetch_page
+        self.page_size = page_size
+        self.pages = []
+        self.is_complete = False
+        self._offset = 0
+        self._seen = set() if dedup else None
+        self.fetch_next_page()
+
+    @property
+    def dataframe(self):
+        return DataFrame([row for page in self.iter_pages() for row in page])
+
+    def fetch_next_page(self):
+        """Fetch the next page.
+
+        Returns:
+            list: rows of the page, empty if all pages are fetched.
+        """
+        if self.is_complete:
+            return []
+        # one more row to know if this is the last page
+        rows = self._fetch_page(self._offset, self.page_size + 1)
+        if len(rows) <= self.page_size:
+            self.is_complete = True
+        rows = rows[: self.page_size]
+        self._offset += len(rows)
+        rows = remove_empty_dicts(rows)
+        if self._seen is not None:
+            rows = [row for row in rows if self._is_unseen(row)]
+        self.pages.append(rows)
+        return rows
+
+    def iter_pages(self):
+        yield from self.pages[:]
+        while not self.is_complete:
+            yield self.fetch_next_page()
+
+    def to_html(self):
+        fetched = DataFrame([row for page in self.pages for row in page])
+        html = DisplayDataframe(fetched).to_html()
+        if not self.is_complete:
+            html += f"<p>First {len(fetched)} rows displayed.</p>"
+        return html
+
+    def _is_unseen(self, row):
+        s = str(row)
+        is_unseen = s not in self._seen
+        self._seen.add(s)
+        return is_unseen
+
+
 class DisplayBlockSummary(DisplayDataframe):
-    def __init__(self, vars_summary, exec_time_sec):
+    def __init__(self, vars_summary, exec_time_sec, notes=None):
         self.vars_summary = vars_summary
         self.footnotes = []
         self.exec_time_sec = exec_time_sec
@@ -62,6 +130,9 @@ class DisplayBlockSummary(DisplayDataframe):
             summaries.append(summary)
             if footnote and footnote not in self.footnotes:
                 self.footnotes.append(footnote)
+        # notes on the block execution, e.g., cache savings
+        if notes:
+            self.footnotes.extend(notes)
         super().__init__(summaries)
         self.exec_time_str = self._cal_exec_time(exec_time_sec)
 
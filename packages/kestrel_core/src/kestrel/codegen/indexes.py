@@ -0,0 +1,108 @@
+import logging
+
+from firepit.exceptions import UnknownViewname
+
+from kestrel.codegen.queries import SQLQuery, get_contains_target_type
+from kestrel.codegen.relations import (
+    stix_2_0_identical_mapping,
+    stix_2_0_ref_mapping,
+)
+
+_logger = logging.getLogger(__name__)
+
+# covering indexes of the join keys in relation queries on firepit tables
+# - __contains: observations of entities in generic relations and process time
+#   lookup; entities of a type in observations, partitioned by the entity type
+#   of target_ref (key "target_type") for generic relations
+# - __reflist: specific relations with reference lists, filtered by ref_name
+# - __queries: views extracted by query_id
+# - observed-data: first/last observed time of process records
+RELATION_TABLE_INDEXES = {
+    "__contains": [
+        ("target_ref", "source_ref"),
+        ("target_type", "source_ref", "target_ref"),
+    ],
+    "__reflist": [
+        ("source_ref", "ref_name", "target_ref"),
+        ("target_ref", "ref_name", "source_ref"),
+    ],
+    "__queries": [("query_id", "sco_id"), ("sco_id", "query_id")],
+    "observed-data": [("id", "first_observed", "last_observed")],
+}
+
+
+def _get_entity_references():
+    # single references of each entity type in specific relations
+    # reference lists are joined through __reflist instead
+    references = {}
+    for (entity_x, _, entity_y), refs in stix_2_0_ref_mapping.items():
+        for entity_type, ref_names in zip((entity_x, entity_y), refs):
+            references.setdefault(entity_type, set()).update(
+                ref_name for ref_name in ref_names if ref_name.endswith("_ref")
+            )
+    return references
+
+
+ENTITY_REFERENCES = _get_entity_references()
+
+
+class IndexAdvisor:
+    """Indexes on the join keys of Kestrel queries in the store.
+
+    After data is ingested to the store, :meth:`advise` ensures the indexes
+    exist for the joins of relation queries: covering indexes on the firepit
+    relation tables, and indexes on the identifier attributes and single
+    references of entity tables. Indexes already created are skipped, and new
+    columns brought by the data are indexed as they appear.
+
+    Attributes:
+        indexes (dict): the columns of each index created by table.
+    """
+
+    def __init__(self, store):
+        self.indexes = {}
+        self._store = store
+
+    def advise(self):
+        """Create the indexes missing on the tables in the store."""
+        for table, indexes in RELATION_TABLE_INDEXES.items():
+            for columns in indexes:
+                self._ensure_index(table, columns)
+
+        for entity_type in self._store.types():
+            if entity_type in RELATION_TABLE_INDEXES:
+                continue
+            candidates = list(stix_2_0_identical_mapping.get(entity_type, ()))
+            candidates += sorted(ENTITY_REFERENCES.get(entity_type, ()))
+            existing_columns = self._store.columns(entity_type)
+            for column in candidates:
+                if column in existing_columns:
+                    self._ensure_index(entity_type, (column,))
+
+    def get_indexes(self, table):
+        """Get the columns of each index created on a table."""
+        return self.indexes.get(table, [])
+
+    def _ensure_index(self, table, columns):
+        if columns in self.get_indexes(table):
+            return
+        name = "_".join([table] + [c.replace(".", "_") for c in columns]) + "_kidx"
+        column_list = ", ".join(map(self._get_index_key, columns))
+        query = SQLQuery(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})',
+            (),
+            table,
+        )
+        try:
+            self._store.run_query(query).close()
+        except UnknownViewname:
+            # table not created in the store yet
+            return
+        _logger.debug(f'index "{name}" created on {table}')
+        self.indexes.setdefault(table, []).append(columns)
+
+    def _get_index_key(self, column):
+        if column == "target_type":
+            return get_contains_target_type("target_ref", self._store.dialect)
+        else:
+            return f'"{column}"'
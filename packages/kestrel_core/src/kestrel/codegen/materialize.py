@@ -0,0 +1,185 @@
+import logging
+import re
+import uuid
+from collections import OrderedDict
+
+from kestrel.codegen.queries import SQLQuery
+
+_logger = logging.getLogger(__name__)
+
+
+class MaterializedViews:
+    """Promotion of frequently used variables to materialized tables.
+
+    The view of a variable is evaluated by the store every time the variable
+    is used. Each use of a variable is recorded with the execution time of the
+    command using it. Once a variable is used ``min_references`` times costing
+    ``min_cost`` seconds in total, its view is evaluated once into a table
+    indexed on ``id`` and the entity identifier attribute, and the view is
+    redefined to read the table. Tables take at most ``disk_budget`` MB in the
+    store; the least recently used ones are evicted to fit a new table. The
+    thresholds are read from the ``materialization`` config section at use.
+
+    Evicted or released tables are dropped and their views are restored to
+    the original definitions, so materialization is transparent to commands.
+
+    Attributes:
+        promotions (int): number of variables promoted to tables.
+
+        evictions (int): number of tables evicted for the disk budget.
+    """
+
+    def __init__(self, store, config):
+        self.promotions = 0
+        self.evictions = 0
+        self._store = store
+        self._config = config
+        # table names unique to the session in a store shared by sessions
+        self._suffix = uuid.uuid4().hex[:8]
+        # {view: {"var": VarStruct, "references": int, "cost": float, "promotable": bool}}
+        self._usage = {}
+        # {view: (table, original view definition, entity type, size)}
+        # in least recently used order
+        self._tables = OrderedDict()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, view):
+        return view in self._tables
+
+    @property
+    def _disk_budget(self):
+        return self._config["disk_budget"] * 2**20
+
+    @property
+    def disk_usage(self):
+        """int: bytes taken by the materialized tables and their indexes."""
+        return sum(size for _, _, _, size in self._tables.values())
+
+    def record(self, var_struct, cost):
+        """Record a use of a variable and promote it once it is hot.
+
+        Args:
+            var_struct (VarStruct): the variable used by a command.
+
+            cost (float): execution time of the command in seconds.
+        """
+        if not self._disk_budget or var_struct.is_deferred:
+            return
+        view = var_struct.entity_table
+        if not view:
+            return
+        if view in self._tables:
+            self._tables.move_to_end(view)
+            return
+
+        usage = self._usage.get(view)
+        if not usage or usage["var"] is not var_struct:
+            usage = {
+                "var": var_struct,
+                "references": 0,
+                "cost": 0.0,
+                "promotable": True,
+            }
+            self._usage[view] = usage
+        usage["references"] += 1
+        usage["cost"] += cost
+
+        if (
+            usage["promotable"]
+            and usage["references"] >= self._config["min_references"]
+            and usage["cost"] >= self._config["min_cost"]
+        ):
+            usage["promotable"] = self._promote(view, var_struct)
+
+    def release(self, view):
+        """Restore the view of a variable to be redefined by a command."""
+        self._usage.pop(view, None)
+        if view in self._tables:
+            self._demote(view)
+
+    def release_all(self):
+        """Restore all views, e.g., before new data is loaded to the store."""
+        self._usage.clear()
+        for view in list(self._tables):
+            self._demote(view)
+
+    def _promote(self, view, var_struct):
+        viewdef = self._store._get_view_def(view)
+        table = f"__mv_{view}_{self._suffix}"
+        if viewdef == f'SELECT * FROM "{view}"':
+            # already a table in the store
+            return False
+
+        try:
+            self._run(f'DROP TABLE IF EXISTS "{table}"', table)
+            # column types declared as in the view, e.g., for DESCRIBE and SAVE
+            schema = self._store.schema(view)
+            columns = [c["name"] for c in schema]
+            definitions = ", ".join(f'"{c["name"]}" {c["type"]}' for c in schema)
+            self._run(f'CREATE TABLE "{table}" ({definitions})', table)
+            self._run(f'INSERT INTO "{table}" SELECT * FROM "{view}"', table)
+            indexes = []
+            for attribute in dict.fromkeys(["id", var_struct.entity_id_attribute]):
+                if attribute in columns:
+                    index = f"{table}_{attribute}_idx"
+                    self._run(
+                        f'CREATE INDEX "{index}" ON "{table}" ("{attribute}")', table
+                    )
+                    indexes.append(index)
+            size = self._table_size(table, indexes)
+        except Exception as e:
+            _logger.warning(f"cannot materialize variable view {view}: {e}")
+            self._run(f'DROP TABLE IF EXISTS "{table}"', table)
+            return False
+
+        if size > self._disk_budget:
+            _logger.debug(f"view {view} of {size} bytes exceeds materialization budget")
+            self._run(f'DROP TABLE "{table}"', table)
+            return False
+
+        while self._tables and self.disk_usage + size > self._disk_budget:
+            evicted = next(iter(self._tables))
+            _logger.debug(f"evict materialized view {evicted}")
+            self._demote(evicted)
+            self.evictions += 1
+
+        # keep the trailing sort of the view for commands reading the order
+        match = re.search(r" ORDER BY \"([a-z0-9:'\._\-]*)\" (ASC|DESC)$", viewdef)
+        order = match.group(0) if match else ""
+        self._redefine(view, f'SELECT * FROM "{table}"{order}', table, var_struct.type)
+        self._tables[view] = (table, viewdef, var_struct.type, size)
+        self.promotions += 1
+        _logger.debug(f"materialize view {view} into {table} of {size} bytes")
+        return True
+
+    def _demote(self, view):
+        table, viewdef, entity_type, _ = self._tables.pop(view)
+        self._redefine(view, viewdef, table, entity_type)
+        self._run(f'DROP TABLE IF EXISTS "{table}"', table)
+
+    def _redefine(self, view, viewdef, table, entity_type):
+        # the view definition is formatted by the store without values
+        text = viewdef.replace("{", "{{").replace("}", "}}")
+        self._store.assign_query(view, SQLQuery(text, (), table), entity_type)
+
+    def _table_size(self, table, indexes):
+        if self._store.dialect == "postgresql":
+            text = f'SELECT pg_total_relation_size({self._store.placeholder}) AS "size"'
+            values = (table,)
+        else:
+            names = [table] + indexes
+            placeholders = ", ".join([self._store.placeholder] * len(names))
+            text = (
+                'SELECT SUM("pgsize") AS "size" FROM "dbstat"'
+                f' WHERE "name" IN ({placeholders})'
+            )
+            values = tuple(names)
+        cursor = self._store.run_query(SQLQuery(text, values, table))
+        size = cursor.fetchone()["size"]
+        cursor.close()
+        return size or 0
+
+    def _run(self, text, table):
+        self._store.run_query(SQLQuery(text, (), table)).close()
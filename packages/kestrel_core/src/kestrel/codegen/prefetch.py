@@ -1,23 +1,74 @@
 import logging
+import uuid
+from collections import defaultdict
 from copy import deepcopy
 from kestrel.symboltable.symtable import SymbolTable
 from kestrel.syntax.parser import parse_ecgpattern
 from kestrel.utils import lowered_str_list
-from kestrel.semantics.reference import make_deref_func, make_var_timerange_func
+from kestrel.semantics.reference import make_batched_deref_funcs
+from kestrel.datasource import ReturnFromShards, ReturnFromStore
 from kestrel.syntax.utils import (
     timedelta_seconds,
 )
+from kestrel.codegen.queries import SQLQuery
 from kestrel.codegen.relations import (
-    get_entity_id_attribute,
     fine_grained_relational_process_filtering,
+    fine_grained_relational_process_filtering_in_store,
     compile_identical_entity_search_pattern,
-    build_pattern_from_ids,
+    create_view_from_ids,
 )
 
 
 _logger = logging.getLogger(__name__)
 
 
+class PrefetchCache:
+    """Cache of prefetch query results in the store.
+
+    Results are keyed by (data source, entity type, identifier attribute,
+    extended pattern, time window). Each result records the identifier values
+    queried and the ``query_id`` of the records loaded to the store. A new
+    prefetch with the same key only queries values not found in previous
+    results.
+
+    Attributes:
+        queries_saved (int): number of prefetch without a data source query.
+
+        values_reused (int): number of identifier values served from the cache.
+    """
+
+    def __init__(self):
+        self.queries_saved = 0
+        self.values_reused = 0
+        self._results = defaultdict(list)
+
+    def __len__(self):
+        return sum(map(len, self._results.values()))
+
+    def lookup(self, key, values):
+        """Find previous results of values.
+
+        Returns:
+            (list, list): ``query_id`` of the results having any of the values,
+            and the values not in any result.
+        """
+        query_ids = []
+        cached = set()
+        requested = set(values)
+        for result_values, query_id in self._results[key]:
+            if not requested.isdisjoint(result_values):
+                query_ids.append(query_id)
+                cached |= requested & result_values
+        missing = [v for v in values if v not in cached]
+        self.values_reused += len(values) - len(missing)
+        if not missing:
+            self.queries_saved += 1
+        return query_ids, missing
+
+    def add(self, key, values, query_id):
+        self._results[key].append((frozenset(values), query_id))
+
+
 def do_prefetch(
     local_stage_varname,
     local_stage_varstruct,
@@ -66,11 +117,11 @@ def do_prefetch(
 
         if pattern_raw:
             _symtable = SymbolTable({local_stage_varname: local_stage_varstruct})
-            pattern_ast = parse_ecgpattern(pattern_raw)
-            deref_func = make_deref_func(session.store, _symtable)
-            get_timerange_func = make_var_timerange_func(session.store, _symtable)
-            pattern_ast.deref(deref_func, get_timerange_func)
-            pattern_ast.add_center_entity(local_stage_varstruct.type)
+            (reference,) = parse_ecgpattern(pattern_raw).get_references()
+            deref_func, get_timerange_func = make_batched_deref_funcs(
+                session.store, _symtable, [reference]
+            )
+            values = deref_func(reference)
             time_adj = tuple(
                 map(
                     timedelta_seconds,
@@ -85,21 +136,93 @@ def do_prefetch(
             if ext_graph_pattern and stmt["command"].lower() == "get":
                 ext_graph_pattern.prune_away_centered_graph(stmt["type"])
             _logger.debug(f"ext pattern in prefetch: {ext_graph_pattern}")
-            _logger.debug(f"prefetch pattern before extend: {pattern_ast}")
-            pattern_ast.extend("AND", ext_graph_pattern)
-            _logger.debug(f"prefetch pattern after extend: {pattern_ast}")
+
+            def build_pattern(identifier_values):
+                pattern_ast = parse_ecgpattern(pattern_raw)
+                pattern_ast.deref(lambda _: identifier_values, get_timerange_func)
+                pattern_ast.add_center_entity(local_stage_varstruct.type)
+                _logger.debug(f"prefetch pattern before extend: {pattern_ast}")
+                pattern_ast.extend("AND", deepcopy(ext_graph_pattern))
+                _logger.debug(f"prefetch pattern after extend: {pattern_ast}")
+                return pattern_ast
+
+            pattern_ast = build_pattern(values)
             stix_pattern = pattern_ast.to_stix(stmt["timerange"], time_adj)
             _logger.info(f"STIX pattern generated in prefetch: {stix_pattern}")
 
-    if stix_pattern:
-        resp = session.data_source_manager.query(
+            # results are not composable if each query is limited
+            if session.config["prefetch"]["reuse_results"] and not stmt.get("limit"):
+                cache_key = (
+                    local_stage_varstruct.data_source,
+                    local_stage_varstruct.type,
+                    local_stage_varstruct.entity_id_attribute,
+                    str(ext_graph_pattern.graph) if ext_graph_pattern else None,
+                    pattern_ast.get_time_window(stmt["timerange"], time_adj),
+                )
+                query_ids, values_to_query = session.prefetch_cache.lookup(
+                    cache_key, values
+                )
+            else:
+                cache_key = None
+                query_ids, values_to_query = [], values
+
+            if values_to_query:
+                if len(values_to_query) < len(values):
+                    pattern_ast = build_pattern(values_to_query)
+                stix_pattern_shards = pattern_ast.to_stix_shards(
+                    stmt["timerange"],
+                    time_adj,
+                    session.config["stixquery"]["max_in_list_size"],
+                    session.config["stixquery"]["max_subqueries"],
+                )
+                _logger.info(
+                    f"query {len(values_to_query)} out of {len(values)} values in prefetch."
+                )
+
+                # fallback query if the prefetch exceeds the budget
+                narrowed_time_window = _narrow_time_window(
+                    pattern_ast, stmt["timerange"], time_adj
+                )
+                if narrowed_time_window:
+                    narrowed_stix_pattern_shards = pattern_ast.to_stix_shards(
+                        narrowed_time_window,
+                        None,
+                        session.config["stixquery"]["max_in_list_size"],
+                        session.config["stixquery"]["max_subqueries"],
+                    )
+                else:
+                    narrowed_stix_pattern_shards = None
+            else:
+                stix_pattern_shards = None
+                _logger.info("all values found in previous prefetch results.")
+
+    if stix_pattern and stix_pattern_shards:
+        query_id, is_complete = _query_with_guardrails(
+            session,
             local_stage_varstruct.data_source,
-            stix_pattern,
-            session.session_id,
-            session.store,
             stmt.get("limit"),
+            stix_pattern_shards,
+            narrowed_stix_pattern_shards,
         )
-        query_id = resp.load_to_store(session.store)
+        if query_id is None:
+            # prefetch skipped by the guardrails
+            stix_pattern = None
+        elif not is_complete and not stmt.get("limit"):
+            # prefetch cut by the guardrails may miss the entities found
+            _logger.info("prefetch incomplete, keep the entities before prefetch.")
+            stix_pattern = None
+        else:
+            if cache_key and is_complete:
+                session.prefetch_cache.add(cache_key, values_to_query, query_id)
+            query_ids.append(query_id)
+
+    if stix_pattern:
+        if len(query_ids) == 1:
+            query_id = query_ids[0]
+        else:
+            query_id = ReturnFromShards(
+                str(uuid.uuid4()), [ReturnFromStore(qid) for qid in query_ids]
+            ).load_to_store(session.store)
 
         # build the view in store
         session.store.extract(
@@ -146,7 +269,7 @@ def _filter_prefetched_process(
     # special handling for process to filter out impossible relational processes
     # this is needed since STIX 2.0 does not have mandatory fields for
     # process and field like `pid` is not unique
-    if return_type == "process" and get_entity_id_attribute(local_varstruct) not in (
+    if return_type == "process" and local_varstruct.entity_id_attribute not in (
         "id",
         "x_unique_id",
     ):
@@ -154,17 +277,22 @@ def _filter_prefetched_process(
             f"filter prefetched {return_type} for {prefetch_raw_entity_table}."
         )
 
-        entity_ids = fine_grained_relational_process_filtering(
+        proc_id_config = session.config["prefetch"]["process_identification"]
+        if proc_id_config["engine"] == "sql":
+            filtering_func = fine_grained_relational_process_filtering_in_store
+        else:
+            filtering_func = fine_grained_relational_process_filtering
+
+        entity_ids = filtering_func(
             local_varstruct,
             prefetch_raw_entity_table,
             session.store,
-            session.config["prefetch"]["process_identification"],
+            proc_id_config,
         )
 
         if entity_ids:
-            id_pattern = build_pattern_from_ids(return_type, entity_ids)
-            session.store.extract(
-                prefetch_filtered_var_name, return_type, None, id_pattern
+            create_view_from_ids(
+                session.store, prefetch_filtered_var_name, return_type, entity_ids
             )
             _logger.debug("filter after prefetch succeeds.")
             ret_table = prefetch_filtered_var_name
@@ -176,6 +304,77 @@ def _filter_prefetched_process(
     return ret_table
 
 
+def _narrow_time_window(pattern_ast, timerange, time_adj):
+    # time range of the entities without the time offsets
+    # not narrowed if the time range is specified in the statement
+    if not timerange and time_adj and any(time_adj):
+        return pattern_ast.get_time_window(None, None)
+    return None
+
+
+def _query_with_guardrails(
+    session, data_source, limit, stix_pattern_shards, narrowed_stix_pattern_shards
+):
+    """Query data source for prefetch within the budget of records.
+
+    The query is first sent with the budget as the limit. Its results are
+    complete if fewer records than the budget are returned. Otherwise the
+    prefetch is estimated to exceed the budget, and the configured action is
+    taken: ``narrow`` queries again in the narrowed time window, ``cap`` keeps
+    the limited results, and ``skip`` skips prefetch. The narrowed results are
+    complete if fewer records than the budget are returned, since the narrowed
+    time window still covers the records of the input entities.
+
+    Returns:
+        (str, bool): the ``query_id`` of the results or ``None`` if prefetch
+        is skipped, and whether the results are complete.
+    """
+    guardrails = session.config["prefetch"]["guardrails"]
+    budget = guardrails["max_records"]
+
+    def query(shards, limit):
+        resp = session.data_source_manager.query_shards(
+            data_source, shards, session.session_id, session.store, limit
+        )
+        query_id = resp.load_to_store(session.store)
+        session.index_advisor.advise()
+        return query_id
+
+    if not budget or (limit and limit <= budget):
+        return query(stix_pattern_shards, limit), not limit
+
+    query_id = query(stix_pattern_shards, budget)
+    record_count = _count_records(session.store, query_id)
+    if record_count < budget:
+        return query_id, True
+
+    action = guardrails["action"]
+    _logger.warning(
+        f"prefetch reaches the budget of {budget} records, action: {action}."
+    )
+    if action == "skip":
+        query_id = None
+    elif action == "narrow" and narrowed_stix_pattern_shards:
+        query_id = query(narrowed_stix_pattern_shards, budget)
+        return query_id, _count_records(session.store, query_id) < budget
+
+    return query_id, False
+
+
+def _count_records(store, query_id):
+    # number of observations (records) in the results of a query
+    # `%%` is a literal `%` with PostgreSQL placeholders and the same pattern
+    # in SQLite
+    query = SQLQuery(
+        'SELECT COUNT(DISTINCT sco_id) AS "count" FROM "__queries"'
+        f" WHERE query_id = {store.placeholder}"
+        " AND sco_id LIKE 'observed-data--%%'",
+        [query_id],
+        "__queries",
+    )
+    return store.run_query(query).fetchone()["count"]
+
+
 def _is_prefetch_allowed_in_config(prefetch_config, command_name, entity_type):
     if prefetch_config["switch_per_command"][
         command_name
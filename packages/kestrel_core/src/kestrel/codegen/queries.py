@@ -107,25 +107,41 @@ def compile_specific_relation_to_query(
     return None
 
 
-def compile_generic_relation_to_query(return_type, input_type, input_var_table):
+def compile_generic_relation_to_query(
+    return_type, input_type, input_var_table, dialect=None
+):
+    # entities of return_type in the observations of the input entities
+    # joined through the type-partitioned index of __contains, see IndexAdvisor
+    return_type_expr = get_contains_target_type("r.target_ref", dialect)
     return SQLQuery(
         f"""
 SELECT DISTINCT sco.*
- FROM __contains c
+ FROM "{input_var_table}" v
+  JOIN __contains c
+   ON c.target_ref = v.id
+  JOIN __contains r
+   ON r.source_ref = c.source_ref
+   AND {return_type_expr} = '{return_type}'
   JOIN "{return_type}" sco
-   ON sco.id = c.target_ref
- WHERE source_ref IN (
-  SELECT source_ref
-   FROM __contains c
-   WHERE target_ref LIKE '{return_type}--%'
-  INTERSECT SELECT source_ref
-   FROM __contains c
-   WHERE target_ref IN (SELECT id FROM "{input_var_table}"))""",
+   ON sco.id = r.target_ref""",
         tuple(),
         input_var_table,
     )
 
 
+def get_contains_target_type(column, dialect=None):
+    """SQL expression of the entity type in a reference of ``__contains``.
+
+    STIX identifiers are ``<type>--<UUID>``. The expression is also the
+    leading key of the type-partitioned index of ``__contains``, so it must be
+    identical in queries to use the index.
+    """
+    if dialect == "postgresql":
+        return f"split_part({column}, '--', 1)"
+    else:
+        return f"substr({column}, 1, instr({column}, '--') - 1)"
+
+
 # Utility class for overriding firepit behavior
 # FIXME: A hack - need to figure out a btter way
 class SQLQuery(Query):
@@ -6,16 +6,29 @@ for more details.
 
 """
 
-import datetime
-from collections import defaultdict
 import logging
-
-from firepit.timestamp import to_datetime
-from kestrel.syntax.reference import value_to_stix
-from firepit.query import Column, Join, Query, Projection, Table, Unique
+import uuid
+
+import pandas as pd
+from firepit.query import (
+    Column,
+    Filter,
+    Join,
+    Limit,
+    Predicate,
+    Query,
+    Projection,
+    Table,
+    Unique,
+)
 
 _logger = logging.getLogger(__name__)
 
+# ids of entities to create views from, see create_view_from_ids()
+IDSETS_TABLE = "__idsets"
+# two parameters per row, within the SQLite limit of 999 parameters
+IDSETS_INSERT_BATCH_SIZE = 400
+
 stix_2_0_ref_mapping = {
     # (EntityX, Relate, EntityY): ([EntityX_STIX_Ref_i], [EntityY_STIX_Ref_i])
     # All STIX 2.0 refs enumerated
@@ -112,29 +125,46 @@ def get_entity_id_attribute(variable):
     # this works for:
     #   - no appriparite identifier attribute found given specific data
     #   - "network-traffic" (not in stix_2_0_identical_mapping)
+    #
+    # use :attr:`VarStruct.entity_id_attribute` to get the memoized result
     id_attr = "id"
 
     if variable.type in stix_2_0_identical_mapping:
         available_attributes = variable.store.columns(variable.entity_table)
         for attr in stix_2_0_identical_mapping[variable.type]:
-            if attr in available_attributes:
-                query = Query()
-                query.append(Table(variable.entity_table))
-                query.append(Projection([attr]))
-                query.append(Unique())
-                rows = variable.store.run_query(query).fetchall()
-                all_values = [row[attr] for row in rows if row[attr]]
-                if all_values:
-                    id_attr = attr
-                    break
+            if attr in available_attributes and _has_value(variable, attr):
+                id_attr = attr
+                break
 
     return id_attr
 
 
+def _has_value(variable, attr):
+    # probe for one non-null value instead of scanning all distinct values
+    query = Query(
+        [
+            Table(variable.entity_table),
+            Filter([Predicate(attr, "!=", "NULL")]),
+            Projection([attr]),
+            Limit(1),
+        ]
+    )
+    rows = variable.store.run_query(query).fetchall()
+    if rows and rows[0][attr]:
+        return True
+    elif not rows:
+        return False
+    else:
+        # the probed value is falsy, e.g., empty string, check all values
+        query = Query([Table(variable.entity_table), Projection([attr]), Unique()])
+        rows = variable.store.run_query(query).fetchall()
+        return any(row[attr] for row in rows)
+
+
 def compile_identical_entity_search_pattern(var_name, var_struct, does_support_id):
     # "id" attribute may not be available for STIX 2.0 via STIX-shifter
     # so `does_support_id` is set to False in default kestrel config file
-    attribute = get_entity_id_attribute(var_struct)
+    attribute = var_struct.entity_id_attribute
     if attribute == "id" and not does_support_id:
         pattern_raw = None
     else:
@@ -164,54 +194,194 @@ def fine_grained_relational_process_filtering(
         f"start fine-grained relational process filtering for prefetched table: {prefetch_entity_table}"
     )
 
+    # time windows of the identification rules computed once
+    rules = _get_process_identification_rules(config)
+
     # reference processes obtained from de-referring data in firepit
-    # type(ref_processes) == {pid: (rid, (pname, ppid, start_time, end_time))}
+    # columns: id, pid, name, ppid, first_observed, last_observed
     ref_processes = _query_process_with_time_and_ppid(store, local_var.entity_table)
 
     # prefetched processes to be filtered
-    # type(pfeh_processes) == {pid: (rid, (pname, ppid, start_time, end_time))}
     pfeh_processes = _query_process_with_time_and_ppid(store, prefetch_entity_table)
 
     # 1. anchor process search (a subset of pfeh_processes that matches ref_processes)
-    # type(anchor_processes) == {pid: (rid, (pname, ppid, start_time, end_time))}
     anchor_processes = _search_for_potential_identical_process(
-        ref_processes, pfeh_processes, config
+        ref_processes, pfeh_processes, rules
     )
 
-    anchor_proc_cnt = sum(map(len, anchor_processes.values()))
-    prefetched_proc_cnt = sum(map(len, pfeh_processes.values()))
     _logger.debug(
-        f"found {anchor_proc_cnt} anchor rows out of {prefetched_proc_cnt} raw prefetched."
+        f"found {len(anchor_processes)} anchor rows out of {len(pfeh_processes)} raw prefetched."
     )
 
     # 2. precise process search (a larger subset of pfeh_processes that matches anchor_processes)
-    # type(anchor_processes) == {pid: (rid, (pname, ppid, start_time, end_time))}
     filtered_processes = _search_for_potential_identical_process(
-        anchor_processes, pfeh_processes, config
+        anchor_processes, pfeh_processes, rules
     )
 
-    filtered_ids = [rid for procs in filtered_processes.values() for rid, _ in procs]
-    filtered_ids = list(set(filtered_ids))
+    filtered_ids = list(filtered_processes["id"].unique())
 
     _logger.debug(
-        f"found {len(filtered_ids)} out of {prefetched_proc_cnt} raw prefetched results to be true relational process records."
+        f"found {len(filtered_ids)} out of {len(pfeh_processes)} raw prefetched results to be true relational process records."
     )
 
     return filtered_ids
 
 
-def build_pattern_from_ids(return_type, ids):
-    if ids:
-        return (
-            "[" + return_type + ":id IN (" + ", ".join(map(value_to_stix, ids)) + ")]"
+def fine_grained_relational_process_filtering_in_store(
+    local_var, prefetch_entity_table, store, config
+):
+    # The same two-step search as fine_grained_relational_process_filtering()
+    # executed as one SQL query in the store without loading records to Python
+
+    # kestrel.codegen.queries imports this module
+    from kestrel.codegen.queries import SQLQuery
+
+    _logger.debug(
+        f"start fine-grained relational process filtering in store for prefetched table: {prefetch_entity_table}"
+    )
+
+    def records(var_table_name):
+        # the rows are filtered by truthy pid as in Python
+        query = _compile_process_with_time_and_ppid_query(store, var_table_name)
+        text, values = query.render(store.placeholder, store.dialect)
+        if "parent_ref" in store.columns(var_table_name):
+            columns = "*"
+        else:
+            columns = '*, NULL AS "ppid"'
+        text = (
+            f'(SELECT {columns} FROM ({text}) AS "r"'
+            " WHERE pid IS NOT NULL AND pid != 0)"
         )
-    else:
-        return None
+        return text, list(values)
+
+    ref_text, ref_values = records(local_var.entity_table)
+    pfeh_text, pfeh_values = records(prefetch_entity_table)
+    ref_match = _compile_process_identification_condition(store, config, "f", "r")
+    anchor_match = _compile_process_identification_condition(store, config, "f", "a")
+
+    query = SQLQuery(
+        f'WITH "ref" AS {ref_text}, "pfeh" AS {pfeh_text},'
+        ' "anchor" AS (SELECT * FROM "pfeh" AS "f" WHERE EXISTS'
+        f' (SELECT 1 FROM "ref" AS "r" WHERE {ref_match}))'
+        ' SELECT DISTINCT "f".id AS "id" FROM "pfeh" AS "f" WHERE EXISTS'
+        f' (SELECT 1 FROM "anchor" AS "a" WHERE {anchor_match})',
+        ref_values + pfeh_values,
+        prefetch_entity_table,
+    )
 
+    filtered_ids = [row["id"] for row in store.run_query(query).fetchall()]
 
-def _query_process_with_time_and_ppid(store, var_table_name):
-    pid2procs = defaultdict(list)
+    _logger.debug(
+        f"found {len(filtered_ids)} raw prefetched results to be true relational process records."
+    )
+
+    return filtered_ids
+
+
+def create_view_from_ids(store, view_name, entity_type, ids):
+    """Create a view of the entities with the given ids.
+
+    The ids are inserted into the ``__idsets`` table with bound parameters
+    under a new set id, and the view joins the set with the entity table. This
+    avoids serializing the ids into a STIX pattern to parse it back in firepit.
+    Sets no longer referred to by any view are deleted by
+    :func:`remove_unused_id_sets` once per statement.
+
+    Args:
+        store (firepit.SqlStorage): the store.
+        view_name (str): the view to create.
+        entity_type (str): the entity table to select from.
+        ids (list): the STIX ids of the entities.
+    """
+
+    # kestrel.codegen.queries imports this module
+    from kestrel.codegen.queries import SQLQuery
 
+    store.run_query(
+        SQLQuery(
+            f'CREATE TABLE IF NOT EXISTS "{IDSETS_TABLE}" (set_id TEXT, sco_id TEXT)',
+            [],
+            IDSETS_TABLE,
+        )
+    )
+    store.run_query(
+        SQLQuery(
+            f'CREATE INDEX IF NOT EXISTS "{IDSETS_TABLE}_set_id_idx"'
+            f' ON "{IDSETS_TABLE}" (set_id)',
+            [],
+            IDSETS_TABLE,
+        )
+    )
+
+    set_id = uuid.uuid4().hex
+    row_placeholders = f"({store.placeholder}, {store.placeholder})"
+    for i in range(0, len(ids), IDSETS_INSERT_BATCH_SIZE):
+        batch = ids[i : i + IDSETS_INSERT_BATCH_SIZE]
+        store.run_query(
+            SQLQuery(
+                f'INSERT INTO "{IDSETS_TABLE}" (set_id, sco_id) VALUES '
+                + ", ".join([row_placeholders] * len(batch)),
+                [v for sco_id in batch for v in (set_id, sco_id)],
+                IDSETS_TABLE,
+            )
+        )
+
+    query = Query(
+        [
+            Table(entity_type),
+            Join(IDSETS_TABLE, "id", "=", "sco_id"),
+            Filter([Predicate("set_id", "=", set_id)]),
+            Projection([Column("*", entity_type)]),
+        ]
+    )
+    store.assign_query(view_name, query, entity_type)
+
+
+def remove_unused_id_sets(store):
+    """Delete id sets no longer referred to by any view in the store.
+
+    A set is used if its id is in the definition of any view, including views
+    redefined on top of the one created from the set. The view definitions are
+    only read if there is any set in the store.
+
+    Args:
+        store (firepit.SqlStorage): the store.
+    """
+
+    # kestrel.codegen.queries imports this module
+    from kestrel.codegen.queries import SQLQuery
+
+    # no view created from ids in the store
+    if not store.columns(IDSETS_TABLE):
+        return
+
+    rows = store.run_query(
+        SQLQuery(f'SELECT DISTINCT set_id FROM "{IDSETS_TABLE}"', [], IDSETS_TABLE)
+    ).fetchall()
+    if not rows:
+        return
+    definitions = [store._get_view_def(view) for view in store.views()]
+    unused = [
+        row["set_id"]
+        for row in rows
+        if not any(row["set_id"] in definition for definition in definitions)
+    ]
+    for i in range(0, len(unused), IDSETS_INSERT_BATCH_SIZE):
+        batch = unused[i : i + IDSETS_INSERT_BATCH_SIZE]
+        store.run_query(
+            SQLQuery(
+                f'DELETE FROM "{IDSETS_TABLE}" WHERE set_id IN ('
+                + ", ".join([store.placeholder] * len(batch))
+                + ")",
+                batch,
+                IDSETS_TABLE,
+            )
+        )
+    if unused:
+        _logger.debug(f"{len(unused)} unused id sets deleted")
+
+
+def _compile_process_with_time_and_ppid_query(store, var_table_name):
     if "parent_ref" in store.columns(var_table_name):
         has_parent_ref = True
     else:
@@ -244,88 +414,127 @@ def _query_process_with_time_and_ppid(store, var_table_name):
 
     query_details.append(Projection(projection_details))
 
-    query = Query(query_details)
-
-    rows = store.run_query(query).fetchall()
-
-    for row in rows:
-        if row["pid"]:
-            rid = row["id"]
-            pname = row["name"]
-            ppid = row["ppid"] if has_parent_ref else None
-            st = to_datetime(row["first_observed"])
-            ed = to_datetime(row["last_observed"])
-            pid2procs[row["pid"]].append((rid, (pname, ppid, st, ed)))
-
-    return pid2procs
-
-
-def _search_for_potential_identical_process(ref_pid2procs, fil_pid2procs, config):
-    # ref_pid2procs: {"pid":(rid, (proc_details))} for reference
-    # fil_pid2procs: {"pid":(rid, (proc_details))} to search
-
-    res_pid2procs = defaultdict(list)
+    return Query(query_details)
 
-    for pid, fil_procs in fil_pid2procs.items():
-        for rid, fil_row in fil_procs:
-            for _, ref_row in ref_pid2procs[pid]:
-                if _identical_process_check(fil_row, ref_row, config):
-                    res_pid2procs[pid].append((rid, fil_row))
-                    break
-
-    return res_pid2procs
 
+def _query_process_with_time_and_ppid(store, var_table_name):
+    query = _compile_process_with_time_and_ppid_query(store, var_table_name)
+    rows = store.run_query(query).fetchall()
 
-def _identical_process_check(fil_row, ref_row, config):
-    pbnc_bo = datetime.timedelta(
-        seconds=config["pid_but_name_changed_time_begin_offset"]
-    )
-    pbnc_eo = datetime.timedelta(seconds=config["pid_but_name_changed_time_end_offset"])
-    pan_bo = datetime.timedelta(seconds=config["pid_and_name_time_begin_offset"])
-    pan_eo = datetime.timedelta(seconds=config["pid_and_name_time_end_offset"])
-    pap_bo = datetime.timedelta(seconds=config["pid_and_ppid_time_begin_offset"])
-    pap_eo = datetime.timedelta(seconds=config["pid_and_ppid_time_end_offset"])
-    panap_bo = datetime.timedelta(
-        seconds=config["pid_and_name_and_ppid_time_begin_offset"]
-    )
-    panap_eo = datetime.timedelta(
-        seconds=config["pid_and_name_and_ppid_time_end_offset"]
+    columns = ["id", "pid", "name", "ppid", "first_observed", "last_observed"]
+    procs = pd.DataFrame(
+        [[row.get(column) for column in columns] for row in rows if row["pid"]],
+        columns=columns,
+        dtype=object,
     )
-
-    fil_pname, fil_ppid, fil_start_time, fil_end_time = fil_row
-    ref_pname, ref_ppid, ref_start_time, ref_end_time = ref_row
-    if (
-        (
-            fil_pname
-            and fil_ppid
-            and fil_pname == ref_pname
-            and fil_ppid == ref_ppid
-            and fil_start_time > ref_start_time + panap_bo
-            and fil_start_time < ref_end_time + panap_eo
-        )
-        or (
-            fil_pname
-            and fil_pname == ref_pname
-            and fil_start_time > ref_start_time + pan_bo
-            and fil_start_time < ref_end_time + pan_eo
-        )
-        or (
-            fil_ppid
-            and fil_ppid == ref_ppid
-            and fil_start_time > ref_start_time + pap_bo
-            and fil_start_time < ref_end_time + pap_eo
-        )
-        or (
-            # name changed process, Linux fork+exec handled
-            fil_start_time > ref_start_time + pbnc_bo
-            and fil_start_time < ref_end_time + pbnc_eo
-        )
-        or (
-            # name changed process, Linux fork+exec handled
-            fil_end_time > ref_start_time + pbnc_bo
-            and fil_end_time < ref_end_time + pbnc_eo
-        )
+    for column in ("first_observed", "last_observed"):
+        procs[column] = pd.to_datetime(procs[column], utc=True, format="ISO8601")
+
+    return procs
+
+
+def _get_process_identification_rules(config):
+    # [(attributes to match besides pid, time attribute of the searched
+    #   process, begin offset, end offset)]
+    # a searched process is identical to a reference process with the same
+    # pid and attributes if the time attribute of the searched process is in
+    # (reference first_observed + begin offset, reference last_observed + end offset)
+    rules = []
+    for attributes, time_attribute, config_prefix in (
+        (["name", "ppid"], "first_observed", "pid_and_name_and_ppid"),
+        (["name"], "first_observed", "pid_and_name"),
+        (["ppid"], "first_observed", "pid_and_ppid"),
+        # name changed process, Linux fork+exec handled
+        ([], "first_observed", "pid_but_name_changed"),
+        ([], "last_observed", "pid_but_name_changed"),
     ):
-        return True
+        begin_offset = pd.Timedelta(
+            seconds=config[config_prefix + "_time_begin_offset"]
+        )
+        end_offset = pd.Timedelta(seconds=config[config_prefix + "_time_end_offset"])
+        rules.append((attributes, time_attribute, begin_offset, end_offset))
+    return rules
+
+
+def _compile_process_identification_condition(store, config, fil, ref):
+    # SQL condition on table aliases: whether process `fil` is identical to `ref`
+    # timestamps are compared in integer milliseconds to avoid rounding errors
+    if store.dialect == "postgresql":
+        epoch = "ROUND(EXTRACT(EPOCH FROM CAST({} AS TIMESTAMPTZ)) * 1000)"
     else:
-        return False
+        epoch = "CAST(ROUND((julianday({}) - 2440587.5) * 86400000) AS INTEGER)"
+
+    def truthy(attribute):
+        null = f'"{fil}".{attribute} IS NOT NULL'
+        if attribute == "name":
+            return f"{null} AND \"{fil}\".{attribute} != ''"
+        else:
+            return f'{null} AND "{fil}".{attribute} != 0'
+
+    rules = []
+    for (
+        attributes,
+        time_attribute,
+        begin_offset,
+        end_offset,
+    ) in _get_process_identification_rules(config):
+        conditions = [truthy(attribute) for attribute in attributes]
+        conditions += [f'"{fil}".{a} = "{ref}".{a}' for a in attributes]
+        fil_time = epoch.format(f'"{fil}".{time_attribute}')
+        ref_begin = epoch.format(f'"{ref}".first_observed')
+        ref_end = epoch.format(f'"{ref}".last_observed')
+        begin_ms = int(begin_offset.total_seconds() * 1000)
+        end_ms = int(end_offset.total_seconds() * 1000)
+        conditions.append(f"{fil_time} > {ref_begin} + {begin_ms}")
+        conditions.append(f"{fil_time} < {ref_end} + {end_ms}")
+        rules.append("(" + " AND ".join(conditions) + ")")
+
+    return f'"{fil}".pid = "{ref}".pid AND (' + " OR ".join(rules) + ")"
+
+
+def _search_for_potential_identical_process(ref_procs, fil_procs, rules):
+    # ref_procs: DataFrame of processes for reference
+    # fil_procs: DataFrame of processes to search
+    # return the rows in fil_procs identical to any process in ref_procs
+
+    matched = pd.Series(False, index=fil_procs.index)
+
+    if ref_procs.empty or fil_procs.empty:
+        return fil_procs[matched]
+
+    for attributes, time_attribute, begin_offset, end_offset in rules:
+        keys = ["pid"] + attributes
+
+        # the searched process should have all attributes to match
+        has_attributes = pd.Series(True, index=fil_procs.index)
+        for attribute in attributes:
+            has_attributes &= fil_procs[attribute].map(bool)
+        probes = fil_procs.loc[~matched & has_attributes, keys + [time_attribute]]
+        probes = probes.rename(columns={time_attribute: "time"})
+        probes["row"] = probes.index
+
+        # time windows of reference processes per (pid, attributes)
+        # a process in probes matches if any window contains its time:
+        # take the last window beginning before the time, and check if the
+        # max end of windows beginning before the time is after the time
+        windows = ref_procs.dropna(subset=keys)[keys].copy()
+        windows["begin"] = ref_procs["first_observed"] + begin_offset
+        windows["end"] = ref_procs["last_observed"] + end_offset
+        windows = windows.sort_values("begin")
+        windows["max_end"] = windows.groupby(keys)["end"].cummax()
+
+        if probes.empty or windows.empty:
+            continue
+
+        candidates = pd.merge_asof(
+            probes.sort_values("time"),
+            windows[keys + ["begin", "max_end"]],
+            left_on="time",
+            right_on="begin",
+            by=keys,
+            allow_exact_matches=False,
+        )
+        hits = candidates.loc[candidates["max_end"] > candidates["time"], "row"]
+        matched[hits] = True
+
+    return fil_procs[matched]
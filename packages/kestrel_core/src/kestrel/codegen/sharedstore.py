@@ -0,0 +1,208 @@
+"""Persistent SQLite store shared by Kestrel sessions.
+
+By default, each session creates its own store in the runtime directory and
+deletes it at exit. With the ``shared_store`` config section, sessions use one
+persistent SQLite database instead:
+
+- Observations are content-addressed: the ``observed-data`` identifier is
+  derived from the observation content and its occurrence among identical
+  observations in the bundle, and observations already in the store are not
+  ingested again, so ingesting the same records again adds no data but the
+  association of the records to the new query.
+
+- Variables are isolated: the views of each session and the id sets they
+  read are created as temporary views and tables of its database connection,
+  with a temporary symbol table shadowing the shared one.
+
+- Sessions read and write the database concurrently in WAL mode, waiting for
+  other writers up to the configured ``busy_timeout``.
+
+Limitations:
+
+- Only SQLite is supported. A shared store is a SQLite database even if
+  ``session.local_database_path`` is a PostgreSQL URL; PostgreSQL stores are
+  never shared.
+
+- The per-session views and id sets rely on private methods of
+  :class:`firepit.sqlitestorage.SQLiteStorage` (``_do_execute``,
+  ``_get_view_def``, and ``_is_sql_view``), which may change in a new firepit
+  release without notice.
+
+"""
+
+import json
+import logging
+import sqlite3
+import uuid
+from collections import Counter
+
+from firepit.sqlitestorage import SQLiteStorage
+
+from kestrel.codegen.relations import IDSETS_TABLE
+
+_logger = logging.getLogger(__name__)
+
+# namespace of content-addressed observed-data identifiers
+OBSERVATION_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "kestrel:observed-data")
+
+# observation ids per query, two queries per batch within the SQLite limit of
+# 999 parameters
+OBSERVATION_BATCH_SIZE = 400
+
+# relation tables created before firepit initializes the store so rows
+# ingested again by sessions at the same time are ignored
+DEDUPLICATED_TABLES = [
+    'CREATE TABLE IF NOT EXISTS "__contains"'
+    " (source_ref TEXT, target_ref TEXT, x_firepit_rank INTEGER,"
+    " UNIQUE(source_ref, target_ref) ON CONFLICT IGNORE)",
+    'CREATE TABLE IF NOT EXISTS "__reflist"'
+    ' ("ref_name" TEXT, "source_ref" TEXT, "target_ref" TEXT,'
+    " UNIQUE(ref_name, source_ref, target_ref) ON CONFLICT IGNORE)",
+]
+
+# id sets of views created by kestrel.codegen.relations.create_view_from_ids
+SESSION_IDSETS = f'CREATE TABLE IF NOT EXISTS "{IDSETS_TABLE}"'
+
+SESSION_SYMTABLE = (
+    'CREATE TEMP TABLE "__symtable"'
+    " (name TEXT, type TEXT, appdata TEXT, UNIQUE(name))"
+)
+
+
+class SharedSQLiteStorage(SQLiteStorage):
+    """SQLite store shared by sessions with per-session views.
+
+    The statements creating views and id sets are rewritten to create
+    temporary ones by overriding the private ``_do_execute()`` of firepit,
+    and views are looked up among the temporary ones of the connection.
+
+    Args:
+        dbname (str): the path of the persistent database.
+
+        busy_timeout (float): seconds to wait for other sessions writing the
+          database.
+    """
+
+    def __init__(self, dbname, busy_timeout):
+        connection = sqlite3.connect(dbname, timeout=busy_timeout)
+        connection.execute("PRAGMA journal_mode=WAL")
+        for stmt in DEDUPLICATED_TABLES:
+            connection.execute(stmt)
+        connection.commit()
+        connection.close()
+
+        try:
+            super().__init__(dbname)
+        except sqlite3.OperationalError:
+            # the store is initialized by another session at the same time
+            self.connection.close()
+            super().__init__(dbname)
+        self.connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self.connection.execute(SESSION_SYMTABLE)
+        self.connection.commit()
+        _logger.debug(f"shared store {dbname} opened")
+
+    def cache(self, query_id, bundles, batchsize=2000, **kwargs):
+        """Cache bundles with content-addressed observations.
+
+        Observations already in the store are not ingested again; their
+        entities are associated to ``query_id`` in the store.
+        """
+        if not isinstance(bundles, list):
+            bundles = [bundles]
+        bundles = list(map(_address_observations, bundles))
+
+        observation_ids = [
+            obj["id"]
+            for bundle in bundles
+            for obj in bundle.get("objects", [])
+            if obj.get("type") == "observed-data"
+        ]
+        existing_ids = set(self._get_existing_observations(observation_ids))
+        if existing_ids:
+            _logger.debug(f"{len(existing_ids)} observations already in store")
+            for bundle in bundles:
+                bundle["objects"] = [
+                    obj
+                    for obj in bundle.get("objects", [])
+                    if obj.get("id") not in existing_ids
+                ]
+
+        super().cache(query_id, bundles, batchsize, **kwargs)
+
+        if existing_ids:
+            self._associate_observations(query_id, list(existing_ids))
+
+    def _get_existing_observations(self, observation_ids):
+        existing_ids = []
+        if "observed-data" in self.types():
+            for i in range(0, len(observation_ids), OBSERVATION_BATCH_SIZE):
+                batch = observation_ids[i : i + OBSERVATION_BATCH_SIZE]
+                placeholders = ", ".join([self.placeholder] * len(batch))
+                rows = self._query(
+                    f'SELECT id FROM "observed-data" WHERE id IN ({placeholders})',
+                    values=batch,
+                ).fetchall()
+                existing_ids.extend(row["id"] for row in rows)
+        return existing_ids
+
+    def _associate_observations(self, query_id, observation_ids):
+        # the observations and their entities as ingested by firepit
+        for i in range(0, len(observation_ids), OBSERVATION_BATCH_SIZE):
+            batch = observation_ids[i : i + OBSERVATION_BATCH_SIZE]
+            placeholders = ", ".join([self.placeholder] * len(batch))
+            self._query(
+                'INSERT INTO "__queries" (sco_id, query_id)'
+                f' SELECT id, {self.placeholder} FROM "observed-data"'
+                f" WHERE id IN ({placeholders})"
+                f' UNION SELECT target_ref, {self.placeholder} FROM "__contains"'
+                f" WHERE source_ref IN ({placeholders})",
+                values=[query_id, *batch, query_id, *batch],
+            )
+
+    def _do_execute(self, query, values=None, cursor=None):
+        # views of the session and the id sets they read are only visible to
+        # its connection
+        if query.startswith("CREATE VIEW "):
+            query = "CREATE TEMP VIEW " + query[len("CREATE VIEW ") :]
+        elif query.startswith(SESSION_IDSETS):
+            query = "CREATE TEMP TABLE " + query[len("CREATE TABLE ") :]
+        return super()._do_execute(query, values, cursor)
+
+    def _get_view_def(self, viewname):
+        view = self._query(
+            "SELECT sql FROM sqlite_temp_master WHERE type='view' AND name=?",
+            values=(viewname,),
+        ).fetchone()
+        if view:
+            return view["sql"].replace(f'CREATE VIEW "{viewname}" AS ', "")
+
+        # Must be a table
+        return f'SELECT * FROM "{viewname}"'
+
+    def _is_sql_view(self, name, cursor=None):
+        view = self._query(
+            "SELECT name FROM sqlite_temp_master WHERE type='view' AND name=?",
+            values=(name,),
+        ).fetchone()
+        return view is not None
+
+
+def _address_observations(bundle):
+    if isinstance(bundle, str):
+        with open(bundle) as f:
+            bundle = json.load(f)
+    # occurrences of identical observations in the bundle, which are distinct
+    # records, e.g., the same event logged twice
+    occurrences = Counter()
+    for obj in bundle.get("objects", []):
+        if obj.get("type") == "observed-data":
+            # time of creation differs for the same records queried again
+            content = {
+                k: v for k, v in obj.items() if k not in ("id", "created", "modified")
+            }
+            name = json.dumps(content, sort_keys=True, ensure_ascii=False)
+            occurrences[name] += 1
+            name += f"#{occurrences[name]}"
+            obj["id"] = f"observed-data--{uuid.uuid5(OBSERVATION_NAMESPACE, name)}"
+    return bundle
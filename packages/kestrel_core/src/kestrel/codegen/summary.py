@@ -1,16 +1,14 @@
-from firepit.exceptions import InvalidAttr
+from firepit.exceptions import InvalidAttr, UnknownViewname
 from firepit.query import (
+    Column,
     Query,
     Projection,
     Table,
-    Filter,
-    Predicate,
-    Count,
     Unique,
     Join,
 )
 from collections import OrderedDict
-from kestrel.codegen.relations import get_entity_id_attribute
+from kestrel.codegen.queries import SQLQuery, get_contains_target_type
 from kestrel.exceptions import KestrelInternalError, MissingEntityAttribute
 
 
@@ -43,35 +41,44 @@ def gen_variable_summary(var_name, var_struct):
     ):
         is_from_direct_datasource = True
 
+    if query_ids and is_from_direct_datasource:
+        type_counts = _get_entity_type_counts(var_struct.store, query_ids)
+    else:
+        type_counts = {}
+
     for entity_type in var_struct.store.types():
         if entity_type not in ("identity", "observed-data"):
-            count = 0
-
-            if query_ids and is_from_direct_datasource:
-                query = Query(
-                    [
-                        Table(entity_type),
-                        Join("__contains", "id", "=", "target_ref"),
-                        Join("__queries", "source_ref", "=", "sco_id"),
-                        Filter([Predicate("query_id", "IN", query_ids)]),
-                        Unique(),
-                        Count(),
-                    ]
-                )
-                result = var_struct.store.run_query(query).fetchall()
-                count = result[0]["count"]
-                if entity_type == var_struct.type and count:
-                    count = count - len(var_struct)
-                    if count < 0:
-                        raise KestrelInternalError(
-                            f"impossible count regarding variable {var_name} and type {entity_type}"
-                        )
+            count = type_counts.get(entity_type, 0)
+            if entity_type == var_struct.type and count:
+                count = count - len(var_struct)
+                if count < 0:
+                    raise KestrelInternalError(
+                        f"impossible count regarding variable {var_name} and type {entity_type}"
+                    )
 
             summary[f"{entity_type}*"] = count
 
     return summary, footnote
 
 
+def _get_entity_type_counts(store, query_ids):
+    # count (entity, record, query) of all entity types in one grouped query
+    # the entity type is the prefix of the STIX id, e.g., "process--..."
+    entity_type = get_contains_target_type("target_ref", store.dialect)
+    placeholders = ", ".join([store.placeholder] * len(query_ids))
+    query = SQLQuery(
+        f'SELECT {entity_type} AS "type", COUNT(*) AS "count" FROM'
+        ' (SELECT DISTINCT target_ref, source_ref, query_id FROM "__contains"'
+        ' INNER JOIN "__queries" ON "__contains".source_ref = "__queries".sco_id'
+        f' WHERE query_id IN ({placeholders})) AS "records"'
+        f" GROUP BY {entity_type}",
+        query_ids,
+        "__contains",
+    )
+    rows = store.run_query(query).fetchall()
+    return {row["type"]: row["count"] for row in rows}
+
+
 def _get_variable_query_ids(variable):
     query_ids = []
     if variable.entity_table:
@@ -91,7 +98,7 @@ def _get_variable_query_ids(variable):
 def get_variable_entity_count(variable):
     entity_count = 0
     if variable.entity_table:
-        entity_id_attr = get_entity_id_attribute(variable)
+        entity_id_attr = variable.entity_id_attribute
         try:
             columns = variable.store.columns(variable.entity_table)
         except InvalidAttr as e:
@@ -102,3 +109,25 @@ def get_variable_entity_count(variable):
         if entity_id_attr in columns:
             entity_count = variable.store.count(variable.entity_table)
     return entity_count
+
+
+def get_variable_attributes(variable):
+    attributes = []
+    if variable.entity_table:
+        attributes = list(variable.store.columns(variable.entity_table))
+        # list references such as `opened_connection_refs` are not columns
+        query = Query(
+            [
+                Table("__reflist"),
+                Join(variable.entity_table, "source_ref", "=", "id"),
+                Projection([Column("ref_name", "__reflist")]),
+                Unique(),
+            ]
+        )
+        try:
+            rows = variable.store.run_query(query).fetchall()
+        except (InvalidAttr, UnknownViewname):
+            pass
+        else:
+            attributes.extend([r["ref_name"] for r in rows])
+    return attributes
@@ -1,3 +1,7 @@
 from kestrel.datasource.interface import MODULE_PREFIX, AbstractDataSourceInterface
-from kestrel.datasource.retstruct import ReturnFromFile, ReturnFromStore
+from kestrel.datasource.retstruct import (
+    ReturnFromFile,
+    ReturnFromStore,
+    ReturnFromShards,
+)
 from kestrel.datasource.manager import DataSourceManager
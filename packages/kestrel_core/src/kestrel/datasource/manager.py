@@ -1,5 +1,13 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from kestrel.absinterface import InterfaceManager
-from kestrel.datasource import MODULE_PREFIX, AbstractDataSourceInterface
+from kestrel.datasource import (
+    MODULE_PREFIX,
+    AbstractDataSourceInterface,
+    ReturnFromShards,
+)
 from kestrel.exceptions import (
     DataSourceInterfaceNotFound,
     InvalidDataSourceInterfaceImplementation,
@@ -8,7 +16,17 @@ from kestrel.exceptions import (
 
 
 class DataSourceManager(InterfaceManager):
-    def __init__(self, config):
+    """Data source interfaces of a session.
+
+    Args:
+        config (dict): the session config.
+
+        store_factory (callable): open a new connection to the session store;
+          queries in background threads write to the store through their own
+          connections. Queries only run in the main thread if not given.
+    """
+
+    def __init__(self, config, store_factory=None):
         super().__init__(
             config,
             "datasources",
@@ -23,13 +41,141 @@ class DataSourceManager(InterfaceManager):
         # important state keeper, required in Session()
         self.queried_data_sources = [None]
 
+        self._store_factory = store_factory
+
+        # queries started by query_ahead() and not joined yet
+        self._queries_ahead = {}
+        self._executor = None
+
     def list_data_sources_from_scheme(self, scheme):
         i, c = self._get_interface_with_config(scheme)
         return i.list_data_sources(c)
 
     def query(self, uri, pattern, session_id, store, limit=None):
         scheme, uri = self._parse_and_complete_uri(uri)
-        i, c = self._get_interface_with_config(scheme)
-        rs = i.query(uri, pattern, session_id, c, store, limit)
+        rs = self._query(scheme, uri, pattern, session_id, store, limit)
         self.queried_data_sources.append(uri)
         return rs
+
+    def query_shards(self, uri, patterns, session_id, store, limit=None):
+        """Query a data source with a pattern split into sub-patterns.
+
+        Sub-queries are executed in parallel up to
+        ``stixquery.max_parallel_subqueries`` in config if the store accepts
+        writes from multiple threads. The limit, if specified, applies to the
+        union of the sub-queries. If the same query is started by :meth:`query_ahead`, this
+        method waits for it to complete and returns its results.
+
+        Returns:
+            AbstractReturnStruct: the results of all sub-queries unioned under
+            one ``query_id`` when loaded to store.
+        """
+        future = self._queries_ahead.pop((uri, tuple(patterns), limit), None)
+        scheme, completed_uri = self._parse_and_complete_uri(uri)
+        if future:
+            rs = future.result()
+        else:
+            rs = self._query_shards(
+                scheme, completed_uri, patterns, session_id, store, limit
+            )
+        self.queried_data_sources.append(completed_uri)
+        return rs
+
+    def can_query_ahead(self, store):
+        return (
+            self._is_thread_safe(store)
+            and self.config["session"]["max_concurrent_queries"] > 0
+        )
+
+    def query_ahead(self, uri, patterns, session_id, store, limit=None):
+        """Start a query in background to be joined by :meth:`query_shards`.
+
+        Up to ``session.max_concurrent_queries`` in config are executed at the
+        same time. The data source is recorded as queried only when the query
+        is joined, so the default data source follows the statement order.
+
+        Returns:
+            bool: whether the query is started.
+        """
+        if not self.can_query_ahead(store):
+            return False
+        key = (uri, tuple(patterns), limit)
+        if key not in self._queries_ahead:
+            scheme, completed_uri = self._parse_and_complete_uri(uri)
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(
+                    self.config["session"]["max_concurrent_queries"]
+                )
+            self._queries_ahead[key] = self._executor.submit(
+                self._query_shards_in_thread,
+                scheme,
+                completed_uri,
+                patterns,
+                session_id,
+                limit,
+            )
+        return True
+
+    def cancel_queries_ahead(self):
+        """Discard queries started ahead but not joined.
+
+        Queries not started yet are cancelled and the running ones are waited
+        for, so no query writes to the store afterwards.
+        """
+        for future in self._queries_ahead.values():
+            future.cancel()
+        self._queries_ahead.clear()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _query(self, scheme, uri, pattern, session_id, store, limit):
+        i, c = self._get_interface_with_config(scheme)
+        return i.query(uri, pattern, session_id, c, store, limit)
+
+    def _query_shards(self, scheme, uri, patterns, session_id, store, limit):
+        if len(patterns) == 1:
+            return self._query(scheme, uri, patterns[0], session_id, store, limit)
+
+        def _query_in_thread(pattern):
+            with self._thread_store() as thread_store:
+                return self._query(
+                    scheme, uri, pattern, session_id, thread_store, limit
+                )
+
+        if self._is_thread_safe(store):
+            max_workers = self.config["stixquery"]["max_parallel_subqueries"]
+        else:
+            max_workers = 1
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers) as executor:
+                ret_structs = list(executor.map(_query_in_thread, patterns))
+        else:
+            ret_structs = [
+                self._query(scheme, uri, pattern, session_id, store, limit)
+                for pattern in patterns
+            ]
+
+        return ReturnFromShards(str(uuid.uuid4()), ret_structs, limit)
+
+    def _query_shards_in_thread(self, scheme, uri, patterns, session_id, limit):
+        with self._thread_store() as thread_store:
+            return self._query_shards(
+                scheme, uri, patterns, session_id, thread_store, limit
+            )
+
+    @contextmanager
+    def _thread_store(self):
+        # the connection of the session store is used by the main thread
+        # concurrently, so each background query has its own connection
+        store = self._store_factory()
+        try:
+            yield store
+        finally:
+            store.close()
+
+    def _is_thread_safe(self, store):
+        # data source interfaces may write to store in query(); concurrent
+        # writers through their own connections are only safe on PostgreSQL
+        return self._store_factory is not None and store.dialect == "postgresql"
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+from kestrel.codegen.queries import SQLQuery
+
 
 class AbstractReturnStruct(ABC):
     """The abstract class for creating return objects.
@@ -54,3 +56,50 @@ class ReturnFromStore(AbstractReturnStruct):
 
     def load_to_store(self, store):
         return self.query_id
+
+
+class ReturnFromShards(AbstractReturnStruct):
+    """The return structure when a query is split into sub-queries.
+
+    The results of all sub-queries are loaded to store and unioned under one
+    ``query_id``. If a limit is given, only the records (observations) of
+    the first ``limit`` observations in the union and their entities are
+    associated with ``query_id``.
+
+    Args:
+        query_id (str): typically just a UUID.
+        ret_structs ([AbstractReturnStruct]): the return structures of the
+          sub-queries.
+        limit (int): the maximum number of records in the union.
+
+    """
+
+    def __init__(self, query_id, ret_structs, limit=None):
+        self.query_id = query_id
+        self.ret_structs = ret_structs
+        self.limit = limit
+
+    def load_to_store(self, store):
+        sub_query_ids = [rs.load_to_store(store) for rs in self.ret_structs]
+        ph = store.placeholder
+        placeholders = ", ".join([ph] * len(sub_query_ids))
+        text = (
+            'INSERT INTO "__queries" (sco_id, query_id)'
+            f" SELECT DISTINCT sco_id, {ph} FROM"
+            f' "__queries" WHERE query_id IN ({placeholders})'
+        )
+        values = [self.query_id] + sub_query_ids
+        if self.limit:
+            observations = (
+                f'SELECT DISTINCT sco_id FROM "__queries"'
+                f" WHERE query_id IN ({placeholders})"
+                f" AND sco_id LIKE 'observed-data--%%' LIMIT {ph}"
+            )
+            text += (
+                f" AND (sco_id IN ({observations}) OR sco_id IN"
+                f' (SELECT target_ref FROM "__contains"'
+                f" WHERE source_ref IN ({observations})))"
+            )
+            values += (sub_query_ids + [self.limit]) * 2
+        store.run_query(SQLQuery(text, values, "__queries"))
+        return self.query_id
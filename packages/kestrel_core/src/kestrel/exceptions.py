@@ -55,6 +55,14 @@ class DebugCacheLinkOccupied(KestrelException):
         )
 
 
+class DisplayExpired(KestrelException):
+    def __init__(self, error):
+        super().__init__(
+            f"{error} after the session executed other statements or closed",
+            "use the results before executing other statements",
+        )
+
+
 ################################################################
 #                       Kestrel Syntax Errors
 ################################################################
@@ -137,6 +145,14 @@ class EmptyInputVariable(KestrelException):
         )
 
 
+class EmptyInputData(KestrelException):
+    def __init__(self, source):
+        super().__init__(
+            f'no entity in input data "{source}"',
+            "provide input data with entities to construct a Kestrel variable",
+        )
+
+
 class InvalidAttribute(KestrelException):
     def __init__(self, attribute):
         super().__init__(
@@ -38,19 +38,19 @@ import typing
 from datetime import datetime
 
 from kestrel.syntax.parser import parse_kestrel
+from kestrel.syntax.cache import ParseCache, split_statements
 from kestrel.symboltable.symtable import SymbolTable
 from kestrel.datasource.manager import DataSourceManager
 from kestrel.analytics.manager import AnalyticsManager
-from kestrel.syntax.utils import (
-    get_entity_types,
-    get_keywords,
-    all_relations,
-)
+from kestrel.syntax.utils import CompletionIndex, get_completion_index
 from firepit.timestamp import timefmt
 
 _logger = logging.getLogger(__name__)
 
 ISO_TS_RE = re.compile(r"\d{4}(-\d{2}(-\d{2}(T\d{2}(:\d{2}(:\d{2}Z?)?)?)?)?)?")
+OUTPUT_VAR_RE = re.compile(r"^\s*[A-Za-z_][\w-]*\s*=(?!=)")
+GET_FIND_RE = re.compile(r"^\s*(?:GET|FIND)\s+([A-Za-z_][\w-]*)", re.IGNORECASE)
+WORD_RE = re.compile(r"[A-Za-z_][\w-]*")
 
 
 @typechecked
@@ -60,6 +60,7 @@ def do_complete(
     datasource_manager: DataSourceManager,
     analytics_manager: AnalyticsManager,
     symtable: SymbolTable,
+    parse_cache: typing.Optional[ParseCache] = None,
 ) -> typing.Iterable[str]:
     _logger.debug("auto_complete function starts...")
 
@@ -74,7 +75,12 @@ def do_complete(
     _logger.debug(f"line to parse: {line_to_parse}")
 
     try:
-        ast = parse_kestrel(line_to_parse)
+        if parse_cache is not None:
+            # only the statement under the cursor is parsed if the previous
+            # statements in the code block are cached
+            ast = parse_cache.parse_tail(line_to_parse)
+        else:
+            ast = parse_kestrel(line_to_parse)
 
     except lark.exceptions.UnexpectedCharacters as e:
         suggestions = ["% illegal char in huntflow %"]
@@ -92,7 +98,7 @@ def do_complete(
         expected_tokens = e.accepts or e.expected
         expected_values = []
         varnames = list(symtable.keys())
-        keywords = set(get_keywords())
+        index = get_completion_index()
         for token in expected_tokens:
             _logger.debug("token: %s", token)
             if token == "VARIABLE":
@@ -127,24 +133,21 @@ def do_complete(
                     )
                 )
             elif token == "ENTITY_TYPE":
-                expected_values.extend(get_entity_types())
+                expected_values.extend(index.entity_types)
             elif token == "RELATION":
-                expected_values.extend(all_relations)
+                expected_values.extend(index.relations)
             elif token == "REVERSED":
                 expected_values.append("BY")
             elif token == "EQUAL":
                 expected_values.append("=")
-            elif token == "ATTRIBUTE":
-                # TODO: attribute completion
-                # https://github.com/opencybersecurityalliance/kestrel-lang/issues/79
-                _logger.debug(f"TODO: ATTRIBUTE COMPLETION")
-            elif token == "ENTITY_ATTRIBUTE_PATH":
-                # TODO: attribute completion
-                # https://github.com/opencybersecurityalliance/kestrel-lang/issues/79
-                _logger.debug(f"TODO: ATTRIBUTE COMPLETION")
+            elif token in ("ATTRIBUTE", "ATTRIBUTES", "ENTITY_ATTRIBUTE_PATH"):
+                _logger.debug("auto-complete attribute")
+                expected_values.extend(
+                    _do_complete_attribute(line_to_parse, symtable, index)
+                )
             elif token == "COMMA":
                 expected_values.append(",")
-            elif token in keywords:
+            elif token in index.keywords:
                 if last_word_prefix and last_word_prefix.islower():
                     token = token.lower()
                 expected_values.append(token)
@@ -268,3 +271,25 @@ def _do_complete_interface(
     else:
         expected_values = [scheme + "://" for scheme in schemes]
     return expected_values
+
+
+def _do_complete_attribute(
+    line: str, symtable: SymbolTable, index: CompletionIndex
+) -> typing.Iterable[str]:
+    stmts = split_statements(line)
+    if not stmts:
+        return []
+    stmt = OUTPUT_VAR_RE.sub("", stmts[-1], count=1)
+
+    # GET/FIND: attributes in WHERE clause are of the returned entity type
+    matched = GET_FIND_RE.match(stmt)
+    if matched:
+        return index.entity_attributes.get(matched.group(1), ())
+
+    # other commands: the first variable is the input variable
+    for word in WORD_RE.findall(stmt):
+        if word in symtable:
+            # served from the schema cache of the variable after first request
+            return symtable[word].attributes
+
+    return []
@@ -1,5 +1,6 @@
 import logging
 import re
+from typing import Optional
 
 from kestrel.syntax.utils import get_all_input_var_names, timedelta_seconds
 from kestrel.syntax.reference import deref_and_flatten_value_to_list
@@ -15,7 +16,7 @@ from kestrel.exceptions import (
     MissingDataSource,
 )
 from kestrel.codegen.relations import stix_2_0_ref_mapping, generic_relations
-from kestrel.semantics.reference import make_deref_func, make_var_timerange_func
+from kestrel.semantics.reference import DerefCache, make_batched_deref_funcs
 
 _logger = logging.getLogger(__name__)
 
@@ -26,6 +27,7 @@ def semantics_processing(
     store: SqlStorage,
     data_source_manager: DataSourceManager,
     config: dict,
+    deref_cache: Optional[DerefCache] = None,
 ):
     # semantics checking and completion
 
@@ -44,11 +46,13 @@ def semantics_processing(
         var_struct = symtable[stmt["input"]]
         stmt["attrs"] = _normalize_attrs(stmt, var_struct)
 
-    deref_func = make_deref_func(store, symtable)
-    get_timerange_func = make_var_timerange_func(store, symtable)
+    references = stmt["where"].get_references() if "where" in stmt else []
+    deref_func, get_timerange_func = make_batched_deref_funcs(
+        store, symtable, references, deref_cache
+    )
 
     if "where" in stmt:
-        # 1. deref()
+        # 1. deref(): all references in the pattern are fetched in batch
         stmt["where"].deref(deref_func, get_timerange_func)
 
         # 2. add_center_entity()
@@ -73,6 +77,12 @@ def semantics_processing(
                 )
             )
             stmt["stixpattern"] = stmt["where"].to_stix(stmt["timerange"], time_adj)
+            stmt["stixpattern_shards"] = stmt["where"].to_stix_shards(
+                stmt["timerange"],
+                time_adj,
+                config["stixquery"]["max_in_list_size"],
+                config["stixquery"]["max_subqueries"],
+            )
 
     if "arguments" in stmt:
         stmt["arguments"] = {
@@ -1,69 +1,230 @@
 import logging
+from collections import defaultdict
+from typing import Iterable, Optional
 from typeguard import typechecked
+from firepit.exceptions import InvalidAttr, InvalidStixPath, UnknownViewname
+from firepit.query import Aggregation, Column, Join, Projection, Query, Table, Unique
 from firepit.sqlstorage import SqlStorage
 from firepit.timestamp import to_datetime
+from firepit.validate import validate_path
 from kestrel.symboltable.symtable import SymbolTable
 from kestrel.syntax.reference import Reference
-from kestrel.exceptions import (
-    InvalidAttribute,
-    KestrelInternalError,
-)
+from kestrel.codegen.queries import SQLQuery
+from kestrel.exceptions import InvalidAttribute
 
 _logger = logging.getLogger(__name__)
 
 
-@typechecked
-def make_deref_func(store: SqlStorage, symtable: SymbolTable):
-    def deref(reference: Reference):
-        _logger.debug(f"deref {reference}")
-        entity_table = symtable[reference.variable].entity_table
-
-        try:
-            store_return = store.lookup(entity_table, reference.attribute)
-        except InvalidAttr as e:
-            _logger.warning(f"cannot deref {reference}. Invalid attribute in firepit.")
-            raise InvalidAttribute(e.message)
-
-        if reference.attribute not in store_return[0]:
-            _logger.warning(f"firepit does not return the correct column.")
-            raise KestrelInternalError(
-                f"firepit does not return {reference} correctly."
-            )
-
-        values = [row[reference.attribute] for row in store_return]
+class DerefCache:
+    """Cache of dereferenced attribute values and time ranges of variables.
+
+    Values are keyed by (variable name, symbol table generation, attribute) and
+    time ranges by (variable name, symbol table generation), so a rebound
+    variable never serves the values of its previous binding. Use
+    :meth:`invalidate` to drop the entries of previous bindings, and
+    :meth:`clear` to drop all entries when new data is loaded to the store.
+
+    Attributes:
+        hits (int): number of attributes served from the cache.
+
+        misses (int): number of attributes queried from the store.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+        self._timeranges = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def load(self, store, symtable, var_name, attributes):
+        """Query uncached attributes of a variable in one query."""
+        generation = symtable.generation(var_name)
+        missing = [
+            attr
+            for attr in attributes
+            if (var_name, generation, attr) not in self._values
+        ]
+        self.hits += len(attributes) - len(missing)
+        self.misses += len(missing)
+        if missing or (var_name, generation) not in self._timeranges:
+            entity_table = symtable[var_name].entity_table
+            attr2values, timerange = _query_references(store, entity_table, missing)
+            for attr, values in attr2values.items():
+                self._values[(var_name, generation, attr)] = values
+            self._timeranges[(var_name, generation)] = timerange
+
+    def get_values(self, store, symtable, reference):
+        key = (
+            reference.variable,
+            symtable.generation(reference.variable),
+            reference.attribute,
+        )
+        if key not in self._values:
+            self.load(store, symtable, reference.variable, [reference.attribute])
+        return self._values[key]
+
+    def get_timerange(self, store, symtable, reference):
+        key = (reference.variable, symtable.generation(reference.variable))
+        if key not in self._timeranges:
+            self.load(store, symtable, reference.variable, [])
+        return self._timeranges[key]
+
+    def invalidate(self, var_name):
+        """Drop all cached entries of a variable, e.g., the name is rebound."""
+        self._values = {k: v for k, v in self._values.items() if k[0] != var_name}
+        self._timeranges = {
+            k: v for k, v in self._timeranges.items() if k[0] != var_name
+        }
+
+    def clear(self):
+        """Drop all cached entries, e.g., new data in the store."""
+        self._values.clear()
+        self._timeranges.clear()
 
-        # filter out None
-        values = [v for v in values if v]
 
-        # dedup
-        values = tuple(set(values))
-
-        _logger.debug(f"deref results: {str(values)}")
+@typechecked
+def make_batched_deref_funcs(
+    store: SqlStorage,
+    symtable: SymbolTable,
+    references: Iterable[Reference],
+    deref_cache: Optional[DerefCache] = None,
+):
+    """Make deref and timerange functions for a batch of references.
+
+    References are grouped by variable. For each variable, the deduplicated
+    values of all referred attributes and the first/last observed time of the
+    variable are fetched in one query. The returned functions serve references
+    from the prefetched results. References not in the batch are queried at
+    first use.
+
+    Args:
+        deref_cache: session-level cache to reuse results across statements.
+          If not given, results are only kept for the returned functions.
+
+    Returns:
+        (deref_func, get_timerange_func)
+    """
+    if deref_cache is None:
+        deref_cache = DerefCache()
+
+    var2attrs = defaultdict(list)
+    for reference in references:
+        if reference.attribute not in var2attrs[reference.variable]:
+            var2attrs[reference.variable].append(reference.attribute)
+
+    for var_name, attributes in var2attrs.items():
+        deref_cache.load(store, symtable, var_name, attributes)
 
+    def deref(reference: Reference):
+        values = deref_cache.get_values(store, symtable, reference)
+        _logger.debug(f"deref {reference} from batched results: {str(values)}")
         return values
 
-    return deref
-
-
-@typechecked
-def make_var_timerange_func(store: SqlStorage, symtable: SymbolTable):
     def get_timerange(reference: Reference):
-        entity_table = symtable[reference.variable].entity_table
-
-        summary = store.summary(entity_table)
-        if summary["first_observed"] is None:
-            start = None
-        else:
-            start = to_datetime(summary["first_observed"])
-        if summary["last_observed"] is None:
-            end = None
+        return deref_cache.get_timerange(store, symtable, reference)
+
+    return deref, get_timerange
+
+
+def _query_references(store, entity_table, attributes):
+    # return ({attribute: (values)}, timerange)
+    if not entity_table:
+        return {attr: tuple() for attr in attributes}, None
+
+    # distinct values of each attribute in its own subquery, so joins of
+    # references do not drop or duplicate values of other attributes; the
+    # subqueries are tagged with the attribute index and put together with
+    # UNION ALL, each attribute in its own column to keep its type
+    columns = store.columns(entity_table)
+    subqueries = []
+    for i, attr in enumerate(attributes):
+        attr_query = Query(entity_table)
+        if attr in columns:
+            attr_query.append(Projection([Column(attr, entity_table, "__value")]))
         else:
-            end = to_datetime(summary["last_observed"])
-        if start is None and end is None:
-            tr = None
-        else:
-            tr = (start, end)
-
-        return tr
+            try:
+                validate_path(attr)
+            except InvalidStixPath:
+                raise InvalidAttribute(attr)
+            joins, table, column = store.path_joins(entity_table, None, attr)
+            attr_query.extend(joins)
+            attr_query.append(Projection([Column(column, table, "__value")]))
+        attr_query.append(Unique())
+        text, values = attr_query.render(store.placeholder, store.dialect)
+        selection = ", ".join(
+            f'"__value" AS "{a}"' if a == attr else f'NULL AS "{a}"' for a in attributes
+        )
+        subqueries.append(
+            (f'SELECT {i} AS "__attr", {selection} FROM ({text}) AS "v{i}"', values)
+        )
+    values_query = SQLQuery(
+        " UNION ALL ".join(text for text, _ in subqueries),
+        tuple(v for _, values in subqueries for v in values),
+        entity_table,
+    )
+
+    # first/last observed time of the variable
+    timerange_query = Query(
+        [
+            Table(entity_table),
+            Join("__contains", "id", "=", "target_ref"),
+            Join("observed-data", "source_ref", "=", "id"),
+            Aggregation(
+                [
+                    ("MIN", Column("first_observed", "observed-data"), "__first"),
+                    ("MAX", Column("last_observed", "observed-data"), "__last"),
+                ]
+            ),
+        ]
+    )
+
+    if attributes:
+        vtext, vvalues = values_query.render(store.placeholder, store.dialect)
+        ttext, tvalues = timerange_query.render(store.placeholder, store.dialect)
+
+        # the aggregation always returns one row, so LEFT JOIN keeps the time
+        # range even if there is no value
+        query = SQLQuery(
+            f'SELECT * FROM ({ttext}) AS "t" LEFT JOIN ({vtext}) AS "v" ON 1 = 1',
+            tvalues + vvalues,
+            entity_table,
+        )
+    else:
+        query = timerange_query
+
+    try:
+        rows = store.run_query(query).fetchall()
+    except UnknownViewname:
+        # no observation in store, e.g., variables from NEW
+        _logger.debug(f"no observation found for {entity_table}")
+        rows = (
+            [
+                {"__first": None, "__last": None, **row}
+                for row in store.run_query(values_query).fetchall()
+            ]
+            if attributes
+            else []
+        )
+    except InvalidAttr as e:
+        _logger.warning(f"cannot deref {entity_table}. Invalid attribute in firepit.")
+        raise InvalidAttribute(e.message)
+
+    if rows and rows[0]["__first"] is not None:
+        timerange = (to_datetime(rows[0]["__first"]), to_datetime(rows[0]["__last"]))
+    else:
+        timerange = None
+
+    # keep values in order, filter out None
+    attr2values = {
+        attr: tuple(
+            dict.fromkeys(
+                row[attr] for row in rows if row.get("__attr") == i and row[attr]
+            )
+        )
+        for i, attr in enumerate(attributes)
+    }
 
-    return get_timerange
+    return attr2values, timerange
@@ -56,20 +56,31 @@ import time
 import math
 import lark
 import atexit
-from contextlib import AbstractContextManager
+import functools
+from copy import deepcopy
+from contextlib import AbstractContextManager, contextmanager
 
 from kestrel.exceptions import (
+    KestrelException,
     KestrelSyntaxError,
     InvalidStixPattern,
     DebugCacheLinkOccupied,
 )
-from kestrel.syntax.parser import parse_kestrel
+from kestrel.syntax.cache import ParseCache
 from kestrel.semantics.processor import semantics_processing
+from kestrel.semantics.reference import DerefCache
 from kestrel.semantics.completor import do_complete
 from kestrel.codegen import commands
+from kestrel.codegen.prefetch import PrefetchCache
+from kestrel.codegen.materialize import MaterializedViews
+from kestrel.codegen.indexes import IndexAdvisor
+from kestrel.codegen.relations import remove_unused_id_sets
+from kestrel.codegen.queries import SQLQuery
+from kestrel.codegen.sharedstore import SharedSQLiteStorage
 from kestrel.codegen.display import DisplayBlockSummary
 from kestrel.codegen.summary import gen_variable_summary
 from kestrel.symboltable.symtable import SymbolTable
+from kestrel.syntax.utils import get_all_input_var_names
 from kestrel.utils import (
     set_current_working_directory,
     resolve_path_in_kestrel_env_var,
@@ -228,14 +239,27 @@ class Session(AbstractContextManager):
         self._logging_setup()
 
         # local database of SQLite or PostgreSQL
-        if not store_path:
-            # use the default local database in config.py
-            local_database_path = self.config["session"]["local_database_path"]
-            if "://" in local_database_path:
-                store_path = local_database_path
-            else:
-                store_path = os.path.join(self.runtime_directory, local_database_path)
-        self.store = get_storage(store_path, self.session_id)
+        shared_store_config = self.config["shared_store"]
+        store_factory = None
+        if not store_path and shared_store_config["path"]:
+            # persistent SQLite database shared by sessions
+            self.store = SharedSQLiteStorage(
+                os.path.expanduser(shared_store_config["path"]),
+                shared_store_config["busy_timeout"],
+            )
+        else:
+            if not store_path:
+                # use the default local database in config.py
+                local_database_path = self.config["session"]["local_database_path"]
+                if "://" in local_database_path:
+                    store_path = local_database_path
+                else:
+                    store_path = os.path.join(
+                        self.runtime_directory, local_database_path
+                    )
+            self.store = get_storage(store_path, self.session_id)
+            # connections for data source queries in background threads
+            store_factory = functools.partial(get_storage, store_path, self.session_id)
 
         # Symbol Table
         # linking variables in syntax with internal data structure
@@ -243,9 +267,29 @@ class Session(AbstractContextManager):
         # {"var": VarStruct}
         self.symtable = SymbolTable()
 
-        self.data_source_manager = DataSourceManager(self.config)
+        self.data_source_manager = DataSourceManager(self.config, store_factory)
         self.analytics_manager = AnalyticsManager(self.config)
 
+        # statement-level parse cache for repeated execution/completion
+        self.parse_cache = ParseCache(self.config["session"]["parse_cache_size"])
+
+        # dereferenced values of variable attributes reused across statements
+        self.deref_cache = DerefCache()
+
+        # prefetch results in the store reused across statements
+        self.prefetch_cache = PrefetchCache()
+
+        # views of frequently used variables promoted to tables in the store
+        self.materialized_views = MaterializedViews(
+            self.store, self.config["materialization"]
+        )
+
+        # indexes on join keys of relation queries ensured after ingestion
+        self.index_advisor = IndexAdvisor(self.store)
+
+        # temporary tables of DISP results kept until the next execution
+        self.display_snapshots = []
+
         atexit.register(self.close)
 
     def execute(self, codeblock):
@@ -271,8 +315,23 @@ class Session(AbstractContextManager):
             statement in the inputted code block.
         """
         ast = self.parse(codeblock)
+        self.drop_display_snapshots()
         return self._execute_ast(ast)
 
+    def drop_display_snapshots(self, snapshots=None):
+        """Drop the temporary tables of DISP results.
+
+        Args:
+            snapshots (list): the tables to drop, all tables if not given.
+        """
+        if snapshots is None:
+            snapshots = list(self.display_snapshots)
+        for snapshot in snapshots:
+            self.store.run_query(
+                SQLQuery(f'DROP TABLE IF EXISTS "{snapshot}"', (), snapshot)
+            ).close()
+            self.display_snapshots.remove(snapshot)
+
     def parse(self, codeblock):
         """Parse a Kestrel code block.
 
@@ -289,7 +348,7 @@ class Session(AbstractContextManager):
             tree* for one Kestrel statement in the inputted code block.
         """
         try:
-            ast = parse_kestrel(
+            ast = self.parse_cache.parse(
                 codeblock,
                 self.config["language"]["default_variable"],
                 self.config["language"]["default_sort_order"],
@@ -309,6 +368,9 @@ class Session(AbstractContextManager):
             raise KestrelSyntaxError(
                 err.line, err.column, "token", err.token, err.accepts or err.expected
             )
+        _logger.debug(
+            f"parse cache: {self.parse_cache.hits} hits, {self.parse_cache.misses} misses"
+        )
         return ast
 
     def get_variable_names(self):
@@ -361,6 +423,7 @@ class Session(AbstractContextManager):
             self.data_source_manager,
             self.analytics_manager,
             self.symtable,
+            self.parse_cache,
         )
 
     def close(self):
@@ -383,6 +446,9 @@ class Session(AbstractContextManager):
 
         # close store/database
         if self.store:
+            # tables of materialized views are not left in a shared store
+            self.materialized_views.release_all()
+            self.drop_display_snapshots()
             # release resources
             self.store.close()
             # ensure this does not executed twice
@@ -406,57 +472,181 @@ class Session(AbstractContextManager):
         new_vars = []
 
         start_exec_ts = time.time()
-        for stmt in ast:
-            try:
-                # semantic checking and unfolding
-                semantics_processing(
-                    stmt,
-                    self.symtable,
-                    self.store,
-                    self.data_source_manager,
-                    self.config,
-                )
-
-                # code generation and execution
-                execute_cmd = getattr(commands, stmt["command"])
-
-                # set current working directory for each command execution
-                # use this to implicitly pass runtime_dir as an argument to each command
-                # the context manager switch back cwd when the command execution completes
-                with set_current_working_directory(self.runtime_directory):
-                    output_var_struct, display = execute_cmd(stmt, self)
-
-            # exception completion
-            except StixPatternError as e:
-                raise InvalidStixPattern(e.stix) from e
-
-            # post-processing: symbol table update
-            if output_var_struct is not None:
-                output_var_name = stmt["output"]
-                self._update_symbol_table(output_var_name, output_var_struct)
+        prefetch_queries_saved = self.prefetch_cache.queries_saved
+        prefetch_values_reused = self.prefetch_cache.values_reused
+
+        # data source queries of independent GET statements run in background
+        # while statements and their store operations are executed in order;
+        # the queries also run in the runtime directory as the commands do
+        with set_current_working_directory(
+            self.runtime_directory
+        ), self._independent_gets_queried_ahead(ast):
+            for stmt in ast:
+                try:
+                    # semantic checking and unfolding
+                    semantics_processing(
+                        stmt,
+                        self.symtable,
+                        self.store,
+                        self.data_source_manager,
+                        self.config,
+                        self.deref_cache,
+                    )
 
-                if output_var_name != self.config["language"]["default_variable"]:
-                    if output_var_name in new_vars:
-                        new_vars.remove(output_var_name)
-                    new_vars.append(output_var_name)
+                    # materialized views are restored before being redefined
+                    # and before new data in the store changes their results
+                    if stmt["command"] in ("get", "find", "load", "new", "apply"):
+                        self.materialized_views.release_all()
+                    elif "output" in stmt:
+                        # views of dependent variables read the redefined view
+                        self.materialized_views.release(stmt["output"])
+                        # lazy variables have no view to release yet
+                        for var_name in self.symtable.get_dependents(stmt["output"]):
+                            var_struct = self.symtable[var_name]
+                            if not var_struct.is_deferred:
+                                self.materialized_views.release(var_struct.entity_table)
+
+                    # code generation and execution
+                    execute_cmd = getattr(commands, stmt["command"])
+
+                    # set current working directory for each command execution
+                    # use this to implicitly pass runtime_dir as an argument to each command
+                    # the context manager switch back cwd when the command execution completes
+                    start_cmd_ts = time.time()
+                    with set_current_working_directory(self.runtime_directory):
+                        output_var_struct, display = execute_cmd(stmt, self)
+                    cmd_cost = time.time() - start_cmd_ts
+
+                # exception completion
+                except StixPatternError as e:
+                    raise InvalidStixPattern(e.stix) from e
+
+                # post-processing: attribute cache invalidation
+                # new data in the store may bring new attributes to existing variables
+                # and new records to their dereferenced values and time ranges
+                if stmt["command"] in ("get", "find", "load", "new", "apply"):
+                    for var_struct in self.symtable.values():
+                        var_struct.invalidate_attributes()
+                    self.deref_cache.clear()
+
+                # post-processing: usage of input variables for materialization
+                for input_var_name in get_all_input_var_names(stmt):
+                    if input_var_name != stmt.get("output"):
+                        self.materialized_views.record(
+                            self.symtable[input_var_name], cmd_cost
+                        )
+
+                # post-processing: symbol table update
+                if output_var_struct is not None:
+                    output_var_name = stmt["output"]
+                    self._update_symbol_table(output_var_name, output_var_struct)
+
+                    if output_var_name != self.config["language"]["default_variable"]:
+                        if output_var_name in new_vars:
+                            new_vars.remove(output_var_name)
+                        new_vars.append(output_var_name)
+
+                # post-processing: id sets of removed or redefined views
+                remove_unused_id_sets(self.store)
+
+                if display is not None:
+                    displays.append(display)
 
-            if display is not None:
-                displays.append(display)
+        _logger.debug(
+            f"deref cache: {self.deref_cache.hits} hits, {self.deref_cache.misses} misses"
+        )
+        _logger.debug(
+            f"materialized views: {len(self.materialized_views)} tables,"
+            f" {self.materialized_views.promotions} promotions,"
+            f" {self.materialized_views.evictions} evictions"
+        )
 
         end_exec_ts = time.time()
         execution_time_sec = math.ceil(end_exec_ts - start_exec_ts)
 
         if self.config["session"]["show_execution_summary"] and new_vars:
+            # lazy variables are not evaluated for the summary
+            lazy_vars = [v for v in new_vars if self.symtable[v].is_deferred]
             vars_summary = [
-                gen_variable_summary(vname, self.symtable[vname]) for vname in new_vars
+                gen_variable_summary(vname, self.symtable[vname])
+                for vname in new_vars
+                if vname not in lazy_vars
             ]
-            displays.append(DisplayBlockSummary(vars_summary, execution_time_sec))
+            notes = []
+            if lazy_vars:
+                notes.append(
+                    f"Lazy variables to be evaluated at first use: {', '.join(lazy_vars)}."
+                )
+            prefetch_queries_saved = (
+                self.prefetch_cache.queries_saved - prefetch_queries_saved
+            )
+            prefetch_values_reused = (
+                self.prefetch_cache.values_reused - prefetch_values_reused
+            )
+            if prefetch_values_reused:
+                notes.append(
+                    f"Prefetch served {prefetch_values_reused} entity identifiers"
+                    " from previous results;"
+                    f" data source queries saved: {prefetch_queries_saved}."
+                )
+            displays.append(
+                DisplayBlockSummary(vars_summary, execution_time_sec, notes)
+            )
 
         return displays
 
+    @contextmanager
+    def _independent_gets_queried_ahead(self, ast):
+        if self.data_source_manager.can_query_ahead(self.store):
+            self._query_ahead_independent_gets(ast)
+        try:
+            yield
+        finally:
+            # queries of statements not reached, e.g., after an exception
+            self.data_source_manager.cancel_queries_ahead()
+
+    def _query_ahead_independent_gets(self, ast):
+
+        # a GET is independent if it refers to no variable
+        # the data source may be parsed as a variable name
+        var_names = set(self.symtable) | {stmt.get("output") for stmt in ast}
+        for stmt in ast:
+            if (
+                stmt["command"] == "get"
+                and "datasource" in stmt
+                and stmt["datasource"] not in var_names
+                and not stmt["where"].get_references()
+            ):
+                ahead_stmt = deepcopy(stmt)
+                try:
+                    semantics_processing(
+                        ahead_stmt,
+                        self.symtable,
+                        self.store,
+                        self.data_source_manager,
+                        self.config,
+                    )
+                    self.data_source_manager.query_ahead(
+                        ahead_stmt["datasource"],
+                        ahead_stmt["stixpattern_shards"],
+                        self.session_id,
+                        self.store,
+                        ahead_stmt.get("limit"),
+                    )
+                except KestrelException as e:
+                    # the error is raised when the statement is executed
+                    _logger.debug(f"no query ahead for statement {stmt}: {e}")
+
     def _update_symbol_table(self, output_var_name, output_var_struct):
+        default_var_name = self.config["language"]["default_variable"]
+        if not output_var_struct.is_deferred:
+            output_var_struct.snapshot_statistics()
         self.symtable[output_var_name] = output_var_struct
-        self.symtable[self.config["language"]["default_variable"]] = output_var_struct
+        self.symtable[default_var_name] = output_var_struct
+        # views of dependent variables read the rebound name
+        dependents = self.symtable.get_dependents(output_var_name)
+        for var_name in [output_var_name, default_var_name] + dependents:
+            self.deref_cache.invalidate(var_name)
 
     def _leave_exit_marker(self):
         runtime_dir = pathlib.Path(self.runtime_directory)
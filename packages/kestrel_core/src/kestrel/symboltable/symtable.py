@@ -2,8 +2,36 @@ from kestrel.exceptions import VariableNotExist
 
 
 class SymbolTable(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # generation of each variable: bumped every time the name is rebound
+        self._generations = {var_name: 0 for var_name in self}
+
     def __getitem__(self, var_name):
         try:
             return super().__getitem__(var_name)
         except KeyError as e:
             raise VariableNotExist(var_name)
+
+    def __setitem__(self, var_name, var_struct):
+        super().__setitem__(var_name, var_struct)
+        self._generations[var_name] = self._generations.get(var_name, -1) + 1
+
+    def generation(self, var_name):
+        return self._generations.get(var_name, 0)
+
+    def get_dependents(self, var_name):
+        # names of variables whose views read the variable, transitively
+        dependents = []
+        var_names = [var_name]
+        while var_names:
+            name = var_names.pop()
+            for other, var_struct in self.items():
+                if (
+                    other != var_name
+                    and other not in dependents
+                    and name in (var_struct.dependent_variables or ())
+                ):
+                    dependents.append(other)
+                    var_names.append(other)
+        return dependents
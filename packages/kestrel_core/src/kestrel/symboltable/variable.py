@@ -1,7 +1,11 @@
 from firepit.query import Query
 
 from kestrel.codegen.data import dump_data_to_file
-from kestrel.codegen.summary import get_variable_entity_count
+from kestrel.codegen.relations import get_entity_id_attribute
+from kestrel.codegen.summary import (
+    get_variable_attributes,
+    get_variable_entity_count,
+)
 from kestrel.syntax.utils import get_all_input_var_names
 
 
@@ -23,7 +27,15 @@ class VarStruct:
         self.store = store
 
         # pointer (name of table) to internal data path (currently a view in SQLite)
-        self.entity_table = entity_table
+        # see :attr:`entity_table`
+        self._entity_table = entity_table
+
+        # query of a lazy variable whose view is not created yet
+        # see :meth:`defer`
+        self.deferred_query = None
+
+        # number of times the deferred query is fused into other variables
+        self.fused_count = 0
 
         # pointers (names of tables) to join tables for future many-to-many relations
         self.link_tables = link_tables
@@ -31,21 +43,18 @@ class VarStruct:
         # entity/SCO type of the variable
         self.type = entity_type
 
-        # how many entities/SCOs in the variable
-        if length is not None:
-            self.length = length
-        else:
-            self.length = get_variable_entity_count(self)
-        if records_count is not None:
-            self.records_count = records_count
-        elif self.entity_table:
-            summary = self.store.summary(self.entity_table)
-            self.records_count = summary["number_observed"]
-        else:
-            self.records_count = 0
-
-        # TODO: cache of attributes for fast code completion request
-        self.attributes = []
+        # cache of the entity identifier attribute
+        # populated at first access, see :attr:`entity_id_attribute`
+        self._entity_id_attribute = None
+
+        # statistics computed at first access
+        # see :attr:`length` and :attr:`records_count`
+        self._length = length
+        self._records_count = records_count
+
+        # cache of attributes for fast code completion request
+        # populated at first access, see :attr:`attributes`
+        self._attributes = None
 
         # dependent variables
         self.dependent_variables = dep_vars
@@ -55,6 +64,98 @@ class VarStruct:
 
         self.data_source = data_source
 
+    @property
+    def entity_table(self):
+        """Name of the view of the variable in the store.
+
+        The view of a lazy variable is created at first access.
+        """
+        if self.deferred_query is not None:
+            self.materialize()
+        return self._entity_table
+
+    @property
+    def is_deferred(self):
+        """Whether the variable is lazy, i.e., its view is not created yet."""
+        return self.deferred_query is not None
+
+    def defer(self, query):
+        """Make the variable lazy: keep the query to create its view later.
+
+        The query is defined on a table or view in the store, and it can be
+        fused with queries of the following commands into one query before
+        the view is created. See :attr:`entity_table`.
+        """
+        self.deferred_query = query
+
+    def materialize(self):
+        """Create the view of a lazy variable in the store."""
+        if self.deferred_query is not None:
+            self.store.assign_query(self._entity_table, self.deferred_query)
+            self.deferred_query = None
+
+    @property
+    def length(self):
+        """Number of entities/SCOs in the variable.
+
+        The number is counted at first access and cached, so intermediate
+        variables, e.g., the local stage in GET, do not pay for it.
+        """
+        if self._length is None:
+            self._length = get_variable_entity_count(self)
+        return self._length
+
+    @property
+    def records_count(self):
+        """Number of records/observations of the entities in the variable.
+
+        The number is summarized at first access and cached.
+        """
+        if self._records_count is None:
+            if self.entity_table:
+                summary = self.store.summary(self.entity_table)
+                self._records_count = summary["number_observed"]
+            else:
+                self._records_count = 0
+        return self._records_count
+
+    def snapshot_statistics(self):
+        """Compute the statistics now if not yet.
+
+        Data loaded to the store later, e.g., prefetch of another command, can
+        add records to entities in the variable. Snapshot the statistics when
+        the variable is bound in the symbol table to report the numbers at its
+        creation.
+        """
+        return self.length, self.records_count
+
+    @property
+    def attributes(self):
+        """Attributes of the variable, including list references.
+
+        The list is queried from the store at first access and cached until
+        :meth:`invalidate_attributes` is called.
+        """
+        if self._attributes is None:
+            self._attributes = get_variable_attributes(self)
+        return self._attributes
+
+    @property
+    def entity_id_attribute(self):
+        """The attribute to identify entities in the variable, e.g., ``pid``.
+
+        The attribute is chosen at first access and cached until
+        :meth:`invalidate_attributes` is called.
+        """
+        if self._entity_id_attribute is None:
+            self._entity_id_attribute = get_entity_id_attribute(self)
+        return self._entity_id_attribute
+
+    def invalidate_attributes(self):
+        """Drop the attribute caches, e.g., new data loaded into the store."""
+        self._attributes = None
+        self._entity_id_attribute = None
+
     def get_entities(self, deref=True):
         if not self.entity_table:
             return []
@@ -0,0 +1,147 @@
+"""Statement-level parse cache for interactive sessions.
+
+A code block (a Jupyter cell, a huntflow) is split into statements at lines
+that open a new statement, e.g., ``x = ...`` or ``DISP ...``. Each statement
+is parsed on its own and its abstract syntax tree is cached by the
+normalized statement text, so re-executing a cell does not pay the parsing
+cost again for unchanged statements.
+
+The split is a lexical heuristic: if any statement fails to parse on its
+own, the whole code block is parsed at once as before, which also gives
+exact line/column in syntax errors.
+
+"""
+
+import copy
+import logging
+import re
+from collections import OrderedDict
+
+from lark.exceptions import LarkError
+
+from kestrel.syntax.parser import (
+    DEFAULT_SORT_ORDER,
+    DEFAULT_VARIABLE,
+    parse_kestrel,
+)
+
+_logger = logging.getLogger(__name__)
+
+STATEMENT_START_RE = re.compile(
+    r"^\s*(?:[A-Za-z_][\w-]*\s*=(?!=)"
+    r"|(?:FIND|GET|GROUP|JOIN|LOAD|NEW|SORT|APPLY|DISP|INFO|SAVE|DESCRIBE)\b)",
+    re.IGNORECASE,
+)
+
+# relative timespan is resolved against the current time in parsing
+RELATIVE_TIMESPAN_RE = re.compile(r"\bLAST\s+\d+", re.IGNORECASE)
+
+
+class ParseCache:
+    """LRU cache of parsed Kestrel statements.
+
+    Args:
+        max_size (int): the maximum number of statements to cache.
+
+    Attributes:
+        hits (int): number of statements served from the cache.
+
+        misses (int): number of statements parsed by Lark.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._asts = OrderedDict()
+
+    def __len__(self):
+        return len(self._asts)
+
+    def parse(
+        self,
+        codeblock,
+        default_variable=DEFAULT_VARIABLE,
+        default_sort_order=DEFAULT_SORT_ORDER,
+    ):
+        """Parse a code block, reusing cached statements.
+
+        Returns:
+            A list of abstract syntax trees (dict), the same as
+            :func:`kestrel.syntax.parser.parse_kestrel`. The trees are copies
+            and can be modified by the caller.
+        """
+        try:
+            return [
+                stmt
+                for chunk in split_statements(codeblock)
+                for stmt in self._parse_statement(
+                    chunk, default_variable, default_sort_order
+                )
+            ]
+        except LarkError:
+            _logger.debug("statement split failed, parse the whole code block")
+            return parse_kestrel(codeblock, default_variable, default_sort_order)
+
+    def parse_tail(
+        self,
+        code,
+        default_variable=DEFAULT_VARIABLE,
+        default_sort_order=DEFAULT_SORT_ORDER,
+    ):
+        """Parse a code block whose last statement may be incomplete.
+
+        Only the last statement is parsed if the previous ones are cached.
+        The last statement is not cached since it changes with every
+        keystroke. Lark exceptions regarding the last statement are raised as
+        is, which is what code auto-completion needs.
+        """
+        chunks = split_statements(code)
+        if not chunks:
+            return []
+        try:
+            ast = [
+                stmt
+                for chunk in chunks[:-1]
+                for stmt in self._parse_statement(
+                    chunk, default_variable, default_sort_order
+                )
+            ]
+        except LarkError:
+            _logger.debug("statement split failed, parse the whole code block")
+            return parse_kestrel(code, default_variable, default_sort_order)
+        return ast + parse_kestrel(chunks[-1], default_variable, default_sort_order)
+
+    def _parse_statement(self, text, default_variable, default_sort_order):
+        key = (text, default_variable, default_sort_order)
+        if key in self._asts:
+            self.hits += 1
+            self._asts.move_to_end(key)
+            ast = self._asts[key]
+        else:
+            self.misses += 1
+            ast = parse_kestrel(text, default_variable, default_sort_order)
+            if not RELATIVE_TIMESPAN_RE.search(text):
+                self._asts[key] = ast
+                if len(self._asts) > self.max_size:
+                    self._asts.popitem(last=False)
+        # semantics processing modifies the AST in place
+        return copy.deepcopy(ast)
+
+
+def split_statements(codeblock):
+    # normalize: strings/comments do not span lines, so indentation, trailing
+    # spaces, blank lines, and comment lines can be safely removed
+    chunks = []
+    lines = []
+    for line in codeblock.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if lines and STATEMENT_START_RE.match(line):
+            chunks.append("\n".join(lines))
+            lines = []
+        lines.append(line)
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
@@ -6,6 +6,7 @@ from typeguard import typechecked
 
 from typing import Tuple, Optional
 import datetime
+import math
 from abc import ABC, abstractmethod
 from firepit.query import Column, Filter, Predicate, Query
 from firepit.sqlstorage import get_path_joins
@@ -48,6 +49,18 @@ class ExtCenteredGraphConstruct(ABC):
     def deref(self, deref_func):
         pass
 
+    @abstractmethod
+    def get_references(self):
+        pass
+
+    @abstractmethod
+    def get_in_lists(self):
+        pass
+
+    @abstractmethod
+    def split_in_list(self, comparison, chunks):
+        pass
+
 
 @typechecked
 class ExtCenteredGraphPattern(ExtCenteredGraphConstruct):
@@ -101,6 +114,20 @@ class ExtCenteredGraphPattern(ExtCenteredGraphConstruct):
             inner = self.graph.to_stix(self.center_entity_type)
         body = "[" + inner + "]"
 
+        tr = self.get_time_window(timerange, timeadj)
+        if tr:
+            tr_stix = f" START t'{timefmt(tr[0])}' STOP t'{timefmt(tr[1])}'"
+        else:
+            tr_stix = ""
+
+        return body + tr_stix
+
+    def get_time_window(
+        self,
+        timerange: Optional[Tuple[datetime.datetime, datetime.datetime]],
+        timeadj: Optional[Tuple[datetime.timedelta, datetime.timedelta]],
+    ):
+        # the START and STOP time in to_stix()
         if timerange:
             tr = timerange
         elif self.timerange:
@@ -109,13 +136,56 @@ class ExtCenteredGraphPattern(ExtCenteredGraphConstruct):
                 tr = (tr[0] + timeadj[0], tr[1] + timeadj[1])
         else:
             tr = None
+        return tr
 
-        if tr:
-            tr_stix = f" START t'{timefmt(tr[0])}' STOP t'{timefmt(tr[1])}'"
-        else:
-            tr_stix = ""
+    def to_stix_shards(
+        self,
+        timerange: Optional[Tuple[datetime.datetime, datetime.datetime]],
+        timeadj: Optional[Tuple[datetime.timedelta, datetime.timedelta]],
+        max_in_list_size: int,
+        max_shards: int,
+    ):
+        # split the largest IN list if larger than max_in_list_size
+        # the union of the results of the returned STIX patterns is the
+        # same as the result of to_stix()
 
-        return body + tr_stix
+        if self.center_entity_type is None:
+            raise KestrelInternalError(
+                "should run add_center_entity() before to_stix_shards()"
+            )
+
+        return [
+            shard.to_stix(timerange, timeadj)
+            for shard in self.split(max_in_list_size, max_shards)
+        ]
+
+    def get_in_lists(self):
+        return self.graph.get_in_lists() if self.graph else []
+
+    def split_in_list(self, comparison, chunks):
+        return self.graph.split_in_list(comparison, chunks)
+
+    def split(self, max_in_list_size: int, max_shards: int):
+        # only the largest IN list is split, into at most max_shards chunks,
+        # so the number of sub-patterns does not multiply across IN lists
+        in_lists = self.get_in_lists()
+        if not in_lists:
+            return [self]
+        largest = max(in_lists, key=lambda comparison: len(comparison.value))
+        if len(largest.value) <= max_in_list_size:
+            return [self]
+        chunk_size = max(max_in_list_size, math.ceil(len(largest.value) / max_shards))
+        chunks = [
+            largest.value[i : i + chunk_size]
+            for i in range(0, len(largest.value), chunk_size)
+        ]
+        shards = []
+        for graph in self.split_in_list(largest, chunks):
+            shard = ExtCenteredGraphPattern(graph)
+            shard.timerange = self.timerange
+            shard.center_entity_type = self.center_entity_type
+            shards.append(shard)
+        return shards
 
     def to_firepit(self):
         if self.center_entity_type is None:
@@ -131,6 +201,10 @@ class ExtCenteredGraphPattern(ExtCenteredGraphConstruct):
         if self.graph is not None:
             self.timerange = self.graph.deref(deref_func, get_timerange_func)
 
+    def get_references(self):
+        # all references to be derefed in the pattern
+        return [] if self.graph is None else self.graph.get_references()
+
     def extend(self, junction_type: str, other_ecgp: Optional[ExtCenteredGraphPattern]):
         if other_ecgp is not None and other_ecgp.graph is not None:
             if self.center_entity_type is None:
@@ -214,6 +288,22 @@ class ECGPJunction(ExtCenteredGraphConstruct):
         rtr = self.rhs.deref(deref_func, get_timerange_func)
         return merge_timeranges((ltr, rtr))
 
+    def get_references(self):
+        return self.lhs.get_references() + self.rhs.get_references()
+
+    def get_in_lists(self):
+        return self.lhs.get_in_lists() + self.rhs.get_in_lists()
+
+    def split_in_list(self, comparison, chunks):
+        # AND/OR are monotone: (l1 OR l2) AND r -> (l1 AND r) OR (l2 AND r)
+        return [
+            ECGPJunction(self.relation, lhs, rhs)
+            for lhs, rhs in zip(
+                self.lhs.split_in_list(comparison, chunks),
+                self.rhs.split_in_list(comparison, chunks),
+            )
+        ]
+
 
 @typechecked
 class ECGPComparison(ExtCenteredGraphConstruct):
@@ -286,6 +376,25 @@ class ECGPComparison(ExtCenteredGraphConstruct):
                 )
         return tr
 
+    def get_references(self):
+        values = self.value if isinstance(self.value, list) else [self.value]
+        return [v for v in values if isinstance(v, Reference)]
+
+    def get_in_lists(self):
+        # NOT IN cannot be split into a union
+        if self.op == "IN" and isinstance(self.value, (list, tuple)):
+            return [self]
+        return []
+
+    def split_in_list(self, comparison, chunks):
+        # x IN (a, b, c, d) -> x IN (a, b) OR x IN (c, d)
+        if comparison is not self:
+            return [self] * len(chunks)
+        return [
+            ECGPComparison(self.attribute, self.op, list(chunk), self.etype)
+            for chunk in chunks
+        ]
+
 
 def _make_extract_func(center_entity_type, preserve_center_or_ext: str):
     def if_preserve_func(entity_type):
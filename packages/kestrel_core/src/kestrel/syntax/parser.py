@@ -1,4 +1,6 @@
+import threading
 from datetime import datetime, timedelta
+from functools import lru_cache
 from importlib.util import find_spec
 from lark import Lark, Token, Transformer
 from lark.visitors import merge_transformers
@@ -18,6 +20,11 @@ from kestrel.syntax.ecgpattern import (
 DEFAULT_VARIABLE = "_"
 DEFAULT_SORT_ORDER = "DESC"
 
+# process-wide parser registry
+# {(grammar, default_variable, default_sort_order): Lark}
+_parsers = {}
+_parsers_lock = threading.Lock()
+
 
 def parse_kestrel(
     stmts, default_variable=DEFAULT_VARIABLE, default_sort_order=DEFAULT_SORT_ORDER
@@ -25,25 +32,72 @@ def parse_kestrel(
     # the public parsing interface for Kestrel
     # return abstract syntax tree
     # check kestrel.lark for details
-    grammar = load_data_file("kestrel.syntax", "kestrel.lark")
-    return Lark(
-        grammar,
-        parser="lalr",
-        transformer=_KestrelT(default_variable, default_sort_order),
-    ).parse(stmts)
+    parser = get_kestrel_parser(default_variable, default_sort_order)
+    return parser.parse(stmts)
 
 
 def parse_ecgpattern(pattern_str) -> ExtCenteredGraphPattern:
-    grammar = load_data_file("kestrel.syntax", "ecgpattern.lark")
+    return get_ecgpattern_parser().parse(pattern_str)
+
+
+def get_kestrel_parser(
+    default_variable=DEFAULT_VARIABLE, default_sort_order=DEFAULT_SORT_ORDER
+):
+    """Get the Kestrel parser, which is built only once per process.
+
+    The parser is keyed by the grammar text and the default variable/sort
+    order baked into its transformer. The transformer is stateless between
+    calls, so the parser can be shared across threads and sessions.
+
+    The LALR analysis result is also cached on disk by Lark (in the system
+    temp directory, validated by a hash of the grammar), so a cold start of
+    the CLI or Jupyter kernel skips grammar analysis.
+    """
+    grammar = _load_grammar("kestrel.lark")
+    return _get_or_build_parser(
+        (grammar, default_variable, default_sort_order),
+        lambda: Lark(
+            grammar,
+            parser="lalr",
+            cache=True,
+            transformer=_KestrelT(default_variable, default_sort_order),
+        ),
+    )
+
+
+def get_ecgpattern_parser():
+    """Get the ECGP parser, which is built only once per process."""
+    grammar = _load_grammar("ecgpattern.lark")
     paths = find_spec("kestrel.syntax").submodule_search_locations
-    return Lark(
-        grammar,
-        parser="lalr",
-        import_paths=paths,
-        transformer=merge_transformers(
-            _ECGPatternT(), kestrel=_KestrelT(token_prefix="kestrel__")
+    return _get_or_build_parser(
+        (grammar, DEFAULT_VARIABLE, DEFAULT_SORT_ORDER),
+        lambda: Lark(
+            grammar,
+            parser="lalr",
+            cache=True,
+            import_paths=paths,
+            transformer=merge_transformers(
+                _ECGPatternT(), kestrel=_KestrelT(token_prefix="kestrel__")
+            ),
         ),
-    ).parse(pattern_str)
+    )
+
+
+@lru_cache(maxsize=None)
+def _load_grammar(grammar_file):
+    return load_data_file("kestrel.syntax", grammar_file)
+
+
+def _get_or_build_parser(key, build_func):
+    parser = _parsers.get(key)
+    if parser is None:
+        with _parsers_lock:
+            # double check: another thread may have built it
+            parser = _parsers.get(key)
+            if parser is None:
+                parser = build_func()
+                _parsers[key] = parser
+    return parser
 
 
 class _ECGPatternT(Transformer):
@@ -1,12 +1,12 @@
 from typeguard import typechecked
-from lark import Lark
+from functools import lru_cache
 from itertools import chain
-from typing import Tuple, Iterable
+from types import MappingProxyType
+from typing import FrozenSet, Iterable, Mapping, NamedTuple, Tuple
 import datetime
 import os
 
 from kestrel.utils import resolve_path
-from kestrel.deprecating import load_data_file
 from kestrel.codegen.relations import (
     all_relations,
     stix_2_0_ref_mapping,
@@ -19,17 +19,30 @@ EXPRESSION_OPTIONS = {"WHERE", "ATTR", "SORT", "LIMIT", "OFFSET"}
 TRANSFORMS = {"TIMESTAMPED", "ADDOBSID", "RECORDS"}
 
 
+class CompletionIndex(NamedTuple):
+    # immutable lookup tables for code auto-completion
+    keywords: FrozenSet[str]
+    entity_types: Tuple[str, ...]
+    relations: Tuple[str, ...]
+    # entity type -> identifier attribute candidates
+    entity_attributes: Mapping[str, Tuple[str, ...]]
+
+
+@lru_cache(maxsize=None)
 def get_keywords():
-    grammar = load_data_file("kestrel.syntax", "kestrel.lark")
-    parser = Lark(grammar, parser="lalr")
+    # avoid circular import: the parser module imports this module
+    from kestrel.syntax.parser import get_kestrel_parser
+
+    parser = get_kestrel_parser()
     alphabet_patterns = filter(lambda x: x.pattern.value.isalnum(), parser.terminals)
     keywords = [x.pattern.value for x in alphabet_patterns] + all_relations
     keywords_lower = map(lambda x: x.lower(), keywords)
     keywords_upper = map(lambda x: x.upper(), keywords)
-    keywords_comprehensive = list(chain(keywords_lower, keywords_upper))
+    keywords_comprehensive = tuple(chain(keywords_lower, keywords_upper))
     return keywords_comprehensive
 
 
+@lru_cache(maxsize=None)
 def get_entity_types():
     all_types = {"x-ibm-finding", "x-oca-asset", "x-oca-event"}
     for mapping in stix_2_0_ref_mapping:
@@ -37,7 +50,18 @@ def get_entity_types():
             if not mapping[i].endswith("-ext"):
                 all_types.add(mapping[i])
     all_types.update(stix_2_0_identical_mapping.keys())
-    return tuple(all_types)
+    return tuple(sorted(all_types))
+
+
+@lru_cache(maxsize=None)
+def get_completion_index():
+    """Get the completion index, which is built only once per process."""
+    return CompletionIndex(
+        keywords=frozenset(get_keywords()),
+        entity_types=get_entity_types(),
+        relations=tuple(sorted(all_relations)),
+        entity_attributes=MappingProxyType(dict(stix_2_0_identical_mapping)),
+    )
 
 
 def get_all_input_var_names(stmt):
@@ -106,3 +106,55 @@ def test_assign_sort_by_indirect_attr(proc_bundle_file):
         s.execute(f"c = GET network-traffic FROM file://{proc_bundle_file} WHERE src_port > 0")
         s.execute("d = c SORT BY dst_ref.value")
         _ = s.get_variable("d")
+
+
+def test_assign_lazy_evaluation(proc_bundle_file):
+    stmt = """
+x = p WHERE pid = 1380 OR name = 'svchost.exe'
+y = SORT x BY pid ASC
+z = y WHERE command_line IS NULL LIMIT 100
+"""
+    with Session() as s:
+        s.execute(f"p = GET process FROM file://{proc_bundle_file} WHERE [process:pid > 0]")
+        s.execute(stmt)
+        expected = {v: len(s.get_variable(v)) for v in ("x", "y", "z")}
+
+    with Session() as s:
+        s.config["session"]["lazy_evaluation"] = True
+        s.execute(f"p = GET process FROM file://{proc_bundle_file} WHERE [process:pid > 0]")
+        out = s.execute(stmt)
+        assert "Lazy variables to be evaluated at first use: x, y, z." in out[-1].footnotes
+        assert all(s.symtable[v].is_deferred for v in ("x", "y", "z"))
+        assert not {"x", "y", "z"} & set(s.store.views())
+
+        # z is fused into one query on p
+        assert len(s.get_variable("z")) == expected["z"]
+        assert s.store._get_view_def("z").count("FROM") == 1
+        assert s.symtable["x"].is_deferred
+
+        # y is referenced a second time: materialized instead of fused
+        s.execute("w = y WHERE pid = 1380")
+        assert not s.symtable["y"].is_deferred
+        assert s.symtable["w"].is_deferred
+        assert len(s.get_variable("y")) == expected["y"]
+        assert len(s.get_variable("x")) == expected["x"]
+
+
+def test_assign_lazy_dependent_not_evaluated(proc_bundle_file):
+    stmts = [
+        f"p = GET process FROM file://{proc_bundle_file} WHERE [process:pid > 0]",
+        "x = p WHERE name = 'svchost.exe'",
+        "p = p WHERE pid = 1380",
+    ]
+    with Session() as s:
+        for stmt in stmts:
+            s.execute(stmt)
+        expected = len(s.get_variable("x"))
+
+    with Session() as s:
+        s.config["session"]["lazy_evaluation"] = True
+        for stmt in stmts:
+            s.execute(stmt)
+        # redefining p does not create the view of its lazy dependent x
+        assert s.symtable["x"].is_deferred
+        assert len(s.get_variable("x")) == expected
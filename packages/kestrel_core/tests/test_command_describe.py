@@ -1,3 +1,4 @@
+import json
 import pytest
 
 from kestrel.session import Session
@@ -25,3 +26,57 @@ newvar = NEW [ {"type": "process", "name": "cmd.exe", "pid": 123}
         assert stats['mean'] == (123 + 99 + 200)/3
         assert stats['min'] == 99
         assert stats['max'] == 200
+
+
+@pytest.fixture
+def proc_var_stmt():
+    procs = [{"name": f"p{i % 3}", "pid": i} for i in range(1, 101)]
+    return f"newvar = NEW process {json.dumps(procs)}"
+
+
+def test_describe_percentiles(proc_var_stmt):
+    with Session() as s:
+        s.config["describe"]["percentiles"] = [0, 0.25, 0.5, 0.75, 1]
+        s.execute(proc_var_stmt)
+        stats = s.execute("DESCRIBE newvar.pid")[0].to_dict()["data"]
+        assert stats["count"] == 100
+        assert stats["0%"] == 1
+        assert stats["25%"] == 25
+        assert stats["50%"] == 50
+        assert stats["75%"] == 75
+        assert stats["100%"] == 100
+
+        stats = s.execute("DESCRIBE newvar.name")[0].to_dict()["data"]
+        assert stats == {"count": 100, "unique": 3, "top": "p1", "freq": 34}
+
+
+def test_describe_approximate(proc_var_stmt):
+    with Session() as s:
+        s.config["describe"]["approximate"] = True
+        s.config["describe"]["sample_size"] = 10
+        s.execute(proc_var_stmt)
+        stats = s.execute("DESCRIBE newvar.pid")[0].to_dict()["data"]
+        assert stats["count"] == 100
+        assert stats["sample_size"] == 10
+        assert 1 <= stats["min"] <= stats["mean"] <= stats["max"] <= 100
+
+        stats = s.execute("DESCRIBE newvar.name")[0].to_dict()["data"]
+        assert stats["count"] == 100
+        assert 1 <= stats["unique"] <= 3
+        assert stats["freq"] <= 10
+
+
+def test_describe_approximate_count():
+    procs = [{"pid": i} if i % 4 else {"pid": i, "name": "cmd.exe"} for i in range(100)]
+    with Session() as s:
+        s.config["describe"]["approximate"] = True
+        s.config["describe"]["sample_size"] = 20
+        s.execute(f"newvar = NEW process {json.dumps(procs)}")
+        stats = s.execute("DESCRIBE newvar.name")[0].to_dict()["data"]
+        assert 0 <= stats["count"] <= 100
+        assert stats["freq"] <= 20
+
+        s.config["describe"]["sample_size"] = 1000
+        stats = s.execute("DESCRIBE newvar.name")[0].to_dict()["data"]
+        assert stats["count"] == 25
+        assert stats["freq"] == 25
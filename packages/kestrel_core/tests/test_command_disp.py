@@ -2,7 +2,7 @@ import os
 import pandas as pd
 import pytest
 
-from kestrel.exceptions import VariableNotExist
+from kestrel.exceptions import DisplayExpired, VariableNotExist
 from kestrel.session import Session
 
 
@@ -108,3 +108,51 @@ def test_disp_sorted_indirect_attr(proc_bundle_file):
         data = out[0].to_dict()["data"]
         names = [d["binary_ref.name"] for d in data]
         assert names == sorted(names, reverse=True)
+
+
+def test_disp_paged(proc_bundle_file):
+    with Session() as s:
+        stmt = f"""
+conns = GET network-traffic
+        FROM file://{proc_bundle_file}
+        WHERE [network-traffic:dst_port > 0]
+"""
+        s.execute(stmt)
+        data = s.execute("DISP conns ATTR src_ref.value, src_port")[0].to_dict()["data"]
+        rows = [tuple(d.items()) for d in data]
+        assert len(rows) == len(set(rows))
+
+        s.config["session"]["display_page_size"] = 7
+        out = s.execute("DISP conns ATTR src_ref.value, src_port")[0]
+        assert len(out.pages) == 1
+        assert "First 7 rows displayed." in out.to_html()
+        assert out.to_dict()["data"] == data
+        assert out.is_complete
+        assert "rows displayed" not in out.to_html()
+
+        out = s.execute("DISP conns ATTR src_ref.value, src_port LIMIT 20 OFFSET 5")[0]
+        assert out.to_dict()["data"] == data[5:25]
+        assert len(out.pages) == 3
+
+        # results not fetched are dropped at the next execution
+        for _ in range(3):
+            out = s.execute("DISP conns")[0]
+            assert len(_disp_tables(s)) == 1
+        s.execute("DISP conns")
+        with pytest.raises(DisplayExpired):
+            out.to_dict()
+
+        # pages are fetched from the results at the DISP statement
+        out = s.execute(
+            """DISP conns ATTR src_ref.value, src_port
+conns = conns WHERE src_port < 0"""
+        )[0]
+        assert out.to_dict()["data"] == data
+        assert not _disp_tables(s)
+
+
+def _disp_tables(session):
+    temp_tables = session.store.connection.execute(
+        "SELECT name FROM sqlite_temp_master WHERE type = 'table'"
+    ).fetchall()
+    return [t["name"] for t in temp_tables if t["name"].startswith("__disp_")]
@@ -3,6 +3,15 @@ import os
 import pytest
 
 from kestrel.session import Session
+from kestrel.codegen.queries import SQLQuery
+import kestrel.codegen.relations
+from kestrel.codegen.prefetch import PrefetchCache
+from kestrel.codegen.relations import (
+    create_view_from_ids,
+    fine_grained_relational_process_filtering,
+    fine_grained_relational_process_filtering_in_store,
+    remove_unused_id_sets,
+)
 
 from .utils import set_empty_kestrel_config, set_no_prefetch_kestrel_config
 
@@ -406,3 +415,165 @@ def test_find_files_contained_by_dir(set_empty_kestrel_config, proc_bundle_file)
         files = s.get_variable("files")
         print(json.dumps(files, indent=4))
         assert len(files) == 10
+
+
+@pytest.mark.parametrize("ref_var", ["parents", "allp", "svchosts"])
+def test_process_identification_engines_identical(
+    set_no_prefetch_kestrel_config, proc_bundle_file, ref_var
+):
+    with Session() as s:
+        stmt = f"""
+                procs = get process
+                        from file://{proc_bundle_file}
+                        where command_line LIKE 'wmic%'
+                parents = FIND process CREATED procs
+                allp = get process
+                       from file://{proc_bundle_file}
+                       where pid > 0
+                svchosts = allp WHERE name = 'svchost.exe'
+                """
+        s.execute(stmt)
+        config = s.config["prefetch"]["process_identification"]
+        ref = s.symtable[ref_var]
+        python_ids = fine_grained_relational_process_filtering(
+            ref, "allp", s.store, config
+        )
+        sql_ids = fine_grained_relational_process_filtering_in_store(
+            ref, "allp", s.store, config
+        )
+        assert python_ids
+        assert set(python_ids) == set(sql_ids)
+
+
+def test_create_view_from_ids(
+    set_no_prefetch_kestrel_config, proc_bundle_file, monkeypatch
+):
+    # small batches to insert the ids in multiple statements
+    monkeypatch.setattr(kestrel.codegen.relations, "IDSETS_INSERT_BATCH_SIZE", 7)
+    with Session() as s:
+        stmt = f"""
+                allp = get process
+                       from file://{proc_bundle_file}
+                       where pid > 0
+                """
+        s.execute(stmt)
+        rows = s.store.lookup("allp", "id")
+        ids = list({row["id"] for row in rows})[:50]
+        create_view_from_ids(s.store, "selected", "process", ids)
+        create_view_from_ids(s.store, "first", "process", ids[:1])
+        assert {row["id"] for row in s.store.lookup("selected", "id")} == set(ids)
+        assert [row["id"] for row in s.store.lookup("first", "id")] == ids[:1]
+        assert s.store.columns("selected") == s.store.columns("allp")
+
+        # the set of a removed or redefined view is deleted at cleanup
+        s.store.remove_view("first")
+        create_view_from_ids(s.store, "selected", "process", ids[:2])
+        create_view_from_ids(s.store, "second", "process", ids[:3])
+        remove_unused_id_sets(s.store)
+        set_ids = s.store.run_query(
+            SQLQuery('SELECT DISTINCT set_id FROM "__idsets"', [], "__idsets")
+        ).fetchall()
+        assert len(set_ids) == 2
+        assert len(s.store.lookup("selected", "id")) == 2
+        assert len(s.store.lookup("second", "id")) == 3
+
+
+@pytest.mark.parametrize("engine", ["python", "sql"])
+def test_find_process_created_process_engine(
+    set_empty_kestrel_config, proc_bundle_file, engine
+):
+    with Session() as s:
+        s.config["prefetch"]["process_identification"]["engine"] = engine
+        stmt = f"""
+                procs = get process
+                        from file://{proc_bundle_file}
+                        where command_line LIKE 'wmic%'
+                parents = FIND process CREATED procs
+                """
+        s.execute(stmt)
+        assert len(s.get_variable("parents")) == 14
+
+
+def test_find_process_prefetch_reuse(set_empty_kestrel_config, proc_bundle_file):
+    with Session() as s:
+        stmt = f"""
+                procs = get process
+                        from file://{proc_bundle_file}
+                        where command_line LIKE 'wmic%'
+                parents = FIND process CREATED procs
+                parents2 = FIND process CREATED procs
+                """
+        summary = s.execute(stmt)[-1].to_dict()["data"]
+        assert len(s.get_variable("parents")) == 14
+        assert len(s.get_variable("parents2")) == 14
+        assert s.prefetch_cache.queries_saved == 1
+        assert s.prefetch_cache.values_reused == 7
+        assert summary["footnotes"] == [
+            "*Number of related records cached.",
+            "Prefetch served 7 entity identifiers from previous results;"
+            " data source queries saved: 1.",
+        ]
+
+
+def test_prefetch_cache():
+    cache = PrefetchCache()
+    key = ("file://x", "process", "pid", None, None)
+    assert cache.lookup(key, [1, 2]) == ([], [1, 2])
+    cache.add(key, [1, 2], "q1")
+    cache.add(key, [3], "q2")
+    assert cache.lookup(key, [2, 4]) == (["q1"], [4])
+    assert cache.lookup(key, [1, 3]) == (["q1", "q2"], [])
+    assert cache.lookup(("file://y",) + key[1:], [1]) == ([], [1])
+    assert cache.queries_saved == 1
+    assert cache.values_reused == 3
+
+
+@pytest.mark.parametrize(
+    "max_records, action, procs_records, parents_records",
+    [
+        (0, "narrow", 7, 14),
+        (10000, "narrow", 7, 14),
+        (3, "narrow", 7, 7),
+        (3, "cap", 7, 7),
+        (3, "skip", 7, 7),
+    ],
+)
+def test_find_process_prefetch_guardrails(
+    set_empty_kestrel_config,
+    proc_bundle_file,
+    max_records,
+    action,
+    procs_records,
+    parents_records,
+):
+    with Session() as s:
+        s.config["prefetch"]["guardrails"]["max_records"] = max_records
+        s.config["prefetch"]["guardrails"]["action"] = action
+        stmt = f"""
+                procs = get process
+                        from file://{proc_bundle_file}
+                        where command_line LIKE 'wmic%'
+                parents = FIND process CREATED procs
+                """
+        s.execute(stmt)
+        assert s.symtable["procs"].records_count == procs_records
+        assert s.symtable["parents"].records_count == parents_records
+
+
+def test_find_linked_type_partitioned_index(set_empty_kestrel_config, proc_bundle_file):
+    with Session() as s:
+        stmt = f"""
+                procs = get process
+                        from file://{proc_bundle_file}
+                        where command_line LIKE 'wmic%'
+                files = FIND file LINKED procs
+                """
+        s.execute(stmt)
+        assert len(s.get_variable("files")) == 2
+
+        viewdef = s.store._get_view_def("files")
+        assert "INTERSECT" not in viewdef
+        plan = s.store._query(f"EXPLAIN QUERY PLAN {viewdef}").fetchall()
+        details = " ".join(row["detail"] for row in plan)
+        assert "__contains_target_type_source_ref_target_ref_kidx" in details
+        assert "SCAN r" not in details and "SCAN c" not in details
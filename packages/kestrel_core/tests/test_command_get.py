@@ -1,11 +1,45 @@
 import json
 import os
 import shutil
+import threading
 
 import pytest
 
 from kestrel.codegen.display import DisplayWarning
+from kestrel.datasource import DataSourceManager
+from kestrel.exceptions import InvalidECGPattern
 from kestrel.session import Session
+from kestrel.semantics.reference import make_batched_deref_funcs
+from kestrel.symboltable.symtable import SymbolTable
+from kestrel.symboltable.variable import VarStruct
+from kestrel.syntax.reference import Reference
+from firepit.timestamp import to_datetime
+
+
+def make_deref_func(store, symtable):
+    # dereference one reference per lookup, as before batched dereference
+    def deref(reference):
+        entity_table = symtable[reference.variable].entity_table
+        store_return = store.lookup(entity_table, reference.attribute)
+        return tuple({row[reference.attribute] for row in store_return} - {None, ""})
+
+    return deref
+
+
+def make_var_timerange_func(store, symtable):
+    # time range of a variable from the summary, as before batched dereference
+    def get_timerange(reference):
+        entity_table = symtable[reference.variable].entity_table
+        summary = store.summary(entity_table)
+        start, end = summary["first_observed"], summary["last_observed"]
+        if start is None and end is None:
+            return None
+        return (
+            to_datetime(start) if start else None,
+            to_datetime(end) if end else None,
+        )
+
+    return get_timerange
 
 
 @pytest.fixture
@@ -331,3 +365,293 @@ def test_regex_escaping_in_stix_bundle(nt_stix_bundles):
         s.execute(stmt1)
         d = s.get_variable("d")
         assert len(d) == 1
+
+
+def test_get_referred_variable_multiple_attributes(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt111 = GET network-traffic
+                         FROM file://{nt_stix_bundles[0]}
+                         WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+
+        # all references to nt111 are dereferenced together
+        stmt2 = f"""
+                 nt112 = GET network-traffic
+                         FROM file://{nt_stix_bundles[1]}
+                         WHERE src_port = nt111.src_port
+                           AND src_ref.value = nt111.src_ref.value
+                           AND dst_ref.value = nt111.dst_ref.value
+                 """
+        s.execute(stmt2)
+
+        nt112 = s.get_variable("nt112")
+        assert len(nt112) == 4
+
+
+def test_batched_deref_same_as_single(nt_stix_bundles):
+    with Session() as s:
+        stmt = f"""
+                nt = GET network-traffic
+                     FROM file://{nt_stix_bundles[0]}
+                     WHERE dst_ref.value = '192.168.56.112'
+                """
+        s.execute(stmt)
+
+        refs = [
+            Reference("nt", "src_port"),
+            Reference("nt", "src_ref.value"),
+            Reference("nt", "dst_ref.value"),
+        ]
+        deref, get_timerange = make_batched_deref_funcs(s.store, s.symtable, refs)
+        deref_single = make_deref_func(s.store, s.symtable)
+        get_timerange_single = make_var_timerange_func(s.store, s.symtable)
+        for ref in refs:
+            assert set(deref(ref)) == set(deref_single(ref))
+            assert get_timerange(ref) == get_timerange_single(ref)
+
+
+def test_deref_cache_across_statements(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt111 = GET network-traffic
+                         FROM file://{nt_stix_bundles[0]}
+                         WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+
+        stmt2 = f"""
+                 nt112 = GET network-traffic
+                         FROM file://{nt_stix_bundles[1]}
+                         WHERE src_port = nt111.src_port
+                 """
+        s.execute(stmt2)
+        assert s.deref_cache.misses == 1
+        assert s.deref_cache.hits == 0
+
+        # records ingested by GET may change the values and time ranges
+        assert len(s.deref_cache) == 0
+        s.execute(stmt2.replace("nt112", "nt112x", 1))
+        assert s.deref_cache.misses == 2
+        assert s.deref_cache.hits == 0
+        assert len(s.get_variable("nt112x")) == 4
+
+        # rebind nt111 to an empty variable: old values should not be served
+        s.deref_cache.load(s.store, s.symtable, "nt111", ["src_port"])
+        assert len(s.deref_cache) == 1
+        s.execute("nt111 = nt111 WHERE src_port = 0")
+        assert len(s.deref_cache) == 0
+        with pytest.raises(InvalidECGPattern):
+            s.execute(stmt2.replace("nt112", "nt112y", 1))
+        assert s.deref_cache.misses == 4
+
+
+def test_deref_cache_dependent_variable_invalidated(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt111 = GET network-traffic
+                         FROM file://{nt_stix_bundles[0]}
+                         WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+        s.execute("x = nt111 WHERE src_port > 0")
+
+        stmt2 = f"""
+                 nt112 = GET network-traffic
+                         FROM file://{nt_stix_bundles[1]}
+                         WHERE src_port = x.src_port
+                 """
+        s.execute(stmt2)
+        assert len(s.get_variable("nt112")) == 4
+
+        # rebind nt111 to an empty variable: x read from nt111 is empty too
+        empty = "'192.168.56.112' AND src_port = 0"
+        s.execute(stmt1.replace("'192.168.56.112'", empty, 1))
+        assert len(s.get_variable("x")) == 0
+        with pytest.raises(InvalidECGPattern):
+            s.execute(stmt2.replace("nt112", "nt112y", 1))
+
+
+def test_symtable_dependents():
+    symtable = SymbolTable()
+    for name, deps in [("a", []), ("b", ["a"]), ("c", ["b"]), ("d", ["x"])]:
+        symtable[name] = VarStruct(None, name, None, None, None, deps, None)
+    assert symtable.get_dependents("a") == ["b", "c"]
+    assert symtable.get_dependents("c") == []
+
+
+def test_symtable_generation():
+    symtable = SymbolTable({"x": None})
+    assert symtable.generation("x") == 0
+    symtable["x"] = None
+    symtable["y"] = None
+    assert symtable.generation("x") == 1
+    assert symtable.generation("y") == 0
+
+
+def test_get_referred_variable_in_shards(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt111 = GET network-traffic
+                         FROM file://{nt_stix_bundles[0]}
+                         WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+
+        # split the IN list of all src_port into sub-queries
+        s.config["stixquery"]["max_in_list_size"] = 1
+        stmt2 = f"""
+                 nt112 = GET network-traffic
+                         FROM file://{nt_stix_bundles[1]}
+                         WHERE src_port = nt111.src_port
+                 """
+        s.execute(stmt2)
+
+        nt112 = s.get_variable("nt112")
+        assert len(nt112) == 4
+
+
+def test_get_referred_variable_in_shards_limit(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt111 = GET network-traffic
+                         FROM file://{nt_stix_bundles[0]}
+                         WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+
+        # the limit applies to the union of the sub-queries
+        s.config["stixquery"]["max_in_list_size"] = 1
+        s.config["prefetch"]["switch_per_command"]["get"] = False
+        stmt2 = f"""
+                 nt112 = GET network-traffic
+                         FROM file://{nt_stix_bundles[1]}
+                         WHERE src_port = nt111.src_port
+                         LIMIT 2
+                 """
+        s.execute(stmt2)
+
+        nt112 = s.get_variable("nt112")
+        assert len(nt112) == 2
+
+
+def test_entity_id_attribute(proc_bundle_file):
+    with Session() as s:
+        stmt = f"""
+                procs = GET process
+                        FROM file://{proc_bundle_file}
+                        WHERE name = 'svchost.exe'
+                """
+        s.execute(stmt)
+        procs = s.symtable["procs"]
+        assert procs.entity_id_attribute == "pid"
+
+        # memoized: no store access
+        store, procs.store = procs.store, None
+        assert procs.entity_id_attribute == "pid"
+        procs.store = store
+
+
+def test_lazy_variable_statistics(proc_bundle_file):
+    with Session() as s:
+        s.config["session"]["show_execution_summary"] = False
+        stmt = f"""
+                procs = GET process
+                        FROM file://{proc_bundle_file}
+                        WHERE name = 'svchost.exe'
+                """
+        s.execute(stmt)
+
+        # snapshot when bound in the symbol table
+        procs = s.symtable["procs"]
+        assert procs._length == 704
+        assert procs._records_count is not None
+
+        # statistics of intermediate variables are computed at first access
+        var = VarStruct(s.store, "procs", [], None, "process", [], None)
+        assert var._length is None
+        assert var._records_count is None
+        assert len(var) == 704
+        assert var.records_count == procs.records_count
+
+
+def test_get_independent_queries_ahead(monkeypatch, nt_stix_bundles):
+    # the file data source does not write to store in query()
+    monkeypatch.setattr(
+        DataSourceManager, "_is_thread_safe", staticmethod(lambda store: True)
+    )
+    query_threads = []
+    query_stores = []
+    query_shards = DataSourceManager._query_shards
+
+    def _query_shards(self, scheme, uri, patterns, session_id, store, limit):
+        query_threads.append(threading.current_thread())
+        query_stores.append(store)
+        return query_shards(self, scheme, uri, patterns, session_id, store, limit)
+
+    monkeypatch.setattr(DataSourceManager, "_query_shards", _query_shards)
+
+    with Session() as s:
+        stmt = f"""
+                nt1 = GET network-traffic
+                      FROM file://{nt_stix_bundles[0]}
+                      WHERE dst_ref.value = '192.168.56.112'
+                nt2 = GET network-traffic
+                      FROM file://{nt_stix_bundles[1]}
+                      WHERE dst_ref.value = '192.168.56.112'
+                nt3 = GET network-traffic
+                      WHERE dst_port = nt1.dst_port
+                """
+        s.execute(stmt)
+        assert len(s.get_variable("nt1")) == 4
+        assert len(s.get_variable("nt2")) == 11
+        assert len(s.get_variable("nt3")) == 7
+
+        # nt1 and nt2 are queried ahead, nt3 depends on nt1
+        main_thread = threading.current_thread()
+        assert len(query_threads) == 3
+        assert query_threads[0] is not main_thread
+        assert query_threads[1] is not main_thread
+        assert query_threads[2] is main_thread
+
+        # background queries have their own store connections
+        assert query_stores[0] is not s.store
+        assert query_stores[1] is not s.store
+        assert query_stores[2] is s.store
+
+        # the default data source of nt3 is the last data source in order
+        assert s.data_source_manager.queried_data_sources[-1].endswith(
+            nt_stix_bundles[1].split("/")[-1]
+        )
+        assert s.data_source_manager._queries_ahead == {}
+
+
+def test_get_referred_variable_same_reference_twice(nt_stix_bundles):
+    with Session() as s:
+        stmt1 = f"""
+                 nt = GET network-traffic
+                      FROM file://{nt_stix_bundles[0]}
+                      WHERE dst_ref.value = '192.168.56.112'
+                 """
+        s.execute(stmt1)
+
+        # both attributes are dereferenced through src_ref
+        stmt2 = f"""
+                 ip = GET ipv4-addr
+                      FROM file://{nt_stix_bundles[0]}
+                      WHERE value = nt.src_ref.value OR id = nt.src_ref.id
+                 """
+        s.execute(stmt2)
+        assert len(s.get_variable("ip")) == 1
+
+        refs = [
+            Reference("nt", "src_ref.value"),
+            Reference("nt", "src_ref.id"),
+            Reference("nt", "dst_port"),
+        ]
+        deref, _ = make_batched_deref_funcs(s.store, s.symtable, refs)
+        deref_single = make_deref_func(s.store, s.symtable)
+        for ref in refs:
+            assert len(deref(ref)) == len(set(deref(ref)))
+            assert set(deref(ref)) == set(deref_single(ref))
@@ -2,8 +2,10 @@ import pytest
 import os
 import shutil
 
+import pandas as pd
+
 from kestrel.session import Session
-from kestrel.exceptions import MissingEntityType
+from kestrel.exceptions import EmptyInputData, MissingEntityType, NonUniformEntityType
 
 
 def test_load_full_csv():
@@ -61,6 +63,64 @@ def test_load_parquet_gz():
         assert v[0]["name"] == "reg.exe"
 
 
+@pytest.mark.parametrize(
+    "file_name",
+    [
+        "test_input_data_procs.csv",
+        "test_input_data_procs.json",
+        "test_input_data_procs.parquet.gz",
+    ],
+)
+def test_load_chunks(file_name):
+    data_file_path = os.path.join(
+        os.path.dirname(__file__), "../../../test-data/" + file_name
+    )
+    with Session() as s:
+        s.config["session"]["data_batch_size"] = 2
+        s.execute(f"newvar = LOAD {data_file_path}")
+        v = s.get_variable("newvar")
+        assert len(v) == 5
+        assert v[0]["type"] == "process"
+        assert v[0]["name"] == "reg.exe"
+
+
+def test_load_string_list_chunks_as_type():
+    data_file_path = os.path.join(
+        os.path.dirname(__file__), "../../../test-data/test_input_data_procs_list.json"
+    )
+    with Session() as s:
+        s.config["session"]["data_batch_size"] = 2
+        s.execute(f"newvar = LOAD {data_file_path} AS process")
+        v = s.get_variable("newvar")
+        assert sorted([i["name"] for i in v]) == ["cmd.exe", "explorer.exe", "reg.exe"]
+
+
+@pytest.mark.parametrize("file_name", ["mixed.csv", "mixed.json", "mixed.parquet"])
+def test_load_chunks_non_uniform_type(tmp_path, file_name):
+    data_file_path = tmp_path / file_name
+    df = pd.DataFrame(
+        [
+            {"type": "process", "name": "cmd.exe", "pid": 123},
+            {"type": "process", "name": "reg.exe", "pid": 456},
+            {"type": "file", "name": "a.txt", "pid": None},
+        ]
+    )
+    if file_name.endswith(".csv"):
+        df.to_csv(data_file_path, index=False)
+    elif file_name.endswith(".json"):
+        df.to_json(data_file_path, orient="records")
+    else:
+        df.to_parquet(data_file_path)
+    with Session() as s:
+        s.config["session"]["data_batch_size"] = 2
+        s.execute('newvar = NEW process ["explorer.exe"]')
+        with pytest.raises(NonUniformEntityType):
+            s.execute(f"newvar = LOAD {data_file_path}")
+        v = s.get_variable("newvar")
+        assert len(v) == 1
+        assert v[0]["name"] == "explorer.exe"
+
+
 def test_load_notype_json_to_fail():
     data_file_path = os.path.join(
         os.path.dirname(__file__), "../../../test-data/test_input_data_procs_no_type.json"
@@ -106,3 +166,23 @@ def test_load_string_list_as_type():
         assert v[0]["type"] == "process"
         assert v[0]["name"] in ["cmd.exe", "reg.exe", "explorer.exe"]
         assert sorted([i["name"] for i in v]) == ["cmd.exe", "explorer.exe", "reg.exe"]
+
+
+@pytest.mark.parametrize(
+    "file_name", ["blank.csv", "empty.csv", "empty.json", "empty.parquet"]
+)
+def test_load_empty_to_fail(tmp_path, file_name):
+    data_file_path = tmp_path / file_name
+    data = pd.DataFrame({"type": pd.Series([], dtype=str)})
+    if file_name == "blank.csv":
+        data_file_path.write_text("")
+    elif file_name.endswith(".csv"):
+        data.to_csv(data_file_path, index=False)
+    elif file_name.endswith(".json"):
+        data_file_path.write_text("[]")
+    else:
+        data.to_parquet(data_file_path)
+    with Session() as s:
+        with pytest.raises(EmptyInputData):
+            s.execute(f"newvar = LOAD {data_file_path}")
+        assert "newvar" not in s.symtable
@@ -1,6 +1,9 @@
+import csv
 import pytest
 import os
 
+import pandas as pd
+
 from kestrel.session import Session
 
 
@@ -58,3 +61,40 @@ def test_save_network_traffic_v4_v6(tmp_path, proc_bundle_file):
         )
         session.execute(f"SAVE conns TO {save_path}")
     assert save_path.exists()
+
+
+@pytest.mark.parametrize(
+    "file_name", ["procs.parquet", "procs.csv", "procs.csv.gz", "procs.json"]
+)
+def test_save_batches(tmp_path, proc_bundle_file, file_name):
+    save_path = tmp_path / file_name
+    with Session() as s:
+        s.config["session"]["data_batch_size"] = 100
+        s.execute(
+            f"""procs = GET process
+                        FROM file://{proc_bundle_file}
+                        WHERE [process:pid > 0]""",
+        )
+        procs = s.execute("DISP procs ATTR id, name, pid, parent_ref.pid")[0]
+        s.execute(f"SAVE procs TO {save_path}")
+        s.execute(f"newload = LOAD {save_path}")
+        newload = s.execute("DISP newload ATTR id, name, pid, parent_ref.pid")[0]
+        assert newload.to_dict()["data"] == procs.to_dict()["data"]
+
+
+def test_save_csv_quoting(tmp_path, fake_bundle_file):
+    # same as the CSV of all records by pandas before streaming
+    save_path = tmp_path / "conns.csv"
+    expected_path = tmp_path / "expected.csv"
+    with Session() as s:
+        s.config["session"]["data_batch_size"] = 7
+        s.execute(
+            f"""conns = GET network-traffic
+                        FROM file://{fake_bundle_file}
+                        WHERE [network-traffic:dst_port > 0]""",
+        )
+        s.execute(f"SAVE conns TO {save_path}")
+        pd.DataFrame(s.store.lookup("conns")).to_csv(
+            expected_path, index=False, quoting=csv.QUOTE_NONNUMERIC
+        )
+    assert save_path.read_text() == expected_path.read_text()
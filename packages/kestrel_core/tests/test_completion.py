@@ -8,6 +8,7 @@ from kestrel.syntax.utils import (
     AGG_FUNCS,
     TRANSFORMS,
     EXPRESSION_OPTIONS,
+    get_completion_index,
 )
 
 
@@ -130,7 +131,7 @@ def test_do_complete_disp(a_session, code, expected):
 #        ( "urls = GET url FROM stixshi", {"fter://"}),
 #        ( "urls = GET url FROM stixshifter://", {"thost101", "thost102", "thost103"}),
 #        ( "urls = GET url FROM stixshifter://thost", {"101", "102", "103"}),
-        ("urls = get url where ", []), # TODO: attribute completion
+        ("urls = get url where ", {"value"}),
         ("urls = get url where name = 'a' ", {"START"}),
         ("urls = get url where name = 'a' START 2022-01-01T00:00:00Z ", {"STOP"}),
     ],
@@ -196,7 +197,10 @@ def test_do_complete_cmd_apply(a_session, code, expected):
         ("grps = GR", {"OUP"}),
         ("grps = GROUP ", {"conns", "_"}),
         ("grps = GROUP conns ", {"BY"}),
-        ("grps = GROUP conns by ", {"BIN"}), # TODO: attribute completion
+        (
+            "grps = GROUP conns by ",
+            {"BIN", "dst_port", "dst_ref", "end", "id", "protocols", "src_port", "src_ref", "start"},
+        ),
     ],
 )
 def test_do_complete_cmd_group(a_session, code, expected):
@@ -255,3 +259,69 @@ def test_session_do_complete_timestamp(time_string, suffix_ts):
         script = f"x = GET p WHERE n = 'x' {time_string}"
         result = session.do_complete(script, len(script))
         assert result == suffix_ts
+
+
+def test_completion_index():
+    index = get_completion_index()
+    assert index is get_completion_index()
+    assert {"GET", "get", "FIND", "find"} <= index.keywords
+    assert set(index.relations) == set(all_relations)
+    assert KNOWN_ETYPES <= set(index.entity_types)
+    assert index.entity_attributes["process"] == ("x_unique_id", "pid")
+    with pytest.raises(TypeError):
+        index.entity_attributes["process"] = ("pid",)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "DISP conns ATTR ",
+        "SORT conns BY ",
+        "cs = conns WHERE ",
+        "cs = GROUP conns BY ",
+    ],
+)
+def test_do_complete_attribute(a_session, code):
+    result = a_session.do_complete(code, len(code))
+    assert {"dst_port", "src_port", "src_ref", "dst_ref"} <= set(result)
+
+
+def test_do_complete_attribute_prefix(a_session):
+    code = "DISP conns ATTR src_"
+    result = a_session.do_complete(code, len(code))
+    assert set(result) == {"port", "ref"}
+
+
+def test_do_complete_attribute_get(a_session):
+    code = "ps = GET process FROM file://x.json WHERE "
+    result = a_session.do_complete(code, len(code))
+    assert {"pid", "x_unique_id"} <= set(result)
+
+
+def test_do_complete_attribute_cached(a_session):
+    code = "DISP conns ATTR "
+    result = a_session.do_complete(code, len(code))
+
+    def no_sql(*args, **kwargs):
+        raise AssertionError("attribute cache not used")
+
+    a_session.store.columns = no_sql
+    a_session.store.run_query = no_sql
+    assert a_session.do_complete(code, len(code)) == result
+
+
+def test_attribute_cache_invalidated(a_session):
+    var = a_session.symtable["conns"]
+    assert "dst_port" in var.attributes
+    a_session.execute('x = NEW ipv4-addr ["1.2.3.4"]')
+    assert var._attributes is None
+
+
+def test_do_complete_parse_cache_used(a_session):
+    code = "x = conns WHERE dst_port = 22\nDISP "
+    misses = a_session.parse_cache.misses
+    hits = a_session.parse_cache.hits
+    a_session.do_complete(code, len(code))
+    assert a_session.parse_cache.misses == misses + 1
+    a_session.do_complete(code, len(code))
+    assert a_session.parse_cache.hits == hits + 1
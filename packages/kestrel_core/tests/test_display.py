@@ -1,5 +1,6 @@
 import pytest
 import json
+import os
 
 from kestrel.session import Session
 
@@ -84,3 +85,29 @@ exp = GET process from newvar WHERE [process:name = 'explorer.exe']
     output_dict = d[0].to_dict()
     del output_dict["data"]["execution time"]
     assert output_dict == correct_dict
+
+
+def test_display_block_summary_related_records():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    bundle = os.path.join(cwd, "../../../test-data/doctored-1k.json")
+    with Session() as s:
+        stmt = f"""
+conns = GET network-traffic
+        FROM file://{bundle}
+        WHERE src_ref.value = '127.0.0.1'
+"""
+        d = s.execute(stmt)
+    assert d[0].to_dict()["data"]["variables updated"] == [
+        {
+            "VARIABLE": "conns",
+            "TYPE": "network-traffic",
+            "#(ENTITIES)": 193,
+            "#(RECORDS)": 203,
+            "directory*": 147,
+            "file*": 147,
+            "ipv4-addr*": 210,
+            "network-traffic*": 10,
+            "process*": 203,
+            "user-account*": 203,
+        }
+    ]
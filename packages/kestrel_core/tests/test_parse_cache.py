@@ -0,0 +1,113 @@
+import pytest
+from lark import UnexpectedToken
+from lark.exceptions import LarkError
+
+from kestrel.syntax.cache import ParseCache
+from kestrel.syntax.parser import parse_kestrel
+
+
+HUNTFLOW = """
+# a comment line
+procs = GET process FROM stixshifter://edr
+        WHERE name = 'cmd.exe'
+        START 2021-01-01T00:00:00Z STOP 2022-01-01T00:00:00Z
+parents = FIND process CREATED procs
+DISP parents ATTR name, pid
+"""
+
+
+def _simplify(ast):
+    # ECGP objects do not have __eq__, compare their string forms
+    return [{k: str(v) for k, v in stmt.items()} for stmt in ast]
+
+
+def test_parse_same_as_parser():
+    cache = ParseCache()
+    assert _simplify(cache.parse(HUNTFLOW)) == _simplify(parse_kestrel(HUNTFLOW))
+    assert cache.misses == 3
+    assert cache.hits == 0
+
+
+def test_reparse_hits():
+    cache = ParseCache()
+    cache.parse(HUNTFLOW)
+    ast = cache.parse(HUNTFLOW + "\nINFO procs")
+    assert cache.hits == 3
+    assert cache.misses == 4
+    assert [stmt["command"] for stmt in ast] == ["get", "find", "disp", "info"]
+
+
+def test_return_copies():
+    cache = ParseCache()
+    ast = cache.parse(HUNTFLOW)
+    ast[0]["output"] = "modified"
+    ast[0]["where"].add_center_entity("process")
+    ast = cache.parse(HUNTFLOW)
+    assert ast[0]["output"] == "procs"
+    assert ast[0]["where"].center_entity_type is None
+
+
+def test_lru_eviction():
+    cache = ParseCache(2)
+    cache.parse("DISP a")
+    cache.parse("DISP b")
+    cache.parse("DISP a")
+    cache.parse("DISP c")
+    assert len(cache) == 2
+    cache.parse("DISP a")
+    assert cache.hits == 2
+    cache.parse("DISP b")
+    assert cache.misses == 4
+
+
+def test_default_variable_in_key():
+    cache = ParseCache()
+    stmt = "GET url FROM udi://all WHERE value LIKE '%'"
+    assert cache.parse(stmt, "x")[0]["output"] == "x"
+    assert cache.parse(stmt)[0]["output"] == "_"
+
+
+def test_statement_split_fallback():
+    # the second line looks like a statement start but is not
+    huntflow = "y = GET process FROM udi://all WHERE\nname = 'cmd.exe'"
+    cache = ParseCache()
+    ast = cache.parse(huntflow)
+    assert len(ast) == 1
+    assert ast[0]["output"] == "y"
+
+
+def test_syntax_error_position():
+    cache = ParseCache()
+    with pytest.raises(UnexpectedToken) as e:
+        cache.parse("DISP a\nDISP b\nINFO b c")
+    assert e.value.line == 3
+
+
+def test_relative_timespan_not_cached():
+    cache = ParseCache()
+    stmt = "y = GET process FROM udi://all WHERE pid = 1 LAST 5 MINUTES"
+    cache.parse(stmt)
+    cache.parse(stmt)
+    assert cache.hits == 0
+    assert len(cache) == 0
+
+
+def test_parse_tail():
+    cache = ParseCache()
+    cache.parse("a = GET process FROM udi://all WHERE pid = 1")
+    with pytest.raises(UnexpectedToken):
+        cache.parse_tail("a = GET process FROM udi://all WHERE pid = 1\nDISP ")
+    assert cache.hits == 1
+
+
+def test_parse_tail_not_cached():
+    cache = ParseCache()
+    stmt = "a = GET process FROM udi://all WHERE pid = 1"
+    for i in range(1, len(stmt) + 1):
+        try:
+            cache.parse_tail(stmt[:i])
+        except LarkError:
+            pass
+    assert len(cache) == 0
+    assert cache.parse_tail(stmt)[0]["output"] == "a"
+    assert len(cache) == 0
@@ -3,7 +3,12 @@ from datetime import datetime, timedelta, timezone
 from lark import UnexpectedToken
 import pytest
 
-from kestrel.syntax.parser import parse_kestrel, parse_ecgpattern
+from kestrel.syntax.parser import (
+    parse_kestrel,
+    parse_ecgpattern,
+    get_kestrel_parser,
+    get_ecgpattern_parser,
+)
 from kestrel.syntax.ecgpattern import Reference
 from kestrel.exceptions import InvalidECGPattern
 from firepit.timestamp import timefmt
@@ -152,6 +157,60 @@ def test_ecgp(ecgp, center_entity, stix):
     assert pattern.to_stix(None, None) == stix
 
 
+@pytest.mark.parametrize(
+    "ecgp, stix_shards",
+    [
+        (
+            "pid IN (1, 2)",
+            ["[process:pid IN (1,2)]"],
+        ),
+        (
+            "pid IN (1, 2, 3)",
+            ["[process:pid IN (1,2)]", "[process:pid IN (3)]"],
+        ),
+        (
+            "pid NOT IN (1, 2, 3)",
+            ["[process:pid NOT IN (1,2,3)]"],
+        ),
+        (
+            "name = 'a' AND pid IN (1, 2, 3)",
+            [
+                "[(process:name = 'a' AND process:pid IN (1,2))]",
+                "[(process:name = 'a' AND process:pid IN (3))]",
+            ],
+        ),
+        (
+            "name = 'a' OR pid IN (1, 2, 3)",
+            [
+                "[(process:name = 'a' OR process:pid IN (1,2))]",
+                "[(process:name = 'a' OR process:pid IN (3))]",
+            ],
+        ),
+        (
+            "ppid IN (4, 5, 6, 7) AND pid IN (1, 2, 3)",
+            [
+                "[(process:ppid IN (4,5) AND process:pid IN (1,2,3))]",
+                "[(process:ppid IN (6,7) AND process:pid IN (1,2,3))]",
+            ],
+        ),
+    ],
+)
+def test_ecgp_shards(ecgp, stix_shards):
+    pattern = parse_ecgpattern(ecgp)
+    pattern.add_center_entity("process")
+    assert pattern.to_stix_shards(None, None, 2, 16) == stix_shards
+
+
+def test_ecgp_shards_capped():
+    pattern = parse_ecgpattern(f"pid IN ({', '.join(map(str, range(10)))})")
+    pattern.add_center_entity("process")
+    assert pattern.to_stix_shards(None, None, 2, 3) == [
+        "[process:pid IN (0,1,2,3)]",
+        "[process:pid IN (4,5,6,7)]",
+        "[process:pid IN (8,9)]",
+    ]
+
+
 @pytest.mark.parametrize(
     "outvar, sco_type, ds, pat",
     [
@@ -354,3 +413,35 @@ def test_describe_simple():
     assert result["command"] == "describe"
     assert result["input"] == "foo"
     assert result["attribute"] == "bar"
+
+
+def test_parser_built_once():
+    assert get_kestrel_parser() is get_kestrel_parser()
+    assert get_ecgpattern_parser() is get_ecgpattern_parser()
+    assert get_kestrel_parser("x") is not get_kestrel_parser()
+    assert get_kestrel_parser("x") is get_kestrel_parser("x")
+
+
+def test_parser_default_variable_isolated():
+    stmt = "GET url FROM udi://all WHERE value LIKE '%'"
+    assert parse_kestrel(stmt, "x")[0]["output"] == "x"
+    assert parse_kestrel(stmt)[0]["output"] == "_"
+
+
+def test_parser_reused_across_statements(monkeypatch):
+    # a 200-statement huntflow is parsed without building any parser
+    huntflow = [
+        f"""p{i} = GET process FROM stixshifter://edr WHERE name = 'cmd{i}.exe'"""
+        if i % 2 == 0
+        else f"c{i} = FIND process CREATED p{i-1} WHERE pid > {i}"
+        for i in range(200)
+    ]
+    parser = get_kestrel_parser()
+
+    def build(*args, **kwargs):
+        raise AssertionError("parser built again")
+
+    monkeypatch.setattr("kestrel.syntax.parser.Lark", build)
+    for stmt in huntflow:
+        assert parse_kestrel(stmt)
+    assert get_kestrel_parser() is parser
@@ -0,0 +1,187 @@
+import datetime
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from kestrel.codegen.relations import (
+    _get_process_identification_rules,
+    _search_for_potential_identical_process,
+)
+from kestrel.config import load_default_config
+
+_logger = logging.getLogger(__name__)
+
+COLUMNS = ["id", "pid", "name", "ppid", "first_observed", "last_observed"]
+T0 = pd.Timestamp("2024-01-01T00:00:00Z")
+
+
+@pytest.fixture
+def config():
+    return load_default_config()["prefetch"]["process_identification"]
+
+
+def _identical_process_check(fil_row, ref_row, config):
+    # the nested loop check before vectorization
+    def offset(name):
+        return datetime.timedelta(seconds=config[name])
+
+    fil_pname, fil_ppid, fil_start_time, fil_end_time = fil_row
+    ref_pname, ref_ppid, ref_start_time, ref_end_time = ref_row
+    return bool(
+        (
+            fil_pname
+            and fil_ppid
+            and fil_pname == ref_pname
+            and fil_ppid == ref_ppid
+            and fil_start_time
+            > ref_start_time + offset("pid_and_name_and_ppid_time_begin_offset")
+            and fil_start_time
+            < ref_end_time + offset("pid_and_name_and_ppid_time_end_offset")
+        )
+        or (
+            fil_pname
+            and fil_pname == ref_pname
+            and fil_start_time
+            > ref_start_time + offset("pid_and_name_time_begin_offset")
+            and fil_start_time < ref_end_time + offset("pid_and_name_time_end_offset")
+        )
+        or (
+            fil_ppid
+            and fil_ppid == ref_ppid
+            and fil_start_time
+            > ref_start_time + offset("pid_and_ppid_time_begin_offset")
+            and fil_start_time < ref_end_time + offset("pid_and_ppid_time_end_offset")
+        )
+        or (
+            fil_start_time
+            > ref_start_time + offset("pid_but_name_changed_time_begin_offset")
+            and fil_start_time
+            < ref_end_time + offset("pid_but_name_changed_time_end_offset")
+        )
+        or (
+            fil_end_time
+            > ref_start_time + offset("pid_but_name_changed_time_begin_offset")
+            and fil_end_time
+            < ref_end_time + offset("pid_but_name_changed_time_end_offset")
+        )
+    )
+
+
+def _search_loop(ref_procs, fil_procs, config):
+    ref_rows = ref_procs.to_dict("records")
+    matched = []
+    for fil in fil_procs.to_dict("records"):
+        for ref in ref_rows:
+            if fil["pid"] == ref["pid"] and _identical_process_check(
+                (fil["name"], fil["ppid"], fil["first_observed"], fil["last_observed"]),
+                (ref["name"], ref["ppid"], ref["first_observed"], ref["last_observed"]),
+                config,
+            ):
+                matched.append(fil["id"])
+                break
+    return matched
+
+
+def _make_procs(records):
+    # records: (id, pid, name, ppid, first_observed, last_observed) with the
+    # times in seconds after T0
+    procs = pd.DataFrame(records, columns=COLUMNS, dtype=object)
+    for column in ("first_observed", "last_observed"):
+        procs[column] = T0 + pd.to_timedelta(procs[column].astype(float), unit="s")
+    return procs
+
+
+def _random_procs(rng, size, prefix, pids, seconds):
+    start = rng.integers(0, seconds, size)
+    return _make_procs(
+        {
+            "id": [f"process--{prefix}{i}" for i in range(size)],
+            "pid": rng.integers(1, pids, size).tolist(),
+            "name": rng.choice(["cmd.exe", "svchost.exe", "", None], size).tolist(),
+            "ppid": rng.choice([1, 4, 0, None], size).tolist(),
+            "first_observed": start,
+            "last_observed": start + rng.integers(0, seconds // 10, size),
+        }
+    )
+
+
+def _search(ref_procs, fil_procs, config):
+    rules = _get_process_identification_rules(config)
+    return list(
+        _search_for_potential_identical_process(ref_procs, fil_procs, rules)["id"]
+    )
+
+
+@pytest.mark.parametrize(
+    "pid, name, ppid, first_observed, last_observed, matched",
+    [
+        # name changed: same pid within 5 seconds of the reference window
+        (7, "sh", 2, 4, 10800, True),
+        (7, "sh", 2, -4, -4, True),
+        # strict bounds: exactly at the begin/end of the window
+        (7, "sh", 2, -5, -5, False),
+        (7, "sh", 2, 5, 10800, False),
+        # name changed: last observed in the window
+        (7, "sh", 2, -10800, 1, True),
+        # same pid and name within an hour
+        (7, "bash", 2, 3599, 10800, True),
+        (7, "bash", 2, 3600, 10800, False),
+        # same pid, name, and ppid within a day
+        (7, "bash", 1, 86399, 90000, True),
+        (7, "bash", 1, 86400, 90000, False),
+        # attributes should be truthy to match
+        (7, "", 0, 1800, 10800, False),
+        # different pid
+        (8, "bash", 1, 0, 0, False),
+    ],
+)
+def test_search_identical_process(
+    config, pid, name, ppid, first_observed, last_observed, matched
+):
+    ref_procs = _make_procs([("r", 7, "bash", 1, 0, 0)])
+    fil_procs = _make_procs([("a", pid, name, ppid, first_observed, last_observed)])
+    expected = ["a"] if matched else []
+    assert _search_loop(ref_procs, fil_procs, config) == expected
+    assert _search(ref_procs, fil_procs, config) == expected
+
+
+def test_search_identical_process_same_as_loop(config):
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        ref_procs = _random_procs(rng, 30, "r", 10, 20000)
+        fil_procs = _random_procs(rng, 300, "f", 10, 20000)
+        assert sorted(_search(ref_procs, fil_procs, config)) == sorted(
+            _search_loop(ref_procs, fil_procs, config)
+        )
+
+
+def test_search_identical_process_benchmark(config):
+    # two-pass search of 500k prefetched records as in FIND after prefetch
+    rng = np.random.default_rng(0)
+    ref_procs = _random_procs(rng, 1000, "r", 50000, 864000)
+    fil_procs = _random_procs(rng, 500000, "f", 50000, 864000)
+
+    start = time.perf_counter()
+    anchors = _search_for_potential_identical_process(
+        ref_procs, fil_procs, _get_process_identification_rules(config)
+    )
+    matched = _search_for_potential_identical_process(
+        anchors, fil_procs, _get_process_identification_rules(config)
+    )
+    elapsed = time.perf_counter() - start
+    _logger.info(
+        f"{len(matched)} of {len(fil_procs)} records matched in {elapsed:.2f} seconds"
+    )
+
+    # the results of a sample of the searched records are the same as the
+    # loop, which only compares records with the same pid
+    pids = set(ref_procs["pid"][:100])
+    sample = fil_procs[fil_procs["pid"].isin(pids)]
+    sample_anchors = anchors[anchors["pid"].isin(pids)]
+    assert set(_search_loop(ref_procs, sample, config)) == set(sample_anchors["id"])
+    assert set(_search_loop(sample_anchors, sample, config)) == set(
+        matched["id"]
+    ) & set(sample["id"])
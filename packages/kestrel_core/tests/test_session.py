@@ -1,6 +1,7 @@
 import json
 import os
 import pytest
+import re
 import pathlib
 import shutil
 import tempfile
@@ -37,6 +38,12 @@ def fake_bundle_3():
     return os.path.join(cwd, "../../../test-data/test_bundle_3.json")
 
 
+@pytest.fixture
+def proc_bundle_file():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(cwd, "../../../test-data/doctored-1k.json")
+
+
 @pytest.fixture
 def cbcloud_powershell_bundle():
     cwd = os.path.dirname(os.path.abspath(__file__))
@@ -327,3 +334,166 @@ def test_where_deref_process(cbcloud_powershell_bundle):
         y = session.get_variable("y")
         assert len(y) == 1
         assert y[0]["parent_ref.x_unique_id"] == "MYORGIDX-02629f16-00000608-00000000-1d71d10a09cc7c4"
+
+
+def test_materialized_views(fake_bundle_file):
+    with Session() as session:
+        session.config["materialization"]["min_references"] = 2
+        session.config["materialization"]["min_cost"] = 0
+        execute(
+            session,
+            f"""conns = get network-traffic
+            from file://{fake_bundle_file}
+            where [network-traffic:dst_port < 10000]""",
+        )
+        execute(session, "c2 = SORT conns BY dst_port ASC")
+        execute(session, "c3 = conns WHERE dst_port = 22")
+        expected = session.execute("DISP c2 ATTR dst_port")[0].dataframe
+
+        # conns and c2 used twice: promoted to indexed tables
+        execute(session, "DISP c2 ATTR dst_port")
+        assert "conns" in session.materialized_views
+        assert "c2" in session.materialized_views
+        viewdef = session.store._get_view_def("c2")
+        assert re.fullmatch(r'SELECT \* FROM "__mv_c2_\w+" ORDER BY "dst_port" ASC', viewdef)
+        out = session.execute("DISP c2 ATTR dst_port")[0].dataframe
+        assert out.equals(expected)
+
+        # no more budget: least recently used conns evicted for c3
+        budget = session.materialized_views.disk_usage / 2**20
+        session.config["materialization"]["disk_budget"] = budget
+        execute(session, "DISP c3")
+        execute(session, "DISP c3")
+        assert "c3" in session.materialized_views
+        assert "conns" not in session.materialized_views
+        assert "c2" in session.materialized_views
+        assert session.materialized_views.evictions == 1
+        assert "__mv_conns" not in session.store._get_view_def("conns")
+        assert len(session.get_variable("conns")) == 100
+
+        # reassigned variable is restored before redefined
+        execute(session, "c3 = c3 WHERE src_port > 0")
+        assert "c3" not in session.materialized_views
+        assert all(c["dst_port"] == 22 for c in session.get_variable("c3"))
+
+        # views of dependent variables are restored with the reassigned view
+        execute(session, "conns = conns WHERE dst_port = 22")
+        assert "c2" not in session.materialized_views
+        assert all(c["dst_port"] == 22 for c in session.get_variable("c2"))
+
+        # new data in the store drops all tables
+        execute(session, 'x = NEW ipv4-addr ["1.2.3.4"]')
+        assert len(session.materialized_views) == 0
+        assert not [t for t in session.store.tables() if t.startswith("__mv_")]
+
+
+def test_index_advisor(fake_bundle_file):
+    with Session() as session:
+        execute(
+            session,
+            f"""conns = get network-traffic
+            from file://{fake_bundle_file}
+            where [network-traffic:dst_port < 10000]""",
+        )
+        indexes = session.index_advisor.indexes
+        assert ("target_ref", "source_ref") in indexes["__contains"]
+        assert ("query_id", "sco_id") in indexes["__queries"]
+        assert ("src_ref",) in indexes["network-traffic"]
+        assert ("value",) in indexes["ipv4-addr"]
+
+        # indexes created once
+        session.index_advisor.advise()
+        assert len(indexes["__contains"]) == 2
+
+        out = session.execute("INFO conns")
+        store_indexes = out[0].to_dict()["data"]["Store Indexes"]
+        assert "network-traffic (src_ref)" in store_indexes
+        assert "__contains (target_ref, source_ref)" in store_indexes
+        assert "ipv4-addr (value)" not in store_indexes
+
+        execute(session, "ips = FIND ipv4-addr LINKED conns")
+        assert len(session.get_variable("ips")) > 0
+
+
+@pytest.fixture
+def shared_store_path(tmp_path):
+    store_path = tmp_path / "shared.db"
+    config_file = tmp_path / "kestrel.yaml"
+    os.environ["KESTREL_CONFIG"] = str(config_file.expanduser().resolve())
+    with open(config_file, "w") as cf:
+        cf.write(f'shared_store:\n  path: "{store_path}"\n')
+    yield store_path
+    del os.environ["KESTREL_CONFIG"]
+
+
+def test_shared_store(shared_store_path, fake_bundle_file, proc_bundle_file):
+    def count_records(session):
+        return {
+            table: session.store.count(table)
+            for table in ("observed-data", "__contains", "network-traffic", "process")
+        }
+
+    get_conns = f"""conns = get network-traffic
+            from file://{fake_bundle_file}
+            where [network-traffic:dst_port < {{}}]"""
+
+    # processes without identifying attributes get random ids at ingestion
+    get_procs = f"""procs = get process
+            from file://{proc_bundle_file}
+            where [process:name = 'svchost.exe']"""
+
+    with Session() as s1, Session() as s2:
+        execute(s1, get_conns.format(10000))
+        execute(s1, get_procs)
+        records = count_records(s1)
+
+        # same records ingested again by another session: not duplicated
+        execute(s2, get_conns.format(100))
+        execute(s2, get_procs)
+        assert count_records(s2) == records
+        assert len(s2.get_variable("procs")) == len(s1.get_variable("procs"))
+
+        # variables of the same name isolated in each session
+        assert len(s1.get_variable("conns")) == 100
+        assert len(s2.get_variable("conns")) == 38
+        execute(s2, "c2 = conns WHERE dst_port = 22")
+        assert "c2" in s2.store.views()
+        assert "c2" not in s1.store.views()
+
+        s1.config["materialization"]["min_references"] = 1
+        s1.config["materialization"]["min_cost"] = 0
+        execute(s1, "DISP conns")
+        assert "conns" in s1.materialized_views
+
+    # data persisted without variables of the closed sessions
+    assert shared_store_path.exists()
+    with Session() as s3:
+        assert count_records(s3) == records
+        assert s3.store.views() == []
+        tables = s3.store.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        assert "__idsets" not in [t["name"] for t in tables]
+        assert not [t for t in tables if t["name"].startswith("__mv_")]
+
+
+def test_shared_store_identical_observations(shared_store_path, fake_bundle_file):
+    # the same event twice in a bundle: two records
+    with open(fake_bundle_file) as f:
+        bundle = json.load(f)
+    observations = [o for o in bundle["objects"] if o["type"] == "observed-data"]
+    duplicate_id = "observed-data--00000000-0000-4000-8000-000000000000"
+    bundle["objects"].append(dict(observations[0], id=duplicate_id))
+    bundle_file = shared_store_path.parent / "bundle.json"
+    with open(bundle_file, "w") as f:
+        json.dump(bundle, f)
+
+    get_conns = f"""conns = get network-traffic
+            from file://{bundle_file}
+            where [network-traffic:dst_port > 0]"""
+
+    with Session() as s:
+        execute(s, get_conns)
+        assert s.store.count("observed-data") == len(observations) + 1
+        execute(s, get_conns)
+        assert s.store.count("observed-data") == len(observations) + 1